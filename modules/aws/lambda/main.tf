@@ -1,5 +1,16 @@
+locals {
+  # manage_layers = false（既定）の場合、レイヤーは作成時のみ設定し以降の変更は無視する（コンソール等での付け替えを維持）
+  # true の場合はTerraformがレイヤーのバージョン更新まで管理する
+  unmanaged_layer_functions = var.manage_layers ? {} : var.lambda_functions
+  managed_layer_functions   = var.manage_layers ? var.lambda_functions : {}
+  function_arns = merge(
+    { for k, v in aws_lambda_function.it : k => v.arn },
+    { for k, v in aws_lambda_function.managed_layers : k => v.arn }
+  )
+}
+
 resource "aws_lambda_function" "it" {
-  for_each = var.lambda_functions
+  for_each = local.unmanaged_layer_functions
 
   function_name = format("%s-%s-function", var.product, each.key)
   role          = aws_iam_role.it[each.key].arn
@@ -14,6 +25,7 @@ resource "aws_lambda_function" "it" {
   publish                        = each.value.publish
   reserved_concurrent_executions = each.value.reserved_concurrent_executions
   memory_size                    = each.value.memory_size
+  layers                         = each.value.layers
   ephemeral_storage {
     size = each.value.size
   }
@@ -40,6 +52,49 @@ resource "aws_lambda_function" "it" {
   }
 }
 
+# manage_layers = true の場合の関数（layersをignore_changesに含めない）
+resource "aws_lambda_function" "managed_layers" {
+  for_each = local.managed_layer_functions
+
+  function_name = format("%s-%s-function", var.product, each.key)
+  role          = aws_iam_role.it[each.key].arn
+  description   = each.value.description
+  runtime       = each.value.image_uri != null ? null : each.value.runtime
+  filename      = each.value.image_uri == null ? try(each.value.filename) : null
+  handler       = each.value.image_uri == null ? each.value.handler : null
+  timeout       = each.value.timeout
+  # image_uriはpackage_typeがImageの場合のみ設定
+  image_uri                      = each.value.image_uri != null ? each.value.image_uri : null
+  package_type                   = each.value.image_uri != null ? "Image" : "Zip"
+  publish                        = each.value.publish
+  reserved_concurrent_executions = each.value.reserved_concurrent_executions
+  memory_size                    = each.value.memory_size
+  layers                         = each.value.layers
+  ephemeral_storage {
+    size = each.value.size
+  }
+  
+  dynamic "environment" {
+    for_each = length(each.value.environment_variables) > 0 ? [each.value.environment_variables] : []
+    content {
+      variables = environment.value
+    }
+  }
+  
+  tags = {
+    Name      = "${var.product}-${each.key}"
+    ManagedBy = "terraform"
+  }
+
+  depends_on = [aws_cloudwatch_log_group.it]
+
+  lifecycle {
+    ignore_changes = [
+      image_uri
+    ]
+  }
+}
+
 resource "aws_cloudwatch_log_group" "it" {
   for_each = var.lambda_functions
 
@@ -134,7 +189,7 @@ resource "aws_lambda_event_source_mapping" "it" {
 
   # 各 SQS キューの ARN を取得
   event_source_arn = module.sqs_queues[each.key].arn[each.key]
-  function_name    = aws_lambda_function.it[each.key].arn
+  function_name    = local.function_arns[each.key]
 
   depends_on = [
 
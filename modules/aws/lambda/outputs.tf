@@ -1,4 +1,4 @@
 output "arns" {
-  value       = { for k, v in aws_lambda_function.it : k => v.arn }
+  value       = local.function_arns
   description = "各Lambda関数のARN"
 }
\ No newline at end of file
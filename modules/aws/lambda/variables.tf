@@ -9,6 +9,12 @@ variable "environment" {
   default     = null
 }
 
+variable "manage_layers" {
+  description = "trueの場合、Lambdaレイヤーの変更をTerraformで管理する（falseは作成時のみ設定し、以降の変更を無視）"
+  type        = bool
+  default     = false
+}
+
 variable "lambda_functions" {
   description = "Lambda関数の設定をマップで定義します"
   type = map(object({
@@ -23,6 +29,7 @@ variable "lambda_functions" {
     publish                        = optional(bool, false)                                    # Lambda関数の公開設定
     reserved_concurrent_executions = optional(number, -1)                                     # Lambda関数の予約済みの同時実行数
     need_sqs_trigger               = optional(bool, false)
+    layers                         = optional(list(string), [])                               # Lambdaレイヤー（バージョン付きARN）のリスト
     iam_policies = optional(list(object({
       effect    = string       # IAMポリシーの効果（AllowまたはDeny）
       actions   = list(string) # 許可するアクションのリスト
@@ -41,5 +41,21 @@ module "dynamodb" {
         }
       }
     }
+
+    # Bedrock推奨文キャッシュ（プロンプト＋データセットバージョンのハッシュ単位、expiresAtで自動削除）
+    RecommendationCache = {
+      billing_mode  = "PAY_PER_REQUEST"
+      hash_key      = "cacheKey"
+      hash_key_type = "S"
+
+      attributes = [
+        { name = "cacheKey", type = "S" } # パーティションキー
+      ]
+
+      ttl = {
+        attribute_name = "expiresAt"
+        enabled        = true
+      }
+    }
   }
 }
\ No newline at end of file
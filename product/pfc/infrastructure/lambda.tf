@@ -1,7 +1,18 @@
+# 共通データアクセスレイヤー（build_and_deploy.sh で作成）
+resource "aws_lambda_layer_version" "shared" {
+  layer_name          = "${local.env.product}-shared-layer"
+  filename            = "../src/lambda/builds/pfc-shared-layer.zip"
+  source_code_hash    = filebase64sha256("../src/lambda/builds/pfc-shared-layer.zip")
+  compatible_runtimes = [local.lambda_common.runtime]
+  description         = "PFC shared modules (dynamodb_codec, spatial_index, pfc_data_access, spot_ranking, keyword_matcher, pfc_metrics)"
+}
+
 module "lambda_functions" {
   source = "../../../modules/aws/lambda"
 
   product = local.env.product
+  # 共通レイヤーはビルドごとに新しいバージョンになるため、関数への付け替えもTerraformで管理
+  manage_layers = true
   lambda_functions = {
     park-finder-chat = {
       filename    = "../src/lambda/builds/lambda_function.zip"
@@ -10,9 +21,16 @@ module "lambda_functions" {
       memory_size = 128
       timeout     = local.lambda_common.timeout
       description = "PFC Park Finder Chat Function"
+      layers      = [aws_lambda_layer_version.shared.arn]
 
       environment_variables = merge(local.lambda_common.environment_variables, {
-        BEDROCK_MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+        BEDROCK_MODEL_ID                 = "anthropic.claude-3-haiku-20240307-v1:0"
+        RECOMMENDATION_CACHE_TABLE       = local.recommendation_cache_table_name
+        RECOMMENDATION_CACHE_TTL_SECONDS = "86400"
+        SESSION_TTL_SECONDS              = "1800"
+        BEDROCK_PROMPT_TOKEN_BUDGET      = "300"
+        BEDROCK_LATENCY_BUDGET_MS        = "2500"
+        TRACE_SAMPLE_RATE                = "0.05"
       })
 
       additional_iam_policies = [
@@ -21,7 +39,8 @@ module "lambda_functions" {
         {
           effect = "Allow"
           actions = [
-            "bedrock:InvokeModel"
+            "bedrock:InvokeModel",
+            "bedrock:InvokeModelWithResponseStream"
           ]
           resources = ["arn:aws:bedrock:ap-northeast-1:*:model/anthropic.claude-3-haiku*"]
         }
@@ -35,17 +54,59 @@ module "lambda_functions" {
       memory_size = 512 # 東京全土対応で増強
       timeout     = 900 # 15分（最大）
       description = "PFC Parking Data Collector Function - Tokyo Wide"
+      layers      = [aws_lambda_layer_version.shared.arn]
 
       environment_variables = merge(local.lambda_common.environment_variables, {
         ENABLE_TOKYO_WIDE  = "true"
         MAX_PARALLEL_WARDS = "5"
         BATCH_SIZE         = "100"
         ENABLE_GEOHASH     = "true"
+        TRACE_SAMPLE_RATE  = "1"
+
+        RECOMMENDATION_CACHE_TABLE           = local.recommendation_cache_table_name
+        RECOMMENDATION_PREGENERATOR_FUNCTION = local.recommendation_pregenerator
       })
 
       additional_iam_policies = [
         local.lambda_common.dynamodb_permissions,
-        local.lambda_common.cloudwatch_permissions
+        local.lambda_common.cloudwatch_permissions,
+        local.lambda_common.snapshot_write_permissions,
+        {
+          effect    = "Allow"
+          actions   = ["lambda:InvokeFunction"]
+          resources = ["arn:aws:lambda:${local.env.region}:${local.env.account_id}:function:${local.recommendation_pregenerator}"]
+        }
+      ]
+    }
+
+    # 収集完了後にチャット推奨文を事前生成（チャット関数と同じパッケージの別ハンドラー）
+    recommendation-pregenerator = {
+      filename    = "../src/lambda/builds/lambda_function.zip"
+      handler     = "park-finder-chat.pregenerate_handler"
+      runtime     = local.lambda_common.runtime
+      memory_size = 256
+      timeout     = 900
+      description = "PFC Recommendation Pregenerator Function"
+      layers      = [aws_lambda_layer_version.shared.arn]
+
+      environment_variables = merge(local.lambda_common.environment_variables, {
+        BEDROCK_MODEL_ID                   = "anthropic.claude-3-haiku-20240307-v1:0"
+        RECOMMENDATION_CACHE_TABLE         = local.recommendation_cache_table_name
+        PREGENERATE_MAX_WORKERS            = "4"
+        PREGENERATE_WARD_COUNT             = "8"
+        PREGENERATED_REUSE_MAX_AGE_SECONDS = "3600"
+      })
+
+      additional_iam_policies = [
+        local.lambda_common.dynamodb_permissions,
+        local.lambda_common.cloudwatch_permissions,
+        {
+          effect = "Allow"
+          actions = [
+            "bedrock:InvokeModel"
+          ]
+          resources = ["arn:aws:bedrock:ap-northeast-1:*:model/anthropic.claude-3-haiku*"]
+        }
       ]
     }
 
@@ -56,13 +117,34 @@ module "lambda_functions" {
       memory_size = 128
       timeout     = 30
       description = "PFC Parking Spots API Function"
+      layers      = [aws_lambda_layer_version.shared.arn]
 
-      environment_variables = local.lambda_common.environment_variables
+      environment_variables = merge(local.lambda_common.environment_variables, {
+        TRACE_SAMPLE_RATE = "0.05"
+      })
 
       additional_iam_policies = [
         local.lambda_common.dynamodb_permissions,
-        local.lambda_common.cloudwatch_permissions
+        local.lambda_common.cloudwatch_permissions,
+        local.lambda_common.snapshot_read_permissions
       ]
     }
   }
-}
\ No newline at end of file
+}
+
+# manage_layers = true への切り替えで関数のリソースアドレスが変わるため、既存の関数を引き継ぐ
+# （recommendation-pregeneratorは新規作成のため対象外）
+moved {
+  from = module.lambda_functions.aws_lambda_function.it["park-finder-chat"]
+  to   = module.lambda_functions.aws_lambda_function.managed_layers["park-finder-chat"]
+}
+
+moved {
+  from = module.lambda_functions.aws_lambda_function.it["parking-data-collector"]
+  to   = module.lambda_functions.aws_lambda_function.managed_layers["parking-data-collector"]
+}
+
+moved {
+  from = module.lambda_functions.aws_lambda_function.it["parking-spots-api"]
+  to   = module.lambda_functions.aws_lambda_function.managed_layers["parking-spots-api"]
+}
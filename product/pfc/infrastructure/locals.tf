@@ -7,7 +7,9 @@ locals {
   }
 
   # 共通リソース名
-  dynamodb_table_name = "${local.env.product}-ParkingSpots-table"
+  dynamodb_table_name             = "${local.env.product}-ParkingSpots-table"
+  recommendation_cache_table_name = "${local.env.product}-RecommendationCache-table"
+  recommendation_pregenerator     = "${local.env.product}-recommendation-pregenerator-function"
 
   # Lambda共通設定
   lambda_common = {
@@ -18,6 +20,7 @@ locals {
       ENVIRONMENT           = local.env.environment
       ENABLE_SELECTION_MODE = "true"
       MAX_BEDROCK_TOKENS    = "150"
+      SNAPSHOT_BUCKET       = module.pfc_s3_bucket.s3_ids["snapshot-bucket"]
     }
 
     # DynamoDB共通権限
@@ -34,6 +37,20 @@ locals {
       resources = ["arn:aws:dynamodb:${local.env.region}:${local.env.account_id}:table/${local.env.product}*"]
     }
 
+    # スナップショット読み取り権限（parking-spots-api）
+    snapshot_read_permissions = {
+      effect    = "Allow"
+      actions   = ["s3:GetObject"]
+      resources = ["${module.pfc_s3_bucket.s3_arns["snapshot-bucket"]}/snapshots/*"]
+    }
+
+    # スナップショット書き込み権限（parking-data-collector）
+    snapshot_write_permissions = {
+      effect    = "Allow"
+      actions   = ["s3:PutObject"]
+      resources = ["${module.pfc_s3_bucket.s3_arns["snapshot-bucket"]}/snapshots/*"]
+    }
+
     # CloudWatch Logs権限
     cloudwatch_permissions = {
       effect = "Allow"
@@ -31,5 +31,24 @@ module "pfc_s3_bucket" {
         }
       ]
     }
+
+    # parking-data-collector が出力する駐輪場スナップショット（API が mmap で参照）
+    snapshot-bucket = {
+      s3_bucket_name       = "pfc-snapshot"
+      force_destroy        = true
+      versioning_status    = "Suspended"
+      encryption_algorithm = "AES256"
+
+      lifecycle_rules = [
+        {
+          id      = "snapshot_expiration"
+          prefix  = "snapshots/"
+          enabled = true
+          expiration = {
+            days = 1
+          }
+        }
+      ]
+    }
   }
-}
\ No newline at end of file
+}
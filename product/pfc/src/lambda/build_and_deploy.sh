@@ -30,6 +30,27 @@ FUNCTIONS=(
     "parking-data-collector:tokyo-parking-data-collector.py:PFC Tokyo Parking Data Collector Function"
 )
 
+# 共通データアクセスレイヤー（3関数で共有するモジュール）
+LAYER_NAME="pfc-shared-layer"
+LAYER_MODULES=(
+    "dynamodb_codec.py"
+    "spatial_index.py"
+    "pfc_data_access.py"
+    "spot_ranking.py"
+    "keyword_matcher.py"
+    "pfc_metrics.py"
+)
+
+echo "📦 Building $LAYER_NAME..."
+rm -rf temp_layer
+mkdir -p temp_layer/python
+cp "${LAYER_MODULES[@]}" temp_layer/python/
+cd temp_layer
+zip -r "../builds/${LAYER_NAME}.zip" . -q
+cd ..
+rm -rf temp_layer
+echo "  ✅ $LAYER_NAME.zip created"
+
 echo "🔨 Building Lambda functions..."
 
 for function_info in "${FUNCTIONS[@]}"; do
@@ -79,6 +100,34 @@ for function_info in "${FUNCTIONS[@]}"; do
     echo "  ✅ $func_name.zip created"
 done
 
+# コールドスタート時の初期化時間を確認（python -X importtime、累積時間の上位をレポートに出力）
+echo "⏱️  Profiling handler import time..."
+for function_info in "${FUNCTIONS[@]}"; do
+    IFS=':' read -r func_name source_file description <<< "$function_info"
+    
+    if [ ! -f "$source_file" ]; then
+        continue
+    fi
+    
+    report="builds/${func_name}-importtime.txt"
+    # ハンドラーモジュールを読み込むだけ（AWS APIは呼び出さない）、レイヤーと依存関係はLambdaと同じくパスに追加
+    if AWS_DEFAULT_REGION="${AWS_DEFAULT_REGION:-ap-northeast-1}" PYTHONPATH=".:temp_packages" python3 -X importtime -c "
+import importlib.util, time
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('handler', '$source_file')
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+print(f'init: {(time.perf_counter() - start) * 1000:.0f} ms')
+" > "$report" 2> "$report.raw"; then
+        echo "# cumulative import time (us) top 20" >> "$report"
+        grep '^import time:' "$report.raw" | sort -t'|' -k2 -n -r | head -20 >> "$report"
+        echo "  ✅ $func_name $(head -1 "$report") (details: $report)"
+    else
+        echo "  ⚠️  Import profiling skipped for $func_name (see $report.raw)"
+        continue
+    fi
+    rm -f "$report.raw"
+done
+
 # 一時的な依存関係ディレクトリを削除
 rm -rf temp_packages
 
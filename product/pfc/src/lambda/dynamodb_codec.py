@@ -0,0 +1,194 @@
+import time
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from pfc_metrics import record_count, span
+
+# batch_write_item 1リクエストあたりの最大件数
+BATCH_WRITE_MAX_ITEMS = 25
+# 未処理アイテム再送の最大試行回数
+BATCH_WRITE_MAX_ATTEMPTS = 8
+
+# 条件オブジェクト（Key/Attr）を受け付けるパラメータ
+CONDITION_PARAMS = ('KeyConditionExpression', 'FilterExpression', 'ConditionExpression')
+
+
+def deserialize_value(value: Dict[str, Any]) -> Any:
+    """
+    DynamoDBのワイヤ形式の値を通常のPython値に変換（Decimalを経由しない）
+    数値は整数値ならint、それ以外はfloat
+    """
+    (type_code, raw), = value.items()
+    
+    if type_code == 'S':
+        return raw
+    if type_code == 'N':
+        return _parse_number(raw)
+    if type_code == 'M':
+        return {key: deserialize_value(item) for key, item in raw.items()}
+    if type_code == 'L':
+        return [deserialize_value(item) for item in raw]
+    if type_code == 'BOOL':
+        return raw
+    if type_code == 'NULL':
+        return None
+    if type_code == 'SS':
+        return set(raw)
+    if type_code == 'NS':
+        return {_parse_number(item) for item in raw}
+    if type_code == 'B':
+        return raw
+    if type_code == 'BS':
+        return set(raw)
+    
+    raise TypeError(f"Unsupported DynamoDB type: {type_code}")
+
+
+def deserialize_item(item: Optional[Dict[str, Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """
+    ワイヤ形式のアイテムを1パスでdictに変換
+    """
+    if item is None:
+        return None
+    return {key: deserialize_value(value) for key, value in item.items()}
+
+
+def _parse_number(raw: str) -> Any:
+    # 小数点・指数を含まない値（座標以外のほとんど）はintへ直接変換
+    if '.' not in raw and 'e' not in raw and 'E' not in raw:
+        return int(raw)
+    return normalize_number(float(raw))
+
+
+def normalize_number(number: float) -> Any:
+    """
+    floatをDynamoDBから読んだ場合と同じ型に揃える（整数値ならint）
+    """
+    return int(number) if number.is_integer() else number
+
+
+def serialize_value(value: Any) -> Dict[str, Any]:
+    """
+    Python値をDynamoDBのワイヤ形式に変換（floatはDecimalを経由せず文字列化）
+    """
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, float, Decimal)):
+        return {'N': str(value)}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, dict):
+        return {'M': {str(key): serialize_value(item) for key, item in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'L': [serialize_value(item) for item in value]}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    if isinstance(value, (set, frozenset)) and value:
+        if all(isinstance(item, str) for item in value):
+            return {'SS': list(value)}
+        if all(isinstance(item, (int, float, Decimal)) and not isinstance(item, bool) for item in value):
+            return {'NS': [str(item) for item in value]}
+    
+    raise TypeError(f"Unsupported type for DynamoDB: {type(value).__name__}")
+
+
+def serialize_item(item: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    dictをワイヤ形式のアイテムに変換
+    """
+    return {key: serialize_value(value) for key, value in item.items()}
+
+
+class DynamoTable:
+    """
+    boto3.client上の軽量テーブルラッパー
+    boto3.resourceのTableと同じ引数（Key/Attr条件・Python値）を受け付け、
+    結果はDecimalではなくint/float/str/list/dictで返す
+    """
+    
+    def __init__(self, client: Any, table_name: str):
+        self.client = client
+        self.table_name = table_name
+    
+    def get_item(self, **kwargs: Any) -> Dict[str, Any]:
+        return self._call(self.client.get_item, kwargs)
+    
+    def put_item(self, **kwargs: Any) -> Dict[str, Any]:
+        return self._call(self.client.put_item, kwargs)
+    
+    def query(self, **kwargs: Any) -> Dict[str, Any]:
+        return self._call(self.client.query, kwargs)
+    
+    def scan(self, **kwargs: Any) -> Dict[str, Any]:
+        return self._call(self.client.scan, kwargs)
+    
+    def update_item(self, **kwargs: Any) -> Dict[str, Any]:
+        return self._call(self.client.update_item, kwargs)
+    
+    def put_items(self, items: Iterable[Dict[str, Any]]) -> int:
+        """
+        batch_write_itemで一括書き込み（25件単位、未処理アイテムはバックオフして再送）
+        """
+        written = 0
+        batch: List[Dict[str, Any]] = []
+        for item in items:
+            batch.append({'PutRequest': {'Item': serialize_item(item)}})
+            if len(batch) == BATCH_WRITE_MAX_ITEMS:
+                self._write_batch(batch)
+                written += len(batch)
+                batch = []
+        
+        if batch:
+            self._write_batch(batch)
+            written += len(batch)
+        
+        return written
+    
+    def _write_batch(self, requests: List[Dict[str, Any]]) -> None:
+        for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+            with span('DynamoDB'):
+                response = self.client.batch_write_item(RequestItems={self.table_name: requests})
+            requests = response.get('UnprocessedItems', {}).get(self.table_name, [])
+            if not requests:
+                return
+            time.sleep(min(0.05 * (2 ** attempt), 2.0))
+        
+        raise RuntimeError(f"{len(requests)} items were not written to {self.table_name}")
+    
+    def _call(self, operation: Any, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        params = dict(kwargs, TableName=self.table_name)
+        names = dict(params.pop('ExpressionAttributeNames', None) or {})
+        values = dict(params.pop('ExpressionAttributeValues', None) or {})
+        
+        # Key/Attr条件をプレースホルダー付きの式文字列に変換
+        builder = ConditionExpressionBuilder()
+        for param in CONDITION_PARAMS:
+            condition = params.get(param)
+            if isinstance(condition, ConditionBase):
+                built = builder.build_expression(condition, is_key_condition=(param == 'KeyConditionExpression'))
+                params[param] = built.condition_expression
+                names.update(built.attribute_name_placeholders)
+                values.update(built.attribute_value_placeholders)
+        
+        if names:
+            params['ExpressionAttributeNames'] = names
+        if values:
+            params['ExpressionAttributeValues'] = serialize_item(values)
+        for param in ('Key', 'ExclusiveStartKey', 'Item'):
+            if param in params:
+                params[param] = serialize_item(params[param])
+        
+        with span('DynamoDB'):
+            response = operation(**params)
+        
+        with span('Decode'):
+            if 'Items' in response:
+                response['Items'] = [deserialize_item(item) for item in response['Items']]
+                record_count('DynamoDBItems', len(response['Items']))
+            for field in ('Item', 'LastEvaluatedKey', 'Attributes'):
+                if field in response:
+                    response[field] = deserialize_item(response[field])
+        
+        return response
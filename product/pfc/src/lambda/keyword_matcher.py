@@ -0,0 +1,83 @@
+from collections import deque
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+
+
+class KeywordMatch(NamedTuple):
+    """
+    本文中で見つかったキーワード（start/endは本文中の位置、endは含まない）
+    """
+    start: int
+    end: int
+    keyword: str
+    value: Any
+
+
+class KeywordMatcher:
+    """
+    複数キーワードの一括照合（Aho-Corasick法）
+    構築時にキーワード全体から遷移表を作り、照合は本文の1パスで全キーワードの出現を列挙する
+    """
+    
+    def __init__(self, keywords: Iterable[Tuple[str, Any]]):
+        # ノードごとの遷移・失敗遷移・出力（そのノードで終わるキーワードの (キーワード, 値) 一覧）
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[str, Any]]] = [[]]
+        
+        for keyword, value in keywords:
+            if not keyword:
+                continue
+            node = 0
+            for char in keyword:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                node = next_node
+            self._output[node].append((keyword, value))
+        
+        # 幅優先で失敗遷移を設定し、失敗先の出力を引き継ぐ
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+    
+    def find_all(self, text: str) -> List[KeywordMatch]:
+        """
+        本文中の全キーワードの出現を列挙（重なりを含む、終了位置順）
+        """
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        matches = []
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for keyword, value in output[node]:
+                matches.append(KeywordMatch(position + 1 - len(keyword), position + 1, keyword, value))
+        return matches
+    
+    def find_longest(self, text: str) -> List[KeywordMatch]:
+        """
+        重なる出現のうち、より左から始まり、同じ開始位置ならより長いものを優先して選ぶ（出現順）
+        例: 「新宿駅」は「駅」より優先され、「駅」単独の一致としては扱わない
+        """
+        selected = []
+        covered_until = 0
+        for match in sorted(self.find_all(text), key=lambda match: (match.start, -len(match.keyword))):
+            if match.start >= covered_until:
+                selected.append(match)
+                covered_until = match.end
+        return selected
@@ -1,20 +1,110 @@
 import json
+import math
 import os
-import boto3
-from typing import Dict, List, Any
+import base64
+import gzip
+import hashlib
+import threading
+import time
+from boto3.dynamodb.conditions import Attr
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Any, NamedTuple, Optional, Tuple
 from datetime import datetime
-from decimal import Decimal
+from keyword_matcher import KeywordMatcher
+from pfc_data_access import AREA_STATION_MAPPING, DATASET_VERSION_KEY, META_WARD, SUMMARY_SCOPE_ALL, FilterSpec, build_spot_summary, find_parking, get_client, get_spot_summary, get_table, log_explain, matches
+from pfc_metrics import emit_metrics, record_cache, record_count, record_duration, span, traced_handler
+from spatial_index import SpatialGridIndex
+from spot_ranking import rank_spots
 
-# AWS クライアントの初期化
-dynamodb = boto3.resource('dynamodb')
-bedrock_runtime = boto3.client('bedrock-runtime', region_name='ap-northeast-1')
+# AWS クライアントの設定（Bedrockは推奨文を生成するリクエストでのみ初回使用時に生成）
+BEDROCK_REGION = 'ap-northeast-1'
 
 # 環境変数
-TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', 'pfc-ParkingSpots-table')
 MODEL_ID = os.environ.get('BEDROCK_MODEL_ID', 'anthropic.claude-3-haiku-20240307-v1:0')
 ENABLE_SELECTION_MODE = os.environ.get('ENABLE_SELECTION_MODE', 'true').lower() == 'true'
 MAX_BEDROCK_TOKENS = int(os.environ.get('MAX_BEDROCK_TOKENS', '150'))
+# 生成の待ち時間予算に合わせてmax_tokensを下げる場合の下限（推奨3件分）
+MIN_BEDROCK_TOKENS = int(os.environ.get('MIN_BEDROCK_TOKENS', '80'))
+# プロンプトの入力トークン予算と生成の待ち時間予算（ms、0以下で無効）
+BEDROCK_PROMPT_TOKEN_BUDGET = int(os.environ.get('BEDROCK_PROMPT_TOKEN_BUDGET', '300'))
+BEDROCK_LATENCY_BUDGET_MS = float(os.environ.get('BEDROCK_LATENCY_BUDGET_MS', '2500'))
+# 料金（USD / 1,000トークン、既定はClaude 3 Haiku）
+BEDROCK_INPUT_PRICE_PER_1K = float(os.environ.get('BEDROCK_INPUT_PRICE_PER_1K', '0.00025'))
+BEDROCK_OUTPUT_PRICE_PER_1K = float(os.environ.get('BEDROCK_OUTPUT_PRICE_PER_1K', '0.00125'))
+# 1文字あたりのトークン数（プロンプトの件数・項目セットの決定に使用、全コンテナで同じプロンプトになるよう固定値）
+BEDROCK_TOKENS_PER_CHAR = float(os.environ.get('BEDROCK_TOKENS_PER_CHAR', '1.0'))
+# 実測値による補正の重み（指数移動平均）
+BEDROCK_CALIBRATION_ALPHA = 0.2
+# 待ち時間予算から選ぶmax_tokensの刻み（推奨文キャッシュのキーが細かく分かれないようにする）
+BEDROCK_TOKENS_STEP = 10
+# プロンプトに含める駐輪場の件数（上位3つを推奨させるため最低3件）と項目セット（詳しい順）
+PROMPT_MAX_SPOTS = 5
+PROMPT_MIN_SPOTS = 3
+PROMPT_FIELD_SETS = ('detailed', 'standard', 'compact')
 ENABLE_TOKYO_WIDE = os.environ.get('ENABLE_TOKYO_WIDE', 'true').lower() == 'true'
+# 区・駅が未確定の場合に選択条件で取得する候補の最大件数（この中から優先度順に上位15件を返す、区・駅の確定時はSESSION_CANDIDATE_LIMIT）
+CANDIDATE_LIMIT = int(os.environ.get('CANDIDATE_LIMIT', '100'))
+GZIP_MIN_BYTES = int(os.environ.get('GZIP_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+SPOT_CACHE_VERSION_CHECK_SECONDS = float(os.environ.get('SPOT_CACHE_VERSION_CHECK_SECONDS', '30'))
+SPATIAL_GRID_CELL_METERS = float(os.environ.get('SPATIAL_GRID_CELL_METERS', '250'))
+# 現在地検索の半径（m）
+NEARBY_RADIUS_METERS = float(os.environ.get('NEARBY_RADIUS_METERS', '1000'))
+# Bedrock推奨文キャッシュ（プロセス内LRU → DynamoDB TTLテーブル）
+RECOMMENDATION_CACHE_TABLE = os.environ.get('RECOMMENDATION_CACHE_TABLE', 'pfc-RecommendationCache-table')
+RECOMMENDATION_CACHE_TTL_SECONDS = int(os.environ.get('RECOMMENDATION_CACHE_TTL_SECONDS', '86400'))
+RECOMMENDATION_CACHE_SIZE = int(os.environ.get('RECOMMENDATION_CACHE_SIZE', '256'))
+# ストリーミング応答（NDJSON、1行1イベント）
+STREAM_CONTENT_TYPE = 'application/x-ndjson'
+SELECTION_SUGGESTIONS = ['別の条件で探す', '詳細を確認', '新しい検索']
+FALLBACK_SUGGESTIONS = ['別の条件', '詳細確認', '新しい検索']
+NO_RESULT_SUGGESTIONS = ['条件を変更', '別のエリア', '新しい検索']
+# 推奨文の事前生成（収集完了後にstep2 × 選択回数上位の区・市を生成し、推奨文キャッシュテーブルに保存）
+PREGENERATED_KEY_PREFIX = 'pregenerated#'
+PREGENERATED_TTL_SECONDS = int(os.environ.get('PREGENERATED_TTL_SECONDS', '604800'))
+PREGENERATE_MAX_WORKERS = int(os.environ.get('PREGENERATE_MAX_WORKERS', '4'))
+PREGENERATE_WARD_COUNT = int(os.environ.get('PREGENERATE_WARD_COUNT', '8'))
+# 前回推奨した駐輪場が引き続き上位にあり料金・車種が変わらなければ、この期間は前回の推奨文を再利用（収集は10分ごと）
+PREGENERATED_REUSE_MAX_AGE_SECONDS = int(os.environ.get('PREGENERATED_REUSE_MAX_AGE_SECONDS', '3600'))
+# セッション内の候補集合（区・駅の全候補を1回だけ取得し、以降の選択条件はメモリ上で絞り込む）
+SESSION_KEY_PREFIX = 'session#'
+SESSION_TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', '1800'))
+# 候補がこの件数を超える区・駅はセッションに保存せず、従来どおり条件付きで検索（DynamoDBの400KB上限内に収める）
+SESSION_CANDIDATE_LIMIT = int(os.environ.get('SESSION_CANDIDATE_LIMIT', '800'))
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '64'))
+SESSION_ID_MAX_LENGTH = 64
+# 区・駅の候補集合の事前取得（step1・step2の選択時に、選択回数の多い区・駅から並列に取得）
+AREA_SELECTION_STATS_KEY = 'stats#areaSelections'
+PREFETCH_AREA_COUNT = int(os.environ.get('PREFETCH_AREA_COUNT', '3'))
+PREFETCH_STATS_TTL_SECONDS = float(os.environ.get('PREFETCH_STATS_TTL_SECONDS', '300'))
+# 選択回数はプロセス内で集計し、この間隔で1回のupdate_itemにまとめて加算（最終選択のリクエストごとに書き込まない）
+AREA_SELECTION_FLUSH_SECONDS = float(os.environ.get('AREA_SELECTION_FLUSH_SECONDS', '60'))
+
+# 実測から補正した生成速度の推定値
+_bedrock_calibration: Dict[str, Optional[float]] = {'ms_per_output_token': None}
+
+# データセットバージョン（SPOT_CACHE_VERSION_CHECK_SECONDS間隔で再確認）
+_dataset_version: Dict[str, Any] = {'version': None, 'checked_at': 0.0}
+
+# ウォームスタート間で再利用する空間索引（データセットバージョンが変わったら再構築）
+_spatial_cache = {'version': None, 'index': None}
+
+# 推奨文キャッシュ（キー → (推奨文, 有効期限)）とヒット率の集計
+_recommendation_cache: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+_recommendation_cache_stats = {'requests': 0, 'memory_hits': 0, 'dynamodb_hits': 0, 'pregenerated_hits': 0}
+
+# 区・駅の候補集合（キー → (データセットバージョン, 候補（多すぎる場合None）, 有効期限)、全セッションで共有）
+_area_candidates: 'OrderedDict[str, Tuple[int, Optional[List[Dict[str, Any]]], float]]' = OrderedDict()
+_area_candidates_lock = threading.Lock()
+
+# 区・駅の選択回数（PREFETCH_STATS_TTL_SECONDS間隔で再取得）
+_area_selection_stats: Dict[str, Any] = {'counts': None, 'checked_at': 0.0}
+
+# 未書き込みの区・駅の選択回数（キー → 回数）と最終書き込み時刻
+_area_selection_pending: Dict[str, int] = {}
+_area_selection_flush = {'flushed_at': time.time()}
+_area_selection_lock = threading.Lock()
 
 # 選択肢マッピング
 SELECTION_MAPPING = {
@@ -88,26 +178,299 @@ SELECTION_MAPPING = {
     }
 }
 
+# step2選択肢の表示テキスト（フロントエンドのChatFlowと同じ、事前生成のプロンプトに使用）
+STEP2_TEXTS = {
+    'free': '💰 無料',
+    'cheap': '💸 安い',
+    'near_station': '🚶 駅近',
+    'motorcycle': '🏍️ バイク可',
+    'bicycle': '🚲 自転車'
+}
+
+# 事前生成の対象となる区・市（step3の主要駅エリア → 区・市選択の定義順、選択回数の集計がない・不足する場合はこの順で補う）
+PREGENERATED_WARDS = list(dict.fromkeys(
+    info['ward']
+    for step in ('step3', 'ward_selection')
+    for info in SELECTION_MAPPING[step].values()
+    if info.get('ward')
+))
+
+# 事前取得の既定の対象（step3の主要駅エリアの定義順、検索時と同じく区を優先したキー）
+DEFAULT_PREFETCH_AREAS = [
+    f"ward#{info['ward']}" if info.get('ward') else f"station#{info['station']}"
+    for info in SELECTION_MAPPING['step3'].values()
+    if info.get('station')
+]
+
+# フリー入力モードの意図キーワード（複数該当時は定義順に優先）
+INTENT_KEYWORDS = {
+    'greeting': ['こんにちは', 'こんばんは', 'おはよう', 'はじめまして'],
+    'nearest': ['近', '最寄', '駅', '徒歩', '距離'],
+    'available': ['空', '空い', '利用可能', '使える'],
+    'cheapest': ['安', '料金', '値段', '無料']
+}
+# 駅・区市の別名と誤認しやすい語（最長一致で先に消費し、場所として扱わない）
+LOCATION_STOPWORDS = ['東京都']
+
+
+class MessageIntent(NamedTuple):
+    """
+    フリー入力メッセージから抽出した意図と場所（場所なしはscope='all'）
+    """
+    intent: str = 'general'
+    scope: str = SUMMARY_SCOPE_ALL
+    location: str = ''
+
+
+def build_message_matcher() -> KeywordMatcher:
+    """
+    意図キーワードと、SELECTION_MAPPINGの駅・区市・エリア名の別名を1つの照合器にまとめる
+    同じ別名は先に登録したもの（駅 → 区市）を優先
+    """
+    entries: Dict[str, Tuple[str, Optional[str]]] = {}
+    for intent, keywords in INTENT_KEYWORDS.items():
+        for keyword in keywords:
+            entries.setdefault(keyword, ('intent', intent))
+    for stopword in LOCATION_STOPWORDS:
+        entries.setdefault(stopword, ('stopword', None))
+    
+    for info in SELECTION_MAPPING['step3'].values():
+        station = info.get('station')
+        if station:
+            for alias in (f"{station}駅", station, info['area']):
+                entries.setdefault(alias.lower(), ('station', station))
+    for step in ('step3', 'ward_selection'):
+        for info in SELECTION_MAPPING[step].values():
+            ward = info.get('ward')
+            if ward:
+                entries.setdefault(ward, ('ward', ward))
+                # 「世田谷」など区・市を省いた表記（1文字は誤一致が多いため除外）
+                if len(ward) > 2:
+                    entries.setdefault(ward[:-1], ('ward', ward))
+    
+    return KeywordMatcher(entries.items())
+
+
+MESSAGE_MATCHER = build_message_matcher()
+
+
+def parse_message(message: str) -> MessageIntent:
+    """
+    メッセージを1パスで照合し、意図と最初に現れた場所を抽出（「新宿駅」の「駅」は場所の一部として扱う）
+    """
+    intents = set()
+    location = None
+    for match in MESSAGE_MATCHER.find_longest(message.lower()):
+        kind, value = match.value
+        if kind == 'intent':
+            intents.add(value)
+        elif kind in ('station', 'ward') and location is None:
+            location = (kind, value)
+    
+    intent = next((name for name in INTENT_KEYWORDS if name in intents), 'general')
+    if location is None:
+        return MessageIntent(intent)
+    return MessageIntent(intent, *location)
+
+
+def pregenerate_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    推奨文の事前生成ハンドラー（データ収集完了後に非同期で呼び出される）
+    step2 × 選択回数上位PREGENERATE_WARD_COUNTの区・市について上位の駐輪場と推奨文を生成し、同時実行数を制限してBedrockを呼び出す
+    """
+    # 収集直後のバージョンを確実に取得するため、確認間隔のキャッシュを無視する
+    _dataset_version['checked_at'] = 0.0
+    version = get_dataset_version()
+    if version is None:
+        print("Pregeneration skipped: dataset version is unknown")
+        return {'statusCode': 200, 'body': json.dumps({'skipped': True})}
+    
+    combinations = [(step2_id, ward) for step2_id in SELECTION_MAPPING['step2'] for ward in get_pregeneration_wards()]
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=PREGENERATE_MAX_WORKERS) as executor:
+        results = Counter(executor.map(lambda combination: pregenerate_recommendation(*combination, version), combinations))
+    
+    summary = {
+        'pregeneratedVersion': version,
+        'combinations': len(combinations),
+        'generated': results['generated'],
+        'reused': results['reused'],
+        'empty': results['empty'],
+        'failed': results['failed'],
+        'elapsedMs': round((time.time() - started) * 1000, 1)
+    }
+    print(json.dumps(summary))
+    return {'statusCode': 200, 'body': json.dumps(summary)}
+
+
+def pregenerate_recommendation(step2_id: str, ward: str, version: int) -> str:
+    """
+    1組み合わせ分の推奨文を生成して保存し、結果（generated / reused / empty / failed）を返す
+    前回プロンプトに含めた駐輪場がすべて現在の上位15件にあり、料金・車種が変わらず、
+    前回の生成からPREGENERATED_REUSE_MAX_AGE_SECONDS以内ならBedrockを呼ばずに再利用
+    （空き状況による上位の入れ替わりでは再生成しない。parkingLotsは推奨文の駐輪場を最新のデータで返す）
+    """
+    try:
+        selections = {'step2': {'id': step2_id, 'text': STEP2_TEXTS.get(step2_id, step2_id)}}
+        parking_data = get_filtered_parking_data_tokyo_wide(build_filters_from_selections(selections, '', ward))
+        cache_key = build_pregenerated_key(step2_id, ward)
+        table = get_table(RECOMMENDATION_CACHE_TABLE)
+        
+        now = int(time.time())
+        generated_at = now
+        spot_ids = None
+        if not parking_data:
+            result = 'empty'
+            response_data = {
+                'response': f'{ward}で条件に合う駐輪場が見つかりませんでした😅 条件を変更してみてください。',
+                'parkingLots': [],
+                'suggestions': NO_RESULT_SUGGESTIONS
+            }
+        else:
+            previous = table.get_item(
+                Key={'cacheKey': cache_key},
+                ProjectionExpression='spotIds, fingerprint, generatedAt, #response',
+                ExpressionAttributeNames={'#response': 'response'}
+            ).get('Item')
+            previous_spots = find_previous_spots(previous, parking_data, now)
+            if previous_spots is not None and build_pregeneration_fingerprint(step2_id, ward, previous_spots) == previous.get('fingerprint'):
+                result = 'reused'
+                ai_response = previous['response']
+                generated_at = previous['generatedAt']
+                parking_data = previous_spots
+            else:
+                result = 'generated'
+                ai_response = invoke_bedrock_text(build_recommendation_prompt(selections, parking_data, '', ward))
+                parking_data = parking_data[:PROMPT_MAX_SPOTS]
+            spot_ids = [p['id'] for p in parking_data]
+            response_data = {
+                'response': ai_response,
+                'parkingLots': parking_data[:3],
+                'suggestions': SELECTION_SUGGESTIONS,
+                'type': 'selection_result'
+            }
+        
+        item = {
+            'cacheKey': cache_key,
+            'datasetVersion': version,
+            'responseData': response_data,
+            'response': response_data['response'],
+            'generatedAt': generated_at,
+            'expiresAt': now + PREGENERATED_TTL_SECONDS,
+            'createdAt': datetime.now().isoformat()
+        }
+        if spot_ids:
+            item['spotIds'] = spot_ids
+            item['fingerprint'] = build_pregeneration_fingerprint(step2_id, ward, parking_data)
+        table.put_item(Item=item)
+        return result
+        
+    except Exception as e:
+        print(f"Pregeneration error ({step2_id}, {ward}): {str(e)}")
+        return 'failed'
+
+
+def get_pregeneration_wards() -> List[str]:
+    """
+    事前生成する区・市（区の選択回数の多い順、集計がない・不足する場合はPREGENERATED_WARDSの順で補う）
+    """
+    try:
+        item = get_table(RECOMMENDATION_CACHE_TABLE).get_item(Key={'cacheKey': AREA_SELECTION_STATS_KEY}).get('Item') or {}
+    except Exception as e:
+        print(f"Area selection stats read error: {str(e)}")
+        item = {}
+    
+    counts = {key.partition('#')[2]: count for key, count in item.items() if key.startswith('ward#')}
+    popular = sorted((ward for ward in counts if ward in PREGENERATED_WARDS), key=lambda ward: -counts[ward])
+    return list(dict.fromkeys(popular + PREGENERATED_WARDS))[:PREGENERATE_WARD_COUNT]
+
+
+def find_previous_spots(previous: Optional[Dict[str, Any]], parking_data: List[Dict[str, Any]], now: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    前回の推奨文の駐輪場を現在のデータで取得（再利用期間切れ・いずれかが上位から外れた場合はNone）
+    """
+    if not previous or not previous.get('spotIds') or now - previous.get('generatedAt', 0) >= PREGENERATED_REUSE_MAX_AGE_SECONDS:
+        return None
+    current = {p['id']: p for p in parking_data}
+    if not all(spot_id in current for spot_id in previous['spotIds']):
+        return None
+    return [current[spot_id] for spot_id in previous['spotIds']]
+
+
+def build_pregeneration_fingerprint(step2_id: str, ward: str, spots: List[Dict[str, Any]]) -> str:
+    """
+    推奨文の再利用判定に使う、step2の検索条件と駐輪場の変わりにくい属性（id・料金・車種）のハッシュ
+    空き状況は収集ごとに変わるため含めない。検索条件が変わった場合は再利用しない
+    """
+    attributes = [[p['id'], p.get('fees'), p.get('vehicleTypes', p.get('bikeTypes'))] for p in spots]
+    payload = json.dumps([step2_id, SELECTION_MAPPING['step2'].get(step2_id), ward, attributes], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
 
+def build_pregenerated_key(step2_id: str, ward: str) -> str:
+    return f"{PREGENERATED_KEY_PREFIX}{step2_id}#{ward}"
+
+
+def get_pregenerated_response(selections: Dict[str, Any], filters: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    事前生成済みの応答を取得（対象外の選択、未生成、データセットバージョン不一致の場合はNone）
+    step1は検索条件・プロンプトに影響しないため、step2と区・市のみで引く
+    """
+    step2_id = (selections.get('step2') or {}).get('id')
+    ward = filters.get('ward')
+    if step2_id not in SELECTION_MAPPING['step2'] or ward not in PREGENERATED_WARDS or filters.get('use_location'):
+        return None
+    
+    version = get_dataset_version()
+    if version is None:
+        return None
+    
+    try:
+        response = get_table(RECOMMENDATION_CACHE_TABLE).get_item(Key={'cacheKey': build_pregenerated_key(step2_id, ward)})
+        item = response.get('Item')
+    except Exception as e:
+        print(f"Pregenerated recommendation read error: {str(e)}")
+        return None
+    
+    if not item or item.get('datasetVersion') != version:
+        return None
+    
+    log_recommendation_cache('pregenerated')
+    return item['responseData']
+
+
+@traced_handler('park-finder-chat')
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     メインのLambdaハンドラー - 選択肢型チャット対応
+    TRACE_SAMPLE_RATEの割合のリクエストでDynamoDB・絞り込み・ランキング・Bedrock等の段階別所要時間を出力
     """
     try:
         body = json.loads(event.get('body', '{}'))
         is_selection_mode = body.get('isSelectionMode', False)
         
         if is_selection_mode and ENABLE_SELECTION_MODE:
-            return handle_selection_mode(body)
+            if body.get('prefetch'):
+                # step1・step2の選択時（応答は待たれない）：選ばれやすい区・駅の候補集合を先に取得
+                return create_response(200, prefetch_area_candidates(get_session_id(body)))
+            if body.get('stream'):
+                # API Gateway経由ではチャンクがバッファされるため、同じNDJSONイベント列をまとめて返す
+                return create_stream_response(stream_selection_mode(body))
+            return compress_response(handle_selection_mode(body), event)
         else:
             # 従来のフリー入力モード
             user_message = body.get('message', '')
             if not user_message:
                 return create_response(400, {'error': 'メッセージが必要です'})
             
-            parking_data = get_parking_data()
-            response_data = get_fallback_response(user_message, parking_data)
-            return create_response(200, response_data)
+            # 意図と場所を抽出し、場所の要約アイテム（なければGSI検索）から応答（Bedrockは呼ばない）
+            intent = parse_message(user_message)
+            summary = get_quick_summary(intent.scope, intent.location)
+            if not summary.get('count') and intent.scope != SUMMARY_SCOPE_ALL:
+                intent = MessageIntent(intent.intent)
+                summary = get_quick_summary()
+            response_data = get_fallback_response(intent, summary)
+            return create_response(200, response_data, event)
         
     except Exception as e:
         print(f"Error: {str(e)}")
@@ -123,28 +486,28 @@ def handle_selection_mode(body: Dict[str, Any]) -> Dict[str, Any]:
     """
     try:
         selections = body.get('selections', {})
-        step = body.get('step', 3)
         area = body.get('area', '')
         ward = body.get('ward', '')
         
-        # 区・市選択モードの場合、ward_selectionステップとして処理
-        if step == 'ward_selection' or area == 'ward_selection':
-            step = 'ward_selection'
-        elif step < 3 and step != 'ward_selection':
+        filters = build_selection_filters(body)
+        if filters is None:
             return create_response(200, {'error': 'まだ選択が完了していません'})
+        record_area_selection(filters)
         
-        # 選択情報を解析
-        filters = build_filters_from_selections(selections, area, ward)
+        # 事前生成済みの組み合わせは駐輪場検索・Bedrock呼び出しを省略
+        pregenerated = get_pregenerated_response(selections, filters)
+        if pregenerated is not None:
+            return create_response(200, pregenerated)
         
-        # DynamoDBから事前フィルタリング（東京全域対応）
-        parking_data = get_filtered_parking_data_tokyo_wide(filters)
+        # DynamoDBから事前フィルタリング（東京全域対応、セッションの候補集合があればテーブルは読まない）
+        parking_data = get_filtered_parking_data_tokyo_wide(filters, get_session_id(body))
         
         if not parking_data:
             area_name = ward or area or 'エリア'
             return create_response(200, {
                 'response': f'{area_name}で条件に合う駐輪場が見つかりませんでした😅 条件を変更してみてください。',
                 'parkingLots': [],
-                'suggestions': ['条件を変更', '別のエリア', '新しい検索']
+                'suggestions': NO_RESULT_SUGGESTIONS
             })
         
         # 最適化されたBedrock呼び出し
@@ -160,6 +523,123 @@ def handle_selection_mode(body: Dict[str, Any]) -> Dict[str, Any]:
         })
 
 
+def build_selection_filters(body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    リクエストから検索フィルタを構築（選択が完了していない場合はNone）
+    """
+    selections = body.get('selections', {})
+    step = body.get('step', 3)
+    area = body.get('area', '')
+    ward = body.get('ward', '')
+    location = body.get('location') or {}
+    
+    # 区・市選択モードの場合、ward_selectionステップとして処理
+    if step != 'ward_selection' and area != 'ward_selection' and step < 3:
+        return None
+    
+    # 選択情報を解析
+    filters = build_filters_from_selections(selections, area, ward)
+    
+    # 現在地検索（例: "location": {"lat": 35.69, "lng": 139.70}）
+    if filters.get('use_location') and location.get('lat') is not None and location.get('lng') is not None:
+        filters['coordinates'] = {'lat': float(location['lat']), 'lng': float(location['lng'])}
+    
+    return filters
+
+
+def get_session_id(body: Dict[str, Any]) -> Optional[str]:
+    """
+    フロントエンドがページ単位で発行するセッションID（英数字・ハイフンのみ、不正な値は無視）
+    """
+    session_id = body.get('sessionId')
+    if not isinstance(session_id, str) or not 0 < len(session_id) <= SESSION_ID_MAX_LENGTH:
+        return None
+    if not session_id.replace('-', '').isalnum() or not session_id.isascii():
+        return None
+    return session_id
+
+
+def stream_selection_mode(body: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    選択肢モードのストリーミング応答
+    トークン生成を待たずに駐輪場データ（parkingLots）を先に送り、続けてBedrockの生成テキストを差分ごとに送る
+    イベント: parkingLots → text（0回以上）→ done、失敗時はerror
+    """
+    started = time.time()
+    try:
+        selections = body.get('selections', {})
+        area = body.get('area', '')
+        ward = body.get('ward', '')
+        
+        filters = build_selection_filters(body)
+        if filters is None:
+            yield {'type': 'error', 'error': 'まだ選択が完了していません'}
+            return
+        record_area_selection(filters)
+        
+        pregenerated = get_pregenerated_response(selections, filters)
+        if pregenerated is not None:
+            yield {'type': 'parkingLots', 'parkingLots': pregenerated['parkingLots'], 'suggestions': pregenerated['suggestions']}
+            yield {'type': 'text', 'text': pregenerated['response']}
+            yield {'type': 'done', 'source': 'pregenerated'}
+            return
+        
+        parking_data = get_filtered_parking_data_tokyo_wide(filters, get_session_id(body))
+        area_display = ward or area or 'エリア'
+        yield {
+            'type': 'parkingLots',
+            'parkingLots': parking_data[:3],
+            'suggestions': SELECTION_SUGGESTIONS if parking_data else NO_RESULT_SUGGESTIONS
+        }
+        first_byte_ms = (time.time() - started) * 1000
+        
+        if not parking_data:
+            yield {'type': 'text', 'text': f'{area_display}で条件に合う駐輪場が見つかりませんでした😅 条件を変更してみてください。'}
+            yield {'type': 'done', 'source': 'empty'}
+            return
+        
+        max_tokens = choose_max_tokens()
+        version, cache_key, cached = lookup_recommendation(selections, parking_data, area, ward, max_tokens)
+        first_token_ms = None
+        
+        if cached is not None:
+            source = 'cache'
+            first_token_ms = (time.time() - started) * 1000
+            yield {'type': 'text', 'text': cached}
+        else:
+            source = 'bedrock'
+            chunks: List[str] = []
+            try:
+                prompt = build_recommendation_prompt(selections, parking_data, area, ward)
+                for text in stream_bedrock_text(prompt, max_tokens):
+                    if first_token_ms is None:
+                        first_token_ms = (time.time() - started) * 1000
+                    chunks.append(text)
+                    yield {'type': 'text', 'text': text}
+            except Exception as e:
+                print(f"Bedrock stream error: {str(e)}")
+                # 途中まで送信済みの場合はそのまま終了し、未送信の場合のみ定型文を送る
+                source = 'partial' if chunks else 'fallback'
+                if not chunks:
+                    yield {'type': 'text', 'text': build_fallback_recommendation(parking_data, area, ward)}
+            
+            if source == 'bedrock' and cache_key:
+                put_cached_recommendation(cache_key, ''.join(chunks), version)
+        
+        yield {'type': 'done', 'source': source}
+        
+        print(json.dumps({
+            'chatStream': source,
+            'timeToFirstByteMs': round(first_byte_ms, 1),
+            'timeToFirstTokenMs': round(first_token_ms, 1) if first_token_ms is not None else None,
+            'totalMs': round((time.time() - started) * 1000, 1)
+        }))
+        
+    except Exception as e:
+        print(f"Selection stream error: {str(e)}")
+        yield {'type': 'error', 'error': '選択処理でエラーが発生しました', 'response': 'もう一度お試しください'}
+
+
 def build_filters_from_selections(selections: Dict[str, Any], area: str = '', ward: str = '') -> Dict[str, Any]:
     """
     選択情報からDynamoDBフィルタを構築（東京全域対応）
@@ -172,11 +652,12 @@ def build_filters_from_selections(selections: Dict[str, Any], area: str = '', wa
         category_info = SELECTION_MAPPING['step1'][step1['id']]
         filters.update(category_info)
     
-    # Step 2: 優先度フィルタ
+    # Step 2: 優先度フィルタ（料金・距離・車種の条件は'filter'の中身を最上位に展開し、build_filter_specで読めるようにする）
     step2 = selections.get('step2', {})
     if step2 and step2.get('id') in SELECTION_MAPPING['step2']:
         priority_info = SELECTION_MAPPING['step2'][step2['id']]
-        filters.update(priority_info)
+        filters.update({key: value for key, value in priority_info.items() if key != 'filter'})
+        filters.update(priority_info.get('filter', {}))
     
     # Step 3: エリアフィルタ（東京全域対応）
     step3 = selections.get('step3', {})
@@ -196,99 +677,43 @@ def build_filters_from_selections(selections: Dict[str, Any], area: str = '', wa
     return filters
 
 
-def get_filtered_parking_data_tokyo_wide(filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+def get_filtered_parking_data_tokyo_wide(filters: Dict[str, Any], session_id: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     東京全域対応のフィルタに基づいてDynamoDBから駐輪場データを取得
+    区・駅の候補集合（事前取得済み、またはsession_id指定時に取得）があればメモリ上で絞り込む
     """
-    table = dynamodb.Table(TABLE_NAME)
-    
     try:
         # 東京全域モードが無効な場合は従来の処理
         if not ENABLE_TOKYO_WIDE:
             return get_filtered_parking_data(filters)
         
-        # 区・駅・エリア指定がある場合はGSIを使用
-        ward = filters.get('ward')
-        station = filters.get('station')
-        area = filters.get('area')
+        spec = build_filter_spec(filters)
+        coordinates = filters.get('coordinates') if filters.get('use_location') else None
+        candidates = get_session_candidates(session_id, spec) if not coordinates else None
         
-        items = []
-        
-        if ward:
-            # WardIndexを使用した効率的検索
-            response = table.query(
-                IndexName='WardIndex',
-                KeyConditionExpression='ward = :ward',
-                ExpressionAttributeValues={':ward': ward},
-                Limit=100
-            )
-            items = response.get('Items', [])
-        elif station:
-            # StationIndexを使用した効率的検索
-            response = table.query(
-                IndexName='StationIndex',
-                KeyConditionExpression='station = :station',
-                ExpressionAttributeValues={':station': station},
-                Limit=100
-            )
-            items = response.get('Items', [])
-        elif area and area in ['shinjuku', 'shibuya', 'ikebukuro', 'tokyo', 'shinagawa', 'ueno']:
-            # 主要駅エリアでの検索
-            station_name = {'shinjuku': '新宿', 'shibuya': '渋谷', 'ikebukuro': '池袋', 
-                           'tokyo': '東京', 'shinagawa': '品川', 'ueno': '上野'}.get(area, area)
-            response = table.query(
-                IndexName='StationIndex',
-                KeyConditionExpression='station = :station',
-                ExpressionAttributeValues={':station': station_name},
-                Limit=100
-            )
-            items = response.get('Items', [])
+        if candidates is not None:
+            predicates = spec._replace(ward=None, station=None, area=None)
+            with span('Filter'):
+                filtered_items = [item for item in candidates if matches(item, predicates)]
+        elif coordinates:
+            # 空間索引による現在地周辺の検索（距離順）、区・駅以外の条件を適用
+            nearby = get_nearby_parking_data(coordinates['lat'], coordinates['lng'], NEARBY_RADIUS_METERS, CANDIDATE_LIMIT)
+            predicates = spec._replace(ward=None, station=None, area=None)
+            with span('Filter'):
+                filtered_items = [item for item in nearby if matches(item, predicates)]
         else:
-            # 全体スキャン（制限付き）
-            response = table.scan(Limit=200)
-            items = response.get('Items', [])
+            # 区・駅・エリアと料金・距離・車種条件から実行計画（GSI／スキャン）を選択
+            # 区・駅が確定している場合は候補集合と同じ上限まで読み、キャッシュの有無で順位付けの対象が変わらないようにする
+            limit = SESSION_CANDIDATE_LIMIT if build_area_key(spec) else CANDIDATE_LIMIT
+            with span('Query'):
+                filtered_items, explain = find_parking(spec, limit)
+            log_explain('selection', explain)
+        record_count('Candidates', len(filtered_items))
         
-        # フィルタリング適用
-        filtered_items = []
-        for item in items:
-            item = convert_decimal(item)
-            
-            # 料金フィルタ
-            if 'fee_type' in filters:
-                if filters['fee_type'] == 'free':
-                    fees = item.get('fees', {})
-                    if fees.get('daily', 999) > 0 and fees.get('hourly', 999) > 0:
-                        continue
-            
-            if 'fee_max' in filters:
-                daily_fee = item.get('fees', {}).get('daily', 999)
-                if daily_fee > filters['fee_max']:
-                    continue
-            
-            # 距離フィルタ
-            if 'distance_max' in filters:
-                if item.get('distance', 999) > filters['distance_max']:
-                    continue
-            
-            # 車種フィルタ
-            if 'bike_types' in filters:
-                vehicle_types = item.get('vehicleTypes', [])
-                if not vehicle_types:
-                    vehicle_types = item.get('bikeTypes', [])  # 旧フィールド名対応
-                
-                if filters['bike_types'] not in ' '.join(vehicle_types):
-                    continue
-            
-            filtered_items.append(item)
-        
-        # 優先度に基づいてソート
+        # 距離・料金・無料時間・空き状況・車種を優先度ごとの重みで総合評価
         priority = filters.get('priority', 'distance')
-        if priority == 'cost':
-            filtered_items.sort(key=lambda x: x.get('fees', {}).get('daily', 999))
-        elif priority == 'distance':
-            filtered_items.sort(key=lambda x: x.get('distance', 999))
-        
-        return filtered_items[:15]  # 最大15件
+        with span('Rank'):
+            return rank_spots(filtered_items, priority, 15, vehicle_type=spec.bike_types)  # 最大15件
         
     except Exception as e:
         print(f"Tokyo-wide filtering error: {str(e)}")
@@ -296,22 +721,222 @@ def get_filtered_parking_data_tokyo_wide(filters: Dict[str, Any]) -> List[Dict[s
         return get_filtered_parking_data(filters)
 
 
+def build_area_key(spec: FilterSpec) -> Optional[str]:
+    """
+    区・駅の候補集合のキー（区・駅が未確定の場合はNone）
+    """
+    if spec.ward:
+        return f"ward#{spec.ward}"
+    station = spec.station_name()
+    if station:
+        return f"station#{station}"
+    return None
+
+
+def get_area_spec(area_key: str) -> FilterSpec:
+    kind, _, name = area_key.partition('#')
+    return FilterSpec(ward=name) if kind == 'ward' else FilterSpec(station=name)
+
+
+def get_session_candidates(session_id: Optional[str], spec: FilterSpec) -> Optional[List[Dict[str, Any]]]:
+    """
+    区・駅の全候補を取得（プロセス内 → セッションのDynamoDB TTLアイテム → 駐輪場テーブルの順）
+    プロセス内の候補集合は全セッションで共有し、駐輪場テーブルは区・駅ごとに1回だけ読む
+    session_idがない場合はプロセス内のみ参照（事前取得済みの区・駅のみ利用）
+    区・駅が未確定、データセットバージョン不明、候補がSESSION_CANDIDATE_LIMITを超える場合はNone
+    """
+    area_key = build_area_key(spec)
+    version = get_dataset_version() if area_key else None
+    if version is None:
+        return None
+    
+    now = time.time()
+    with _area_candidates_lock:
+        entry = _area_candidates.get(area_key)
+        if entry is not None and entry[0] == version and entry[2] > now:
+            _area_candidates.move_to_end(area_key)
+        else:
+            entry = None
+    if entry is not None:
+        # 候補が多すぎる区・駅も記録しておき、再取得しない
+        log_session_candidates('memory' if entry[1] is not None else 'too_large', len(entry[1] or []))
+        return entry[1]
+    if not session_id:
+        return None
+    
+    session_key = f"{SESSION_KEY_PREFIX}{session_id}#{area_key}"
+    try:
+        item = get_table(RECOMMENDATION_CACHE_TABLE).get_item(Key={'cacheKey': session_key}).get('Item')
+    except Exception as e:
+        print(f"Session candidates read error: {str(e)}")
+        item = None
+    
+    # TTLによる削除は遅延するため有効期限も確認
+    if item and item.get('datasetVersion') == version and item.get('expiresAt', 0) > now:
+        candidates = json.loads(gzip.decompress(item['candidates']))
+        remember_session_candidates(area_key, version, candidates, item['expiresAt'])
+        log_session_candidates('dynamodb', len(candidates))
+        return candidates
+    
+    location = FilterSpec(ward=spec.ward, station=spec.station, area=spec.area)
+    candidates, explain = find_parking(location, SESSION_CANDIDATE_LIMIT + 1)
+    log_explain('session', explain)
+    expires_at = int(now + SESSION_TTL_SECONDS)
+    if len(candidates) > SESSION_CANDIDATE_LIMIT:
+        remember_session_candidates(area_key, version, None, expires_at)
+        log_session_candidates('too_large', len(candidates))
+        return None
+    
+    try:
+        get_table(RECOMMENDATION_CACHE_TABLE).put_item(Item={
+            'cacheKey': session_key,
+            'candidates': gzip.compress(json.dumps(candidates, ensure_ascii=False).encode('utf-8'), compresslevel=GZIP_LEVEL),
+            'datasetVersion': version,
+            'expiresAt': expires_at,
+            'createdAt': datetime.now().isoformat()
+        })
+    except Exception as e:
+        print(f"Session candidates write error: {str(e)}")
+    
+    remember_session_candidates(area_key, version, candidates, expires_at)
+    log_session_candidates('fetched', len(candidates))
+    return candidates
+
+
+def remember_session_candidates(area_key: str, version: int, candidates: Optional[List[Dict[str, Any]]], expires_at: float) -> None:
+    with _area_candidates_lock:
+        _area_candidates[area_key] = (version, candidates, expires_at)
+        _area_candidates.move_to_end(area_key)
+        while len(_area_candidates) > SESSION_CACHE_SIZE:
+            _area_candidates.popitem(last=False)
+
+
+def log_session_candidates(source: str, count: int) -> None:
+    """
+    区・駅の候補集合の取得元（memory / dynamodb / fetched / too_large）をログ出力
+    """
+    record_cache('AreaCandidates', source in ('memory', 'dynamodb'))
+    print(json.dumps({'sessionCandidates': source, 'count': count}))
+
+
+def record_area_selection(filters: Dict[str, Any]) -> None:
+    """
+    確定した区・駅の選択回数をプロセス内に集計（事前取得・事前生成の優先順に使用）
+    DynamoDBへの加算はAREA_SELECTION_FLUSH_SECONDS間隔でまとめて行う
+    """
+    area_key = None if filters.get('use_location') else build_area_key(build_filter_spec(filters))
+    if not area_key:
+        return
+    with _area_selection_lock:
+        _area_selection_pending[area_key] = _area_selection_pending.get(area_key, 0) + 1
+    flush_area_selections()
+
+
+def flush_area_selections(force: bool = False) -> None:
+    """
+    未書き込みの選択回数を1回のupdate_itemでstats#areaSelectionsに加算（間隔内ならforce指定時のみ）
+    失敗した分は次回に持ち越し、応答は続行。コンテナ終了時の未書き込み分は集計から漏れる
+    """
+    with _area_selection_lock:
+        if not _area_selection_pending:
+            return
+        if not force and time.time() - _area_selection_flush['flushed_at'] < AREA_SELECTION_FLUSH_SECONDS:
+            return
+        pending = dict(_area_selection_pending)
+        _area_selection_pending.clear()
+        _area_selection_flush['flushed_at'] = time.time()
+    
+    names = {f"#a{i}": area_key for i, area_key in enumerate(pending)}
+    values = {f":c{i}": count for i, count in enumerate(pending.values())}
+    try:
+        get_table(RECOMMENDATION_CACHE_TABLE).update_item(
+            Key={'cacheKey': AREA_SELECTION_STATS_KEY},
+            UpdateExpression='ADD ' + ', '.join(f"#a{i} :c{i}" for i in range(len(pending))),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+    except Exception as e:
+        print(f"Area selection stats write error: {str(e)}")
+        with _area_selection_lock:
+            for area_key, count in pending.items():
+                _area_selection_pending[area_key] = _area_selection_pending.get(area_key, 0) + count
+
+
+def get_prefetch_areas() -> List[str]:
+    """
+    事前取得する区・駅（選択回数の多い順、集計がない・不足する場合はstep3の主要駅エリアの定義順で補う）
+    """
+    now = time.time()
+    if _area_selection_stats['counts'] is None or now - _area_selection_stats['checked_at'] >= PREFETCH_STATS_TTL_SECONDS:
+        try:
+            item = get_table(RECOMMENDATION_CACHE_TABLE).get_item(Key={'cacheKey': AREA_SELECTION_STATS_KEY}).get('Item') or {}
+            _area_selection_stats['counts'] = {key: count for key, count in item.items() if key != 'cacheKey'}
+        except Exception as e:
+            print(f"Area selection stats read error: {str(e)}")
+            _area_selection_stats['counts'] = {}
+        _area_selection_stats['checked_at'] = now
+    
+    counts = _area_selection_stats['counts']
+    popular = sorted(counts, key=lambda key: -counts[key])
+    areas = list(dict.fromkeys(popular + DEFAULT_PREFETCH_AREAS))
+    return areas[:PREFETCH_AREA_COUNT]
+
+
+def prefetch_area_candidates(session_id: Optional[str]) -> Dict[str, Any]:
+    """
+    step1・step2の選択中に、選ばれやすい区・駅の候補集合を並列に取得してプロセス内に保持
+    最終ステップのリクエストは候補の絞り込みのみで応答できる
+    """
+    if not session_id:
+        return {'prefetched': []}
+    
+    started = time.time()
+    # 選択回数の書き込みは最終選択ではなく、こちらの事前取得の呼び出しで優先的に行う
+    flush_area_selections()
+    areas = get_prefetch_areas()
+    with ThreadPoolExecutor(max_workers=max(1, len(areas))) as executor:
+        results = list(executor.map(lambda area_key: get_session_candidates(session_id, get_area_spec(area_key)), areas))
+    
+    prefetched = [area_key for area_key, candidates in zip(areas, results) if candidates is not None]
+    print(json.dumps({'prefetch': prefetched, 'totalMs': round((time.time() - started) * 1000, 1)}, ensure_ascii=False))
+    return {'prefetched': prefetched}
+
+
+def build_filter_spec(filters: Dict[str, Any]) -> FilterSpec:
+    """
+    選択フィルタを検索条件に変換（区 → 駅 → 主要駅エリアの優先順で1つだけ使用）
+    """
+    location = {}
+    if filters.get('ward'):
+        location['ward'] = filters['ward']
+    elif filters.get('station'):
+        location['station'] = filters['station']
+    elif filters.get('area') in AREA_STATION_MAPPING:
+        location['area'] = filters['area']
+    
+    return FilterSpec(
+        fee_type=filters.get('fee_type'),
+        fee_max=filters.get('fee_max'),
+        distance_max=filters.get('distance_max'),
+        bike_types=filters.get('bike_types'),
+        **location
+    )
+
+
 def get_filtered_parking_data(filters: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
     フィルタに基づいてDynamoDBから駐輪場データを取得
     """
-    table = dynamodb.Table(TABLE_NAME)
+    table = get_table()
     
     try:
         # 基本スキャン
-        response = table.scan(Limit=50)  # 最大50件に制限
+        response = table.scan(Limit=50, FilterExpression=Attr('ward').ne(META_WARD))  # 最大50件に制限
         items = response.get('Items', [])
         
         # フィルタリング適用
         filtered_items = []
         for item in items:
-            item = convert_decimal(item)
-            
             # 料金フィルタ
             if 'fee_type' in filters:
                 if filters['fee_type'] == 'free' and item.get('fees', {}).get('daily', 999) > 0:
@@ -360,146 +985,540 @@ def generate_optimized_bedrock_response(selections: Dict[str, Any], parking_data
             'suggestions': ['条件変更', '別のエリアを試す', '新しい検索']
         }
     
-    # 超短縮プロンプト - 東京全域対応
-    step2_choice = selections.get('step2', {}).get('text', '一般的な')
-    
-    # エリア表示の決定（区・市 > step3選択 > area）
-    location_choice = ward or selections.get('step3', {}).get('text', area or 'エリア')
-    
-    # 駐輪場データを最小限に（東京全域データに対応）
-    compact_data = []
-    for p in parking_data[:5]:  # 最大5件
-        # 新しいスキーマ対応（capacity、walkTime、fees構造）
-        available = p.get('capacity', {}).get('available', p.get('available', 0))
-        total = p.get('capacity', {}).get('total', p.get('total', 0))
-        walk_time = p.get('walkTime', p.get('walk_time', 0))
-        daily_fee = p.get('fees', {}).get('daily', p.get('daily_fee', 0))
-        
-        compact_data.append(f"{p['name']}(空{available}/{total},徒歩{walk_time}分,{daily_fee}円)")
-    
-    # 東京全域対応の短縮プロンプト
-    prompt = f"{step2_choice}重視で{location_choice}の駐輪場。{len(compact_data)}件:{'|'.join(compact_data)}。上位3つ推奨理由各1行"
+    max_tokens = choose_max_tokens()
+    version, cache_key, ai_response = lookup_recommendation(selections, parking_data, area, ward, max_tokens)
+    if ai_response is not None:
+        return {
+            'response': ai_response,
+            'parkingLots': parking_data[:3],
+            'suggestions': SELECTION_SUGGESTIONS,
+            'type': 'selection_result'
+        }
     
     try:
-        response = bedrock_runtime.invoke_model(
-            modelId=MODEL_ID,
-            contentType='application/json',
-            accept='application/json',
-            body=json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": MAX_BEDROCK_TOKENS,
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.3
-            })
-        )
+        ai_response = invoke_bedrock_text(build_recommendation_prompt(selections, parking_data, area, ward), max_tokens)
         
-        response_body = json.loads(response['body'].read())
-        ai_response = response_body['content'][0]['text']
+        if cache_key:
+            put_cached_recommendation(cache_key, ai_response, version)
         
         return {
             'response': ai_response,
             'parkingLots': parking_data[:3],
-            'suggestions': ['別の条件で探す', '詳細を確認', '新しい検索'],
+            'suggestions': SELECTION_SUGGESTIONS,
             'type': 'selection_result'
         }
         
     except Exception as e:
         print(f"Bedrock error: {str(e)}")
         # フォールバック（東京全域対応）
-        area_display = ward or area or 'エリア'
         return {
-            'response': f'{area_display}で{len(parking_data)}件の駐輪場が見つかりました！条件にぴったりの場所をご案内します🎯',
+            'response': build_fallback_recommendation(parking_data, area, ward),
             'parkingLots': parking_data[:3],
-            'suggestions': ['別の条件', '詳細確認', '新しい検索'],
+            'suggestions': FALLBACK_SUGGESTIONS,
             'type': 'selection_result'
         }
 
 
+def build_recommendation_prompt(selections: Dict[str, Any], parking_data: List[Dict[str, Any]], area: str = '', ward: str = '') -> str:
+    """
+    推奨文生成用の短縮プロンプトを構築
+    入力トークンの推定がBEDROCK_PROMPT_TOKEN_BUDGET以内に収まるよう、件数（5 → 3件）→ 項目セットの順に減らす
+    """
+    # 超短縮プロンプト - 東京全域対応
+    step2_choice = selections.get('step2', {}).get('text', '一般的な')
+    
+    # エリア表示の決定（区・市 > step3選択 > area）
+    location_choice = ward or selections.get('step3', {}).get('text', area or 'エリア')
+    
+    max_spots = min(PROMPT_MAX_SPOTS, len(parking_data))
+    prompt = ''
+    for count in range(max_spots, min(PROMPT_MIN_SPOTS, max_spots) - 1, -1):
+        for field_set in PROMPT_FIELD_SETS:
+            compact_data = [format_prompt_spot(p, field_set) for p in parking_data[:count]]
+            # 東京全域対応の短縮プロンプト
+            prompt = f"{step2_choice}重視で{location_choice}の駐輪場。{len(compact_data)}件:{'|'.join(compact_data)}。上位3つ推奨理由各1行"
+            if estimate_prompt_tokens(prompt) <= BEDROCK_PROMPT_TOKEN_BUDGET:
+                return prompt
+    
+    # 予算を超える場合も最小構成で送る
+    return prompt
+
+
+def format_prompt_spot(p: Dict[str, Any], field_set: str) -> str:
+    """
+    駐輪場1件をプロンプト用に最小限の文字列へ変換（新しいスキーマ対応：capacity、walkTime、fees構造）
+    """
+    available = p.get('capacity', {}).get('available', p.get('available', 0))
+    total = p.get('capacity', {}).get('total', p.get('total', 0))
+    walk_time = p.get('walkTime', p.get('walk_time', 0))
+    daily_fee = p.get('fees', {}).get('daily', p.get('daily_fee', 0))
+    
+    if field_set == 'compact':
+        return f"{p['name']}(空{available},{daily_fee}円)"
+    if field_set == 'standard':
+        return f"{p['name']}(空{available}/{total},徒歩{walk_time}分,{daily_fee}円)"
+    
+    free_time = p.get('fees', {}).get('freeTime', p.get('free_time', 0))
+    return f"{p['name']}(空{available}/{total},徒歩{walk_time}分,{daily_fee}円,無料{free_time}分)"
+
+
+def estimate_prompt_tokens(prompt: str) -> int:
+    return math.ceil(len(prompt) * BEDROCK_TOKENS_PER_CHAR)
+
+
+def choose_max_tokens() -> int:
+    """
+    実測の生成速度からBEDROCK_LATENCY_BUDGET_MS以内に収まるmax_tokensを選ぶ（MIN_BEDROCK_TOKENS〜MAX_BEDROCK_TOKENS、BEDROCK_TOKENS_STEP刻み）
+    """
+    ms_per_output_token = _bedrock_calibration['ms_per_output_token']
+    if BEDROCK_LATENCY_BUDGET_MS <= 0 or not ms_per_output_token:
+        return MAX_BEDROCK_TOKENS
+    budget_tokens = int(BEDROCK_LATENCY_BUDGET_MS / ms_per_output_token) // BEDROCK_TOKENS_STEP * BEDROCK_TOKENS_STEP
+    return max(MIN_BEDROCK_TOKENS, min(MAX_BEDROCK_TOKENS, budget_tokens))
+
+
+def build_bedrock_request(prompt: str, max_tokens: int = MAX_BEDROCK_TOKENS) -> str:
+    return json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0.3
+    })
+
+
+def record_bedrock_usage(mode: str, prompt: str, max_tokens: int, input_tokens: int, output_tokens: int, latency_ms: float, first_token_ms: Optional[float] = None) -> None:
+    """
+    Bedrock呼び出し1回分のトークン数・待ち時間・推定料金をEMFで出力し、生成速度の推定値を補正
+    推定入力トークン数との差はBEDROCK_TOKENS_PER_CHARの見直しに使う
+    """
+    estimated_input_tokens = estimate_prompt_tokens(prompt)
+    cost = input_tokens / 1000 * BEDROCK_INPUT_PRICE_PER_1K + output_tokens / 1000 * BEDROCK_OUTPUT_PRICE_PER_1K
+    
+    metrics = {
+        'InputTokens': (input_tokens, 'Count'),
+        'OutputTokens': (output_tokens, 'Count'),
+        'LatencyMs': (round(latency_ms, 1), 'Milliseconds'),
+        'EstimatedCostUSD': (round(cost, 8), 'None')
+    }
+    if first_token_ms is not None:
+        metrics['FirstTokenMs'] = (round(first_token_ms, 1), 'Milliseconds')
+    emit_metrics(metrics, {'ModelId': MODEL_ID, 'Mode': mode}, {
+        'promptChars': len(prompt),
+        'estimatedInputTokens': estimated_input_tokens,
+        'maxTokens': max_tokens
+    })
+    
+    alpha = BEDROCK_CALIBRATION_ALPHA
+    if output_tokens:
+        observed = latency_ms / output_tokens
+        previous = _bedrock_calibration['ms_per_output_token']
+        _bedrock_calibration['ms_per_output_token'] = observed if previous is None else (1 - alpha) * previous + alpha * observed
+
+
+def build_fallback_recommendation(parking_data: List[Dict[str, Any]], area: str = '', ward: str = '') -> str:
+    area_display = ward or area or 'エリア'
+    return f'{area_display}で{len(parking_data)}件の駐輪場が見つかりました！条件にぴったりの場所をご案内します🎯'
+
+
+def lookup_recommendation(selections: Dict[str, Any], parking_data: List[Dict[str, Any]], area: str, ward: str, max_tokens: int) -> Tuple[Optional[int], Optional[str], Optional[str]]:
+    """
+    推奨文キャッシュを検索し、(データセットバージョン, キャッシュキー, キャッシュ済み推奨文) を返す
+    同じ選択・同じ駐輪場・同じmax_tokens・同じデータセットの推奨文はキャッシュから返す（バージョン不明時はキャッシュしない）
+    """
+    version = get_dataset_version()
+    cache_key = build_recommendation_cache_key(selections, parking_data, area, ward, max_tokens, version) if version is not None else None
+    cached = get_cached_recommendation(cache_key) if cache_key else None
+    if cached is not None:
+        ai_response, source = cached
+        log_recommendation_cache(source)
+        return version, cache_key, ai_response
+    
+    log_recommendation_cache('miss' if cache_key else 'bypass')
+    return version, cache_key, None
+
+
+def invoke_bedrock_text(prompt: str, max_tokens: Optional[int] = None) -> str:
+    """
+    invoke_modelで推奨文を生成（usage・応答ヘッダーからトークン数を計測）
+    max_tokensはキャッシュキーと同じ値を渡す（省略時は待ち時間予算から選ぶ）
+    """
+    max_tokens = max_tokens or choose_max_tokens()
+    started = time.time()
+    # 失敗・タイムアウトした呼び出しの待ち時間もトレースに含める
+    with span('Bedrock'):
+        response = get_client('bedrock-runtime', region_name=BEDROCK_REGION).invoke_model(
+            modelId=MODEL_ID,
+            contentType='application/json',
+            accept='application/json',
+            body=build_bedrock_request(prompt, max_tokens)
+        )
+        response_body = json.loads(response['body'].read())
+    latency_ms = (time.time() - started) * 1000
+    
+    usage = response_body.get('usage') or {}
+    headers = response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    record_bedrock_usage(
+        'invoke', prompt, max_tokens,
+        int(usage.get('input_tokens', headers.get('x-amzn-bedrock-input-token-count', 0))),
+        int(usage.get('output_tokens', headers.get('x-amzn-bedrock-output-token-count', 0))),
+        latency_ms
+    )
+    return response_body['content'][0]['text']
+
+
+def stream_bedrock_text(prompt: str, max_tokens: Optional[int] = None) -> Iterator[str]:
+    """
+    invoke_model_with_response_streamで生成テキストを差分ごとに取得
+    トークン数はmessage_start・message_deltaのusage（最終チャンクのinvocationMetricsがあればそちら）から計測
+    """
+    max_tokens = max_tokens or choose_max_tokens()
+    started = time.time()
+    response = get_client('bedrock-runtime', region_name=BEDROCK_REGION).invoke_model_with_response_stream(
+        modelId=MODEL_ID,
+        contentType='application/json',
+        accept='application/json',
+        body=build_bedrock_request(prompt, max_tokens)
+    )
+    
+    input_tokens = 0
+    output_tokens = 0
+    first_token_ms = None
+    for event in response['body']:
+        chunk = event.get('chunk')
+        if not chunk:
+            continue
+        payload = json.loads(chunk['bytes'])
+        payload_type = payload.get('type')
+        if payload_type == 'message_start':
+            input_tokens = payload.get('message', {}).get('usage', {}).get('input_tokens', input_tokens)
+        elif payload_type == 'message_delta':
+            output_tokens = payload.get('usage', {}).get('output_tokens', output_tokens)
+        elif payload_type == 'content_block_delta':
+            text = payload.get('delta', {}).get('text')
+            if text:
+                if first_token_ms is None:
+                    first_token_ms = (time.time() - started) * 1000
+                yield text
+        
+        invocation_metrics = payload.get('amazon-bedrock-invocationMetrics')
+        if invocation_metrics:
+            input_tokens = invocation_metrics.get('inputTokenCount', input_tokens)
+            output_tokens = invocation_metrics.get('outputTokenCount', output_tokens)
+    
+    latency_ms = (time.time() - started) * 1000
+    # 差分の送出中もBedrockの待ち時間に含まれるためwith文ではなく終了時に加算
+    record_duration('Bedrock', latency_ms)
+    record_bedrock_usage('stream', prompt, max_tokens, input_tokens, output_tokens, latency_ms, first_token_ms)
+
+
 def get_parking_data() -> List[Dict[str, Any]]:
     """
     DynamoDBから駐輪場データを取得
     """
-    table = dynamodb.Table(TABLE_NAME)
-    
     try:
-        response = table.scan()
-        items = response.get('Items', [])
-        return [convert_decimal(item) for item in items]
+        items, explain = find_parking(FilterSpec())
+        log_explain('all', explain)
+        return items
     except Exception as e:
         print(f"DynamoDB Error: {str(e)}")
         return []
 
 
-def convert_decimal(obj: Any) -> Any:
+def get_quick_summary(scope: str = SUMMARY_SCOPE_ALL, location: str = '') -> Dict[str, Any]:
     """
-    DynamoDBのDecimal型を通常の数値型に変換
+    フリー入力モード用の要約（近い順・空き台数順・安い順の上位）を取得
+    collectorが保存した要約アイテム1件を読み、未作成の場合のみ駅・区市のGSI検索（場所なしは全件）から集計
     """
-    if isinstance(obj, list):
-        return [convert_decimal(item) for item in obj]
-    elif isinstance(obj, dict):
-        return {key: convert_decimal(value) for key, value in obj.items()}
-    elif isinstance(obj, Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-    else:
-        return obj
+    summary = get_spot_summary(scope, location)
+    if summary:
+        return summary
+    if scope == SUMMARY_SCOPE_ALL:
+        return build_spot_summary(get_parking_data())
+    
+    spec = FilterSpec(station=location) if scope == 'station' else FilterSpec(ward=location)
+    try:
+        items, explain = find_parking(spec)
+        log_explain(f'summary_{scope}', explain)
+    except Exception as e:
+        print(f"DynamoDB Error: {str(e)}")
+        items = []
+    return build_spot_summary(items)
+
+
+def get_nearby_parking_data(lat: float, lng: float, radius: float, limit: int) -> List[Dict[str, Any]]:
+    """
+    指定地点から半径内の駐輪場を距離の近い順に取得（calculated_distanceを付与）
+    """
+    index, spots = get_spatial_index()
+    results = []
+    with span('Nearby'):
+        for i, distance in index.nearest(lat, lng, limit, max_distance=radius):
+            spot = dict(spots[i])
+            spot['calculated_distance'] = round(distance)
+            results.append(spot)
+    return results
+
+
+def get_spatial_index() -> Tuple[SpatialGridIndex, List[Dict[str, Any]]]:
+    """
+    全駐輪場の空間索引を取得（SPOT_CACHE_VERSION_CHECK_SECONDS間隔でデータセットバージョンを確認）
+    バージョン不明（収集未実行・取得失敗）の場合はキャッシュせず毎回構築する
+    """
+    version = get_dataset_version()
+    if version is not None and version == _spatial_cache['version'] and _spatial_cache['index'] is not None:
+        return _spatial_cache['index']
+    
+    spots = get_parking_data()
+    index = SpatialGridIndex(
+        [float(spot.get('lat', 0)) for spot in spots],
+        [float(spot.get('lng', 0)) for spot in spots],
+        SPATIAL_GRID_CELL_METERS
+    )
+    _spatial_cache['version'] = version
+    _spatial_cache['index'] = (index, spots) if version is not None else None
+    return index, spots
 
 
-def get_fallback_response(message: str, parking_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+def get_dataset_version() -> Optional[int]:
     """
-    フリー入力モード用のフォールバック応答
+    現在のデータセットバージョンを取得（SPOT_CACHE_VERSION_CHECK_SECONDS間隔で再確認、不明時はNone）
     """
-    lower_message = message.lower()
+    now = time.time()
+    if now - _dataset_version['checked_at'] < SPOT_CACHE_VERSION_CHECK_SECONDS:
+        return _dataset_version['version']
+    
+    try:
+        response = get_table().get_item(Key=DATASET_VERSION_KEY, ProjectionExpression='version')
+        version = response.get('Item', {}).get('version')
+    except Exception as e:
+        print(f"Dataset version check error: {str(e)}")
+        version = None
+    
+    _dataset_version['version'] = version
+    _dataset_version['checked_at'] = now
+    return version
+
+
+def build_recommendation_cache_key(selections: Dict[str, Any], parking_data: List[Dict[str, Any]], area: str, ward: str, max_tokens: int, version: int) -> str:
+    """
+    正規化した選択・プロンプトに含める駐輪場のID・実際に送るmax_tokens・モデル・データセットバージョンから推奨文キャッシュのキーを生成
+    プロンプトは同じ入力から常に同じ文字列になるため、生成後の文字列ではなく入力をキーにする
+    """
+    selection = {
+        'step2': selections.get('step2', {}).get('id', ''),
+        'step3': selections.get('step3', {}).get('id', ''),
+        'area': area.strip(),
+        'ward': ward.strip()
+    }
+    spot_ids = [p.get('id') for p in parking_data[:PROMPT_MAX_SPOTS]]
+    payload = json.dumps([MODEL_ID, max_tokens, version, selection, spot_ids], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get_cached_recommendation(cache_key: str) -> Optional[Tuple[str, str]]:
+    """
+    推奨文をプロセス内LRU → DynamoDBの順に検索し、(推奨文, 取得元) を返す
+    """
+    now = time.time()
+    entry = _recommendation_cache.get(cache_key)
+    if entry is not None and entry[1] > now:
+        _recommendation_cache.move_to_end(cache_key)
+        return entry[0], 'memory'
+    
+    try:
+        response = get_table(RECOMMENDATION_CACHE_TABLE).get_item(Key={'cacheKey': cache_key})
+        item = response.get('Item')
+    except Exception as e:
+        print(f"Recommendation cache read error: {str(e)}")
+        return None
+    
+    # TTLによる削除は遅延するため有効期限も確認
+    if item and item.get('expiresAt', 0) > now:
+        remember_recommendation(cache_key, item['response'], item['expiresAt'])
+        return item['response'], 'dynamodb'
+    return None
+
+
+def put_cached_recommendation(cache_key: str, ai_response: str, version: int) -> None:
+    """
+    推奨文をプロセス内LRUとDynamoDBに保存（書き込み失敗時も応答は継続）
+    """
+    expires_at = int(time.time()) + RECOMMENDATION_CACHE_TTL_SECONDS
+    remember_recommendation(cache_key, ai_response, expires_at)
+    
+    try:
+        get_table(RECOMMENDATION_CACHE_TABLE).put_item(Item={
+            'cacheKey': cache_key,
+            'response': ai_response,
+            'datasetVersion': version,
+            'modelId': MODEL_ID,
+            'expiresAt': expires_at,
+            'createdAt': datetime.now().isoformat()
+        })
+    except Exception as e:
+        print(f"Recommendation cache write error: {str(e)}")
+
+
+def remember_recommendation(cache_key: str, ai_response: str, expires_at: float) -> None:
+    _recommendation_cache[cache_key] = (ai_response, expires_at)
+    _recommendation_cache.move_to_end(cache_key)
+    while len(_recommendation_cache) > RECOMMENDATION_CACHE_SIZE:
+        _recommendation_cache.popitem(last=False)
+
+
+def log_recommendation_cache(source: str) -> None:
+    """
+    推奨文キャッシュの取得元（pregenerated / memory / dynamodb / miss / bypass）とコンテナ内の累計ヒット率をログ出力
+    """
+    stats = _recommendation_cache_stats
+    stats['requests'] += 1
+    if source == 'memory':
+        stats['memory_hits'] += 1
+    elif source == 'dynamodb':
+        stats['dynamodb_hits'] += 1
+    elif source == 'pregenerated':
+        stats['pregenerated_hits'] += 1
+    
+    record_cache('Recommendation', source in ('memory', 'dynamodb', 'pregenerated'))
+    
+    hits = stats['memory_hits'] + stats['dynamodb_hits'] + stats['pregenerated_hits']
+    print(json.dumps({
+        'recommendationCache': source,
+        'requests': stats['requests'],
+        'pregeneratedHits': stats['pregenerated_hits'],
+        'memoryHits': stats['memory_hits'],
+        'dynamodbHits': stats['dynamodb_hits'],
+        'hitRate': round(hits / stats['requests'], 3)
+    }))
+
+
+def get_fallback_response(intent: MessageIntent, summary: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    フリー入力モード用のフォールバック応答（要約アイテムの上位リストから応答し、全件の並べ替えは行わない）
+    """
+    nearest = summary.get('nearest') or []
+    if intent.scope == 'station':
+        area_label = f'{intent.location}駅周辺の'
+        nearest_from = f'{intent.location}駅から'
+    elif intent.scope == 'ward':
+        area_label = f'{intent.location}の'
+        nearest_from = f'{intent.location}で駅から'
+    else:
+        area_label = ''
+        nearest_from = '池袋駅から'
     
     # 挨拶
-    greetings = ['こんにちは', 'こんばんは', 'おはよう', 'はじめまして']
-    if any(greeting in message for greeting in greetings):
+    if intent.intent == 'greeting':
         return {
             'response': 'こんにちは！池袋エリアの駐輪場案内アシスタントです😊 選択肢モードで簡単検索できます！',
             'type': 'greeting',
-            'parkingLots': parking_data[:3],
+            'parkingLots': nearest[:3],
             'suggestions': ['🎯 選択肢モードを試す', '空いている場所', '近い場所', '安い場所']
         }
     
     # 距離関連
-    location_keywords = ['近', '最寄', '駅', '徒歩', '距離']
-    if any(keyword in message for keyword in location_keywords):
-        nearest = sorted(parking_data, key=lambda x: x['distance'])[:3]
+    if nearest and intent.intent == 'nearest':
         return {
-            'response': f'池袋駅から一番近いのは{nearest[0]["name"]}です！徒歩{nearest[0]["walkTime"]}分です🚶‍♂️',
+            'response': f'{nearest_from}一番近いのは{nearest[0]["name"]}です！徒歩{nearest[0]["walkTime"]}分です🚶‍♂️',
             'type': 'nearest',
-            'parkingLots': nearest,
+            'parkingLots': nearest[:3],
             'suggestions': ['空き状況を確認', '料金を比較', '🎯 選択肢モード']
         }
     
     # 空き状況
-    availability_keywords = ['空', '空い', '利用可能', '使える']
-    if any(keyword in message for keyword in availability_keywords):
-        available = sorted(
-            [p for p in parking_data if p['capacity']['available'] > 10],
-            key=lambda x: x['capacity']['available'],
-            reverse=True
-        )[:3]
+    available = [p for p in summary.get('mostAvailable') or [] if p['capacity']['available'] > 10][:3]
+    if available and intent.intent == 'available':
         return {
-            'response': f'今なら{len(available)}ヶ所で空きがあります！一番空いているのは{available[0]["name"]}です🟢',
+            'response': f'今なら{area_label}{len(available)}ヶ所で空きがあります！一番空いているのは{available[0]["name"]}です🟢',
             'type': 'available',
             'parkingLots': available,
             'suggestions': ['もっと空いている場所', '🎯 選択肢モード', '料金を確認']
         }
     
+    # 料金
+    cheapest = (summary.get('cheapest') or [])[:3]
+    if cheapest and intent.intent == 'cheapest':
+        return {
+            'response': f'{area_label}一番安い駐輪場は{cheapest[0]["name"]}です！1日{cheapest[0]["fees"]["daily"]}円です💰',
+            'type': 'cheapest',
+            'parkingLots': cheapest,
+            'suggestions': ['空き状況を確認', '近い場所', '🎯 選択肢モード']
+        }
+    
     # デフォルト応答
     return {
         'response': '選択肢モードで簡単に条件を指定できます！🎯 または、「近い場所」「安い場所」など条件を教えてください😊',
         'type': 'general',
-        'parkingLots': parking_data[:3],
+        'parkingLots': nearest[:3],
         'suggestions': ['🎯 選択肢モードを試す', '空いている駐輪場', '一番近い駐輪場', '料金が安い順']
     }
 
 
-def create_response(status_code: int, body: Dict[str, Any]) -> Dict[str, Any]:
+def get_request_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    """
+    リクエストヘッダーを大文字小文字を区別せず取得（ペイロード v1/v2 両対応）
+    """
+    headers = event.get('headers') or {}
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def accepts_gzip(event: Dict[str, Any]) -> bool:
     """
-    API Gatewayレスポンスを作成
+    Accept-Encodingでgzipが許可されているか判定
+    """
+    accept_encoding = get_request_header(event, 'Accept-Encoding') or ''
+    for encoding in accept_encoding.split(','):
+        token, _, params = encoding.strip().partition(';')
+        if token.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+def compress_response(response: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    クライアントがgzip対応かつ本文がGZIP_MIN_BYTES以上の場合にgzip圧縮（API Gatewayのバイナリパススルー）
+    """
+    body = response.get('body') or ''
+    encoded = body.encode('utf-8')
+    if len(encoded) < GZIP_MIN_BYTES or not accepts_gzip(event):
+        return response
+    
+    response['headers']['Content-Encoding'] = 'gzip'
+    response['headers']['Vary'] = 'Accept-Encoding'
+    with span('Compress'):
+        response['body'] = base64.b64encode(gzip.compress(encoded, compresslevel=GZIP_LEVEL)).decode('ascii')
+    response['isBase64Encoded'] = True
+    return response
+
+
+def create_stream_response(events: Iterator[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    ストリーミングイベントをNDJSONにまとめたAPI Gatewayレスポンスを作成（バッファ経路用）
     """
     return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': STREAM_CONTENT_TYPE,
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
+        },
+        'body': ''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in events)
+    }
+
+
+def create_response(status_code: int, body: Dict[str, Any], event: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    API Gatewayレスポンスを作成（eventを渡した場合はAccept-Encodingに応じてgzip圧縮）
+    """
+    with span('Serialize'):
+        serialized = json.dumps(body, ensure_ascii=False)
+    
+    response = {
         'statusCode': status_code,
         'headers': {
             'Content-Type': 'application/json',
@@ -507,5 +1526,47 @@ def create_response(status_code: int, body: Dict[str, Any]) -> Dict[str, Any]:
             'Access-Control-Allow-Headers': 'Content-Type',
             'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
         },
-        'body': json.dumps(body, ensure_ascii=False)
-    }
\ No newline at end of file
+        'body': serialized
+    }
+    
+    if event is not None:
+        response = compress_response(response, event)
+    
+    return response
+
+
+def serve_streaming(port: int) -> None:
+    """
+    ストリーミングサーバーを起動（http.serverはLambdaのハンドラーでは使わないため、コールドスタートで読み込まないようここで読み込む）
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    class StreamingChatHandler(BaseHTTPRequestHandler):
+        """
+        選択肢モードのイベントをHTTP/1.1チャンク転送で1行ずつ送出するサーバー
+        ローカル検証や、レスポンスストリーミングを中継するWebアダプター配下での実行用
+        """
+        protocol_version = 'HTTP/1.1'
+        
+        def do_POST(self) -> None:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+            
+            self.send_response(200)
+            self.send_header('Content-Type', STREAM_CONTENT_TYPE)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            
+            for event in stream_selection_mode(body):
+                line = (json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8')
+                self.wfile.write(f"{len(line):X}\r\n".encode('ascii') + line + b'\r\n')
+                self.wfile.flush()
+            self.wfile.write(b'0\r\n\r\n')
+            self.wfile.flush()
+    
+    ThreadingHTTPServer(('', port), StreamingChatHandler).serve_forever()
+
+
+if __name__ == '__main__':
+    serve_streaming(int(os.environ.get('PORT', '8080')))
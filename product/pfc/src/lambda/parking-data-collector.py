@@ -1,20 +1,26 @@
 import json
 import os
+import sys
+import time
+import array
+import struct
 import boto3
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
 import logging
-from decimal import Decimal
 # import asyncio
 # import aiohttp
 from concurrent.futures import ThreadPoolExecutor
 import geohash2
 import hashlib
+from dynamodb_codec import DynamoTable
+from pfc_data_access import SUMMARY_TABLE_NAME, build_summary_records, get_client
+from pfc_metrics import record_count, traced, traced_handler
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
+dynamodb = boto3.client('dynamodb')
 # stepfunctions = boto3.client('stepfunctions')
 
 TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', 'pfc-ParkingSpots-table')
@@ -23,6 +29,33 @@ MAX_PARALLEL_WARDS = int(os.environ.get('MAX_PARALLEL_WARDS', '5'))
 BATCH_SIZE = int(os.environ.get('BATCH_SIZE', '100'))
 ENABLE_GEOHASH = os.environ.get('ENABLE_GEOHASH', 'false').lower() == 'true'
 
+# データセットバージョン管理用アイテム（API側のキャッシュ無効化に使用）
+DATASET_VERSION_KEY = {'id': '__dataset_version__', 'ward': '__meta__'}
+
+# スナップショット出力先（SNAPSHOT_BUCKET未設定時はSNAPSHOT_DIRをS3の代替として使用）
+SNAPSHOT_BUCKET = os.environ.get('SNAPSHOT_BUCKET', '')
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', '')
+SNAPSHOT_PREFIX = os.environ.get('SNAPSHOT_PREFIX', 'snapshots/')
+
+# 収集完了後に非同期で呼び出す推奨文事前生成関数（未設定時は呼び出さない）
+RECOMMENDATION_PREGENERATOR_FUNCTION = os.environ.get('RECOMMENDATION_PREGENERATOR_FUNCTION', '')
+
+# スナップショット形式（parking-spots-api の読み込み側と一致させること）
+# ヘッダー → セクションテーブル（offset, length）→ 各列（8バイト境界）→ 文字列テーブル
+SNAPSHOT_MAGIC = b'PFCS'
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<4sHHIIQ')  # magic, format_version, section_count, spot_count, string_count, created_at
+SNAPSHOT_SECTION = struct.Struct('<QQ')
+SNAPSHOT_COLUMNS = (
+    ('lat', 'd'), ('lng', 'd'),
+    ('available', 'i'), ('total', 'i'), ('daily_fee', 'i'), ('free_time', 'i'),
+    ('distance', 'i'), ('walk_time', 'i'),
+    # 以下は文字列テーブルへの参照
+    ('id', 'I'), ('name', 'I'), ('ward', 'I'), ('station', 'I'), ('detail', 'I')
+)
+# 列として保持し、detail（残りの属性のJSON）から除外するキー
+SNAPSHOT_KEY_FIELDS = ('id', 'name', 'ward', 'station', 'lat', 'lng')
+
 # 東京23区 + 主要市部
 TOKYO_AREAS = {
     "23区": [
@@ -94,9 +127,11 @@ MAJOR_STATIONS = {
     "成増": {"lat": 35.7759, "lng": 139.6348, "ward": "板橋区"},
 }
 
+@traced_handler('parking-data-collector')
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     東京全域駐車場データ収集のメインハンドラー
+    TRACE_SAMPLE_RATEの割合の実行で収集・スナップショット・保存等の段階別所要時間を出力
     """
     try:
         logger.info("Starting Tokyo-wide parking data collection...")
@@ -107,12 +142,19 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         # 並列データ収集実行
         collected_data = collect_tokyo_parking_data()
+        record_count('Spots', len(collected_data))
+        
+        # 全件のスナップショットを出力（失敗してもDynamoDBへの保存は継続）
+        snapshot_key = publish_snapshot(collected_data)
         
-        # DynamoDBに保存
-        saved_count = save_to_dynamodb_batch(collected_data)
+        # DynamoDBに保存（APIの実行計画選択に使う件数統計も更新）
+        saved_count = save_to_dynamodb_batch(collected_data, snapshot_key, build_dataset_stats(collected_data))
         
         logger.info(f"Successfully processed {saved_count} parking spots across Tokyo")
         
+        # 新しいデータセットに対するチャット推奨文を事前生成
+        trigger_recommendation_pregeneration()
+        
         return {
             'statusCode': 200,
             'body': json.dumps({
@@ -134,6 +176,7 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             })
         }
 
+@traced('Collect')
 def collect_tokyo_parking_data() -> List[Dict[str, Any]]:
     """
     東京全域の駐車場データを並列収集
@@ -449,11 +492,13 @@ def collect_ikebukuro_only() -> Dict[str, Any]:
         logger.error(f"Error in Ikebukuro fallback: {str(e)}")
         raise
 
-def save_to_dynamodb_batch(parking_data: List[Dict[str, Any]]) -> int:
+@traced('Save')
+def save_to_dynamodb_batch(parking_data: List[Dict[str, Any]], snapshot_key: Optional[str] = None, stats: Optional[Dict[str, Any]] = None) -> int:
     """
     DynamoDBにバッチでデータを保存
+    snapshot_keyはこのデータセットに対応するスナップショット、statsは全件の件数統計（部分収集時はいずれもNone）
     """
-    table = dynamodb.Table(TABLE_NAME)
+    table = DynamoTable(dynamodb, TABLE_NAME)
     saved_count = 0
     
     try:
@@ -461,31 +506,191 @@ def save_to_dynamodb_batch(parking_data: List[Dict[str, Any]]) -> int:
         for i in range(0, len(parking_data), BATCH_SIZE):
             batch = parking_data[i:i + BATCH_SIZE]
             
-            with table.batch_writer() as writer:
-                for spot in batch:
-                    # DynamoDB用にDecimal変換
-                    spot_data = convert_floats_to_decimal(spot)
-                    writer.put_item(Item=spot_data)
-                    saved_count += 1
+            # Decimalを経由せずワイヤ形式に直接変換して書き込み
+            saved_count += table.put_items(batch)
             
             logger.info(f"Saved batch {i//BATCH_SIZE + 1}, total: {saved_count}")
                 
         logger.info(f"Successfully saved {saved_count} items to DynamoDB")
+        
+        # 全件収集時のみ、全体・区・駅ごとの要約（近い順・空き台数順・安い順）を更新（駐輪場テーブルとは別テーブル）
+        if stats:
+            summary_count = DynamoTable(dynamodb, SUMMARY_TABLE_NAME).put_items(build_summary_records(parking_data))
+            logger.info(f"Saved {summary_count} summary records")
+        
+        # 読み取り側のキャッシュを無効化するためバージョンを更新
+        version = bump_dataset_version(table, snapshot_key, stats)
+        logger.info(f"Dataset version bumped to {version}")
+        
         return saved_count
         
     except Exception as e:
         logger.error(f"Failed to save to DynamoDB: {str(e)}")
         raise
 
-def convert_floats_to_decimal(obj: Any) -> Any:
+def bump_dataset_version(table: Any, snapshot_key: Optional[str] = None, stats: Optional[Dict[str, Any]] = None) -> int:
     """
-    floatをDynamoDB用のDecimalに変換
+    データセットバージョンをアトミックにインクリメント
+    スナップショットキーも同時に更新し、バージョンとスナップショットの対応を保証する
+    statsは指定時のみ更新（部分収集では前回の全件統計を残す）
     """
-    if isinstance(obj, list):
-        return [convert_floats_to_decimal(item) for item in obj]
-    elif isinstance(obj, dict):
-        return {key: convert_floats_to_decimal(value) for key, value in obj.items()}
-    elif isinstance(obj, float):
-        return Decimal(str(obj))
-    else:
-        return obj
\ No newline at end of file
+    update_expression = 'ADD version :one SET updatedAt = :updated_at'
+    values = {
+        ':one': 1,
+        ':updated_at': datetime.now().isoformat()
+    }
+    if snapshot_key:
+        update_expression += ', snapshotKey = :snapshot_key'
+        values[':snapshot_key'] = snapshot_key
+    if stats:
+        update_expression += ', stats = :stats'
+        values[':stats'] = stats
+    if not snapshot_key:
+        update_expression += ' REMOVE snapshotKey'
+    
+    response = table.update_item(
+        Key=DATASET_VERSION_KEY,
+        UpdateExpression=update_expression,
+        ExpressionAttributeValues=values,
+        ReturnValues='UPDATED_NEW'
+    )
+    return int(response['Attributes']['version'])
+
+@traced('Stats')
+def build_dataset_stats(parking_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    区・駅ごとの件数とGeoHashセル数（pfc_data_access の実行計画選択で選択度の推定に使用）
+    """
+    wards: Dict[str, int] = {}
+    stations: Dict[str, int] = {}
+    geo_cells = set()
+    
+    for spot in parking_data:
+        if spot.get('ward'):
+            wards[spot['ward']] = wards.get(spot['ward'], 0) + 1
+        if spot.get('station'):
+            stations[spot['station']] = stations.get(spot['station'], 0) + 1
+        if spot.get('geoHash'):
+            geo_cells.add(spot['geoHash'])
+    
+    return {
+        'total': len(parking_data),
+        'wards': wards,
+        'stations': stations,
+        'geoCells': len(geo_cells)
+    }
+
+def build_snapshot(parking_data: List[Dict[str, Any]]) -> bytes:
+    """
+    駐輪場データを列指向のバイナリスナップショットに変換
+    """
+    strings: List[bytes] = []
+    string_refs: Dict[str, int] = {}
+    
+    def string_ref(value: Any) -> int:
+        value = '' if value is None else str(value)
+        ref = string_refs.get(value)
+        if ref is None:
+            ref = string_refs[value] = len(strings)
+            strings.append(value.encode('utf-8'))
+        return ref
+    
+    columns = {name: array.array(code) for name, code in SNAPSHOT_COLUMNS}
+    
+    for spot in parking_data:
+        capacity = spot.get('capacity') or {}
+        fees = spot.get('fees') or {}
+        detail = {key: value for key, value in spot.items() if key not in SNAPSHOT_KEY_FIELDS}
+        
+        columns['lat'].append(float(spot.get('lat') or 0))
+        columns['lng'].append(float(spot.get('lng') or 0))
+        columns['available'].append(int(capacity.get('available') or 0))
+        columns['total'].append(int(capacity.get('total') or 0))
+        columns['daily_fee'].append(int(fees.get('daily') or 0))
+        columns['free_time'].append(int(fees.get('freeTime') or 0))
+        columns['distance'].append(int(spot.get('distance') or 0))
+        columns['walk_time'].append(int(spot.get('walkTime') or 0))
+        columns['id'].append(string_ref(spot['id']))
+        columns['name'].append(string_ref(spot.get('name')))
+        columns['ward'].append(string_ref(spot.get('ward')))
+        columns['station'].append(string_ref(spot.get('station')))
+        columns['detail'].append(string_ref(json.dumps(detail, ensure_ascii=False, separators=(',', ':'))))
+    
+    string_offsets = array.array('I', [0])
+    for encoded in strings:
+        string_offsets.append(string_offsets[-1] + len(encoded))
+    
+    sections = [columns[name] for name, _ in SNAPSHOT_COLUMNS] + [string_offsets]
+    if sys.byteorder == 'big':
+        for section in sections:
+            section.byteswap()
+    payloads = [section.tobytes() for section in sections] + [b''.join(strings)]
+    
+    # 各セクションを8バイト境界に配置
+    offset = SNAPSHOT_HEADER.size + SNAPSHOT_SECTION.size * len(payloads)
+    section_table = []
+    body = bytearray()
+    for payload in payloads:
+        padding = -offset % 8
+        body += b'\0' * padding
+        offset += padding
+        section_table.append(SNAPSHOT_SECTION.pack(offset, len(payload)))
+        body += payload
+        offset += len(payload)
+    
+    header = SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, len(payloads),
+        len(parking_data), len(strings), int(time.time())
+    )
+    return header + b''.join(section_table) + bytes(body)
+
+@traced('Pregenerate')
+def trigger_recommendation_pregeneration() -> None:
+    """
+    推奨文事前生成関数を非同期（Event）で呼び出す（失敗しても収集結果には影響させない）
+    """
+    if not RECOMMENDATION_PREGENERATOR_FUNCTION:
+        return
+    
+    try:
+        get_client('lambda').invoke(
+            FunctionName=RECOMMENDATION_PREGENERATOR_FUNCTION,
+            InvocationType='Event',
+            Payload=json.dumps({'source': 'parking-data-collector'}).encode('utf-8')
+        )
+        logger.info(f"Triggered recommendation pregeneration: {RECOMMENDATION_PREGENERATOR_FUNCTION}")
+    except Exception as e:
+        logger.error(f"Failed to trigger recommendation pregeneration: {str(e)}")
+
+@traced('Snapshot')
+def publish_snapshot(parking_data: List[Dict[str, Any]]) -> Optional[str]:
+    """
+    スナップショットをS3（またはSNAPSHOT_DIR）に書き出し、オブジェクトキーを返す
+    出力先未設定・失敗時はNone（APIはDynamoDBから読み込む）
+    """
+    if not SNAPSHOT_BUCKET and not SNAPSHOT_DIR:
+        return None
+    
+    try:
+        snapshot = build_snapshot(parking_data)
+        key = f"{SNAPSHOT_PREFIX}parking-spots-{datetime.now().strftime('%Y%m%d%H%M%S')}-v{SNAPSHOT_FORMAT_VERSION}.bin"
+        
+        if SNAPSHOT_BUCKET:
+            get_client('s3').put_object(
+                Bucket=SNAPSHOT_BUCKET,
+                Key=key,
+                Body=snapshot,
+                ContentType='application/octet-stream'
+            )
+        else:
+            path = os.path.join(SNAPSHOT_DIR, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(snapshot)
+        
+        logger.info(f"Published snapshot {key} ({len(parking_data)} spots, {len(snapshot)} bytes)")
+        return key
+        
+    except Exception as e:
+        logger.error(f"Failed to publish snapshot: {str(e)}")
+        return None
\ No newline at end of file
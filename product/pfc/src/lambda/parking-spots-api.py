@@ -1,22 +1,107 @@
 import json
 import os
-import boto3
-from typing import Dict, List, Any, Optional
-from decimal import Decimal
+import base64
+import gzip
+import hashlib
+import time
+import mmap
+import struct
+import sys
+from typing import Callable, Dict, List, Any, NamedTuple, Optional, Sequence, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dynamodb_codec import normalize_number
+from pfc_data_access import AREA_STATION_MAPPING, DATASET_VERSION_KEY, FilterSpec, find_parking, get_client, get_table, log_explain, query_page
+from pfc_metrics import record_cache, record_count, span, traced_handler
+from spatial_index import SpatialGridIndex
+from spot_ranking import PRIORITY_WEIGHTS, rank_spots
 
-dynamodb = boto3.resource('dynamodb')
-
-TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', 'pfc-ParkingSpots-table')
 ENABLE_TOKYO_WIDE = os.environ.get('ENABLE_TOKYO_WIDE', 'true').lower() == 'true'
+MAX_FANOUT_WORKERS = int(os.environ.get('MAX_FANOUT_WORKERS', '4'))
+MAX_FANOUT_VALUES = int(os.environ.get('MAX_FANOUT_VALUES', '10'))
+MAX_PAGE_LIMIT = int(os.environ.get('MAX_PAGE_LIMIT', '200'))
+GZIP_MIN_BYTES = int(os.environ.get('GZIP_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+SPOT_CACHE_VERSION_CHECK_SECONDS = float(os.environ.get('SPOT_CACHE_VERSION_CHECK_SECONDS', '30'))
+
+# スナップショット取得元（parking-data-collectorの出力先と一致させること）
+SNAPSHOT_BUCKET = os.environ.get('SNAPSHOT_BUCKET', '')
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', '')
+SNAPSHOT_LOCAL_DIR = os.environ.get('SNAPSHOT_LOCAL_DIR', '/tmp')
+
+# スナップショット形式（parking-data-collector の書き込み側と一致させること）
+SNAPSHOT_MAGIC = b'PFCS'
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<4sHHIIQ')  # magic, format_version, section_count, spot_count, string_count, created_at
+SNAPSHOT_SECTION = struct.Struct('<QQ')
+SNAPSHOT_COLUMNS = (
+    ('lat', 'd'), ('lng', 'd'),
+    ('available', 'i'), ('total', 'i'), ('daily_fee', 'i'), ('free_time', 'i'),
+    ('distance', 'i'), ('walk_time', 'i'),
+    ('id', 'I'), ('name', 'I'), ('ward', 'I'), ('station', 'I'), ('detail', 'I')
+)
+# 区・駅の行索引の並び順（DynamoDBのWardIndex / StationIndexのソートキー）
+SNAPSHOT_INDEX_SORT_KEYS = {'ward': 'station', 'station': 'ward'}
+
+# ウォームコンテナ間で共有する駐輪場キャッシュ（データセットバージョン単位で無効化）
+_spot_cache: Dict[str, Any] = {
+    'version': None,
+    'snapshot_key': None,
+    'snapshot': None,
+    'checked_at': 0.0,
+    'entries': {}
+}
 
+# fields= で指定できる出力フィールドと、その生成に必要なDynamoDB属性
+FIELD_ATTRIBUTES = {
+    'id': ('id',),
+    'name': ('name',),
+    'address': ('address',),
+    'lat': ('lat', 'coordinates'),
+    'lng': ('lng', 'coordinates'),
+    'coordinates': ('lat', 'lng', 'coordinates'),
+    'distance': ('distance',),
+    'walkTime': ('walkTime', 'walk_time'),
+    'price': ('fees', 'daily_fee'),
+    'priceDetails': ('fees', 'daily_fee'),
+    'freeBadge': ('fees', 'free_time'),
+    'hours': ('openHours', 'hours'),
+    'vehicleTypes': ('vehicleTypes', 'bikeTypes'),
+    'paymentMethods': ('paymentMethods',),
+    'paymentMethodsList': ('paymentMethods',),
+    'occupancyRate': ('capacity', 'total', 'available', 'available_spots'),
+    'available': ('capacity', 'available', 'available_spots'),
+    'total': ('capacity', 'total'),
+    'availabilityText': ('capacity', 'total', 'available', 'available_spots'),
+    'availabilityShort': ('capacity', 'available', 'available_spots'),
+    'lastUpdated': ('lastUpdated',),
+    'ward': ('ward',),
+    'station': ('station',),
+    'area': ('area',),
+    'geoHash': ('geoHash',)
+}
+# 正規化とソートに常に必要な属性
+CORE_ATTRIBUTES = ('id', 'name', 'distance')
+# priority= 指定時の総合評価に必要な出力フィールド（fields指定時も読み取り対象に追加）
+RANKING_FIELDS = ('distance', 'price', 'freeBadge', 'available', 'total', 'vehicleTypes')
+
+# 空間索引のセルサイズ（m）
+SPATIAL_GRID_CELL_METERS = float(os.environ.get('SPATIAL_GRID_CELL_METERS', '250'))
+
+@traced_handler('parking-spots-api')
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     駐輪場データAPI のメインハンドラー - 東京全域地理検索対応
+    TRACE_SAMPLE_RATEの割合のリクエストで取得・ランキング・整形等の段階別所要時間を出力
     """
     try:
         # クエリパラメータを取得
         query_params = event.get('queryStringParameters') or {}
         
+        # データセットバージョンとクエリから算出したETagが一致すれば本文を返さない
+        etag = build_etag(get_dataset_version(), query_params)
+        if etag and etag_matches(get_request_header(event, 'If-None-Match'), etag):
+            return create_not_modified_response(etag)
+        
         # 地理検索パラメータ
         ward = query_params.get('ward')
         station = query_params.get('station')
@@ -26,21 +111,79 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         radius = int(query_params.get('radius', 1000))  # デフォルト1km
         limit = int(query_params.get('limit', 50))  # デフォルト50件
         
-        # 東京全域モードが有効かつ地理検索パラメータがある場合
-        if ENABLE_TOKYO_WIDE and (ward or station or area):
-            parking_data = get_parking_data_tokyo_wide(ward, station, area, limit)
-        elif lat and lng:
-            # 座標ベースの近傍検索
-            parking_data = get_parking_data_by_location(float(lat), float(lng), radius, limit)
-        else:
-            # 従来の全件取得
-            parking_data = get_parking_data()
+        # スパースフィールドセット（例: fields=id,lat,lng,available）
+        fields = parse_fields(query_params.get('fields'))
+        
+        # 総合評価による並び替え（例: priority=cost&vehicle=原付、未指定時は距離順）
+        priority = parse_priority(query_params.get('priority'))
+        vehicle = query_params.get('vehicle')
+        query_fields = tuple(sorted(set(fields) | set(RANKING_FIELDS))) if priority and fields else fields
+        
+        # ページネーション（paginate=true または nextToken 指定時のみ、limitがページサイズ）
+        # limitのみの指定は既存クライアントとの互換のため従来の配列レスポンス
+        next_token = query_params.get('nextToken')
+        paginate = is_truthy(query_params.get('paginate')) or next_token is not None
+        if paginate:
+            limit = max(1, min(limit, MAX_PAGE_LIMIT))
+        
+        page_token = None
+        
+        # 地図表示範囲（例: bbox=35.68,139.69,35.70,139.71 ＝ 南西lat,lng,北東lat,lng）
+        bbox = query_params.get('bbox')
+        
+        # 複数の区・駅指定（例: ward=新宿区,渋谷区）
+        wards = split_query_values(ward)
+        stations = split_query_values(station)
+        
+        with span('Fetch'):
+            # 東京全域モードが有効かつ地理検索パラメータがある場合
+            if lat and lng and not (ENABLE_TOKYO_WIDE and (ward or station or area)):
+                # 座標ベースの近傍検索（距離順の上位limit件のため単一ページ）
+                parking_data = get_parking_data_by_location(float(lat), float(lng), radius, limit)
+            elif bbox and not (ENABLE_TOKYO_WIDE and (ward or station or area)):
+                # 矩形検索（単一ページ）
+                parking_data = get_parking_data_in_bbox(*parse_bbox(bbox), limit)
+            elif ENABLE_TOKYO_WIDE and (len(wards) > 1 or (not wards and len(stations) > 1)):
+                # 複数クエリを並列実行してマージ（距離順の上位limit件のため単一ページ）
+                if wards:
+                    parking_data = get_parking_data_multi('ward', wards, limit, query_fields)
+                else:
+                    parking_data = get_parking_data_multi('station', stations, limit, query_fields)
+            elif paginate:
+                if not ENABLE_TOKYO_WIDE:
+                    ward = station = area = None
+                parking_data, page_token = get_parking_page(ward, station, area, limit, next_token, query_fields)
+            elif ENABLE_TOKYO_WIDE and (ward or station or area):
+                parking_data = get_parking_data_tokyo_wide(ward, station, area, limit, query_fields)
+            else:
+                # 従来の全件取得
+                parking_data = get_parking_data(query_fields)
+        record_count('Results', len(parking_data))
+        
+        # 総合評価順に並べ替え（ページネーション時はページ内での並び替え）
+        if priority:
+            with span('Rank'):
+                parking_data = rank_spots(parking_data, priority, vehicle_type=vehicle)
         
         # フロントエンド用のフォーマットに変換
-        formatted_data = format_for_frontend(parking_data)
+        with span('Format'):
+            formatted_data = format_for_frontend(parking_data, fields, keep_order=bool(priority))
+        
+        if paginate:
+            return create_response(200, {
+                'items': formatted_data,
+                'count': len(formatted_data),
+                'nextToken': page_token
+            }, event, etag)
         
-        return create_response(200, formatted_data)
+        return create_response(200, formatted_data, event, etag)
         
+    except ValueError as e:
+        print(f"Invalid request: {str(e)}")
+        return create_response(400, {
+            'error': 'リクエストパラメータが不正です',
+            'message': str(e)
+        })
     except Exception as e:
         print(f"Error: {str(e)}")
         return create_response(500, {
@@ -49,267 +192,784 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         })
 
 
-def get_parking_data_tokyo_wide(ward: Optional[str] = None, station: Optional[str] = None, area: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+def get_parking_data_tokyo_wide(ward: Optional[str] = None, station: Optional[str] = None, area: Optional[str] = None, limit: int = 50, fields: Optional[Tuple[str, ...]] = None) -> List[Dict[str, Any]]:
     """
     東京全域対応：GSIを使用した効率的な地理検索
     """
-    table = dynamodb.Table(TABLE_NAME)
-    
     try:
-        items = []
-        
-        if ward:
-            # WardIndexを使用した区での検索
-            response = table.query(
-                IndexName='WardIndex',
-                KeyConditionExpression='ward = :ward',
-                ExpressionAttributeValues={':ward': ward},
-                Limit=limit
-            )
-            items = response.get('Items', [])
-        elif station:
-            # StationIndexを使用した駅での検索
-            response = table.query(
-                IndexName='StationIndex',
-                KeyConditionExpression='station = :station',
-                ExpressionAttributeValues={':station': station},
-                Limit=limit
-            )
-            items = response.get('Items', [])
-        elif area:
-            # エリア指定による検索（主要駅マッピング）
-            station_mapping = {
-                'shinjuku': '新宿', 'shibuya': '渋谷', 'ikebukuro': '池袋',
-                'tokyo': '東京', 'shinagawa': '品川', 'ueno': '上野',
-                'kichijoji': '吉祥寺', 'tachikawa': '立川', 'machida': '町田'
-            }
-            station_name = station_mapping.get(area, area)
-            response = table.query(
-                IndexName='StationIndex',
-                KeyConditionExpression='station = :station',
-                ExpressionAttributeValues={':station': station_name},
-                Limit=limit
-            )
-            items = response.get('Items', [])
-        else:
-            # 全体スキャン（制限付き）
-            response = table.scan(Limit=limit)
-            items = response.get('Items', [])
-        
-        # Decimalを通常の数値に変換
-        return [convert_decimal(item) for item in items]
+        return get_cached(
+            ('tokyo_wide', ward, station, area, limit, fields),
+            lambda: read_parking_data_tokyo_wide(ward, station, area, limit, fields)
+        )
         
     except Exception as e:
         print(f"Tokyo-wide DynamoDB Error: {str(e)}")
         # フォールバック：従来の方法
-        return get_parking_data()
+        return get_parking_data(fields)
 
 
-def get_parking_data_by_location(lat: float, lng: float, radius: int = 1000, limit: int = 50) -> List[Dict[str, Any]]:
+def read_parking_data_tokyo_wide(ward: Optional[str], station: Optional[str], area: Optional[str], limit: int, fields: Optional[Tuple[str, ...]]) -> List[Dict[str, Any]]:
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return query_snapshot_tokyo_wide(snapshot, ward, station, area, limit)
+    return query_parking_data_tokyo_wide(ward, station, area, limit, fields=fields)[0]
+
+
+def parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    """
+    bboxパラメータ（南西lat,南西lng,北東lat,北東lng）を検証して分解
+    """
+    parts = [float(part) for part in bbox.split(',')]
+    if len(parts) != 4 or parts[0] > parts[2] or parts[1] > parts[3]:
+        raise ValueError(f"Invalid bbox: {bbox}")
+    return parts[0], parts[1], parts[2], parts[3]
+
+
+def is_truthy(value: Optional[str]) -> bool:
     """
-    座標ベースの近傍検索（GeoHashを使用）
+    クエリパラメータの真偽値（true / 1 / yes）を判定
     """
-    table = dynamodb.Table(TABLE_NAME)
+    return (value or '').strip().lower() in ('true', '1', 'yes')
+
+
+def split_query_values(value: Optional[str]) -> List[str]:
+    """
+    カンマ区切りのクエリパラメータを重複なしのリストに分割
+    """
+    if not value:
+        return []
     
+    values = list(dict.fromkeys(v.strip() for v in value.split(',') if v.strip()))
+    if len(values) > MAX_FANOUT_VALUES:
+        raise ValueError(f"Too many values (max {MAX_FANOUT_VALUES}): {value}")
+    return values
+
+
+def get_parking_data_multi(key: str, values: List[str], limit: int = 50, fields: Optional[Tuple[str, ...]] = None) -> List[Dict[str, Any]]:
+    """
+    複数の区（WardIndex）または駅（StationIndex）を並列にクエリし、id重複を除いて距離順の上位limit件を返す
+    """
     try:
-        # 簡易的な近傍検索（実装時はGeoHashライブラリを使用）
-        # ここでは全データを取得してアプリケーション側でフィルタリング
-        response = table.scan(Limit=100)  # 制限付きスキャン
-        items = response.get('Items', [])
+        return get_cached(
+            ('multi', key, tuple(values), limit, fields),
+            lambda: read_parking_data_multi(key, values, limit, fields)
+        )
         
-        # 距離計算とフィルタリング
-        nearby_items = []
+    except Exception as e:
+        print(f"Multi-area DynamoDB Error: {str(e)}")
+        return []
+
+
+def read_parking_data_multi(key: str, values: List[str], limit: int, fields: Optional[Tuple[str, ...]]) -> List[Dict[str, Any]]:
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        # DynamoDBのクエリと同じく、値ごとに索引順の先頭limit件のみを対象にする
+        results = [snapshot.spots(snapshot.rows_for(key, value)[:limit]) for value in values]
+    else:
+        with ThreadPoolExecutor(max_workers=min(MAX_FANOUT_WORKERS, len(values))) as executor:
+            results = list(executor.map(
+                lambda value: find_parking_by(key, value, limit, fields),
+                values
+            ))
+    
+    merged = []
+    seen_ids = set()
+    for items in results:
         for item in items:
-            item_lat = float(item.get('lat', 0))
-            item_lng = float(item.get('lng', 0))
-            
-            # 簡易距離計算（Haversine式の簡略版）
-            distance = calculate_distance(lat, lng, item_lat, item_lng)
-            
-            if distance <= radius:
-                item['calculated_distance'] = distance
-                nearby_items.append(item)
+            if item['id'] not in seen_ids:
+                seen_ids.add(item['id'])
+                merged.append(item)
+    
+    # 特定の区・駅に偏らないよう距離順に並べてから件数を絞る
+    merged.sort(key=lambda item: item.get('distance') or 0)
+    return merged[:limit]
+
+
+def find_parking_by(key: str, value: str, limit: int, fields: Optional[Tuple[str, ...]] = None) -> List[Dict[str, Any]]:
+    """
+    区（key='ward'）または駅（key='station'）1件分をlimit件まで取得
+    """
+    items, explain = find_parking(FilterSpec(**{key: value}), limit, projection_attributes(fields))
+    log_explain(f'multi_{key}', explain)
+    return items
+
+
+def get_parking_page(ward: Optional[str], station: Optional[str], area: Optional[str], limit: int, next_token: Optional[str] = None, fields: Optional[Tuple[str, ...]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    カーソル（nextToken）ベースで1ページ分の駐輪場データを取得
+    """
+    start_key = decode_next_token(next_token) if next_token else None
+    
+    return get_cached(
+        ('page', ward, station, area, limit, next_token, fields),
+        lambda: _load_parking_page(ward, station, area, limit, start_key, fields)
+    )
+
+
+def _load_parking_page(ward: Optional[str], station: Optional[str], area: Optional[str], limit: int, start_key: Optional[Dict[str, Any]], fields: Optional[Tuple[str, ...]]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    items, last_key = query_parking_data_tokyo_wide(ward, station, area, limit, start_key, fields)
+    return items, encode_next_token(last_key) if last_key else None
+
+
+def parse_fields(fields_param: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """
+    fieldsクエリパラメータを検証して出力フィールドのタプルに変換（未指定時はNone＝全フィールド）
+    """
+    if not fields_param:
+        return None
+    
+    fields = {field.strip() for field in fields_param.split(',') if field.strip()}
+    unknown = fields - FIELD_ATTRIBUTES.keys()
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    
+    return tuple(sorted(fields)) if fields else None
+
+
+def parse_priority(priority_param: Optional[str]) -> Optional[str]:
+    """
+    priorityクエリパラメータを検証（未指定時はNone＝距離順）
+    """
+    if not priority_param:
+        return None
+    if priority_param not in PRIORITY_WEIGHTS:
+        raise ValueError(f"Unknown priority: {priority_param}")
+    return priority_param
+
+
+def projection_attributes(fields: Optional[Tuple[str, ...]]) -> Optional[List[str]]:
+    """
+    出力フィールドの生成に必要なDynamoDB属性の一覧（None＝全属性）
+    """
+    if not fields:
+        return None
+    
+    attributes = list(CORE_ATTRIBUTES)
+    for field in fields:
+        for attribute in FIELD_ATTRIBUTES[field]:
+            if attribute not in attributes:
+                attributes.append(attribute)
+    return attributes
+
+
+def encode_next_token(last_evaluated_key: Dict[str, Any]) -> str:
+    """
+    LastEvaluatedKeyを不透明なnextTokenにエンコード
+    """
+    payload = json.dumps(last_evaluated_key, ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_next_token(next_token: str) -> Dict[str, Any]:
+    """
+    nextTokenをExclusiveStartKeyにデコード（キーの形・検索条件との一致はquery_pageで検証、不正な場合はValueError＝400）
+    """
+    try:
+        padded = next_token + '=' * (-len(next_token) % 4)
+        start_key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid nextToken: {str(e)}")
+    
+    if not isinstance(start_key, dict) or not start_key:
+        raise ValueError("Invalid nextToken")
+    return start_key
+
+
+def query_parking_data_tokyo_wide(ward: Optional[str], station: Optional[str], area: Optional[str], limit: int, exclusive_start_key: Optional[Dict[str, Any]] = None, fields: Optional[Tuple[str, ...]] = None) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    区・駅・エリア指定（優先順）でDynamoDBから1ページ分取得（実行計画はpfc_data_accessが選択）
+    """
+    if ward:
+        spec = FilterSpec(ward=ward)
+    elif station:
+        spec = FilterSpec(station=station)
+    elif area:
+        spec = FilterSpec(area=area)
+    else:
+        spec = FilterSpec()
+    
+    items, last_key, explain = query_page(spec, limit, exclusive_start_key, projection_attributes(fields))
+    log_explain('tokyo_wide_page', explain)
+    return items, last_key
+
+
+def get_dataset_version() -> Optional[int]:
+    """
+    現在のデータセットバージョンを取得（SPOT_CACHE_VERSION_CHECK_SECONDS間隔で再確認）
+    """
+    now = time.time()
+    if now - _spot_cache['checked_at'] < SPOT_CACHE_VERSION_CHECK_SECONDS:
+        return _spot_cache['version']
+    
+    try:
+        response = get_table().get_item(Key=DATASET_VERSION_KEY, ProjectionExpression='version, snapshotKey')
+        item = response.get('Item', {})
+        version = int(item['version']) if item.get('version') is not None else None
+        snapshot_key = item.get('snapshotKey')
+    except Exception as e:
+        print(f"Dataset version check error: {str(e)}")
+        version = None
+        snapshot_key = None
+    
+    _spot_cache['checked_at'] = now
+    if version != _spot_cache['version']:
+        _spot_cache['version'] = version
+        _spot_cache['snapshot_key'] = snapshot_key
+        _spot_cache['entries'] = {}
+    
+    return version
+
+
+def get_cached(key: Tuple[Any, ...], loader: Callable[[], Any]) -> Any:
+    """
+    データセットバージョン単位で正規化済みの取得結果をキャッシュ（戻り値は変更しないこと）
+    バージョン不明（収集未実行・取得失敗）の場合はキャッシュせず毎回読み込む
+    """
+    if get_dataset_version() is None:
+        return loader()
+    
+    entries = _spot_cache['entries']
+    record_cache('Spots', key in entries)
+    if key not in entries:
+        entries[key] = loader()
+    
+    return entries[key]
+
+
+class ParkingSnapshot:
+    """
+    parking-data-collectorが出力する列指向スナップショットをmmapで参照する読み取り専用ビュー
+    """
+    
+    def __init__(self, key: str, path: str):
+        self.key = key
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
         
-        # 距離順でソート
-        nearby_items.sort(key=lambda x: x.get('calculated_distance', 999999))
+        magic, format_version, section_count, self.count, string_count, self.created_at = SNAPSHOT_HEADER.unpack_from(buffer, 0)
+        if magic != SNAPSHOT_MAGIC or format_version != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format: {magic!r} v{format_version}")
+        if section_count != len(SNAPSHOT_COLUMNS) + 2:
+            raise ValueError(f"Unexpected snapshot section count: {section_count}")
+        if sys.byteorder == 'big':
+            raise ValueError("Snapshot is little-endian and cannot be mapped on this platform")
         
-        # Decimalを通常の数値に変換
-        return [convert_decimal(item) for item in nearby_items[:limit]]
+        sections = [
+            SNAPSHOT_SECTION.unpack_from(buffer, SNAPSHOT_HEADER.size + i * SNAPSHOT_SECTION.size)
+            for i in range(section_count)
+        ]
+        self.columns = {
+            name: buffer[offset:offset + length].cast(code)
+            for (name, code), (offset, length) in zip(SNAPSHOT_COLUMNS, sections)
+        }
+        offset, length = sections[-2]
+        self._string_offsets = buffer[offset:offset + length].cast('I')
+        offset, length = sections[-1]
+        self._string_data = buffer[offset:offset + length]
         
-    except Exception as e:
-        print(f"Location-based search error: {str(e)}")
-        return []
+        if len(self._string_offsets) != string_count + 1:
+            raise ValueError("Corrupted snapshot string table")
+        
+        self._string_index: Dict[str, Dict[str, List[int]]] = {}
+    
+    def string(self, ref: int) -> str:
+        return str(self._string_data[self._string_offsets[ref]:self._string_offsets[ref + 1]], 'utf-8')
+    
+    def rows_for(self, column: str, value: str) -> List[int]:
+        """
+        ward / station 列が一致する行番号（初回呼び出し時に列ごとの索引を構築）
+        DynamoDBのGSI（WardIndex / StationIndex）と同じくソートキー順、同じソートキー内はid順
+        """
+        index = self._string_index.get(column)
+        if index is None:
+            rows_by_ref: Dict[int, List[int]] = {}
+            for row, ref in enumerate(self.columns[column]):
+                rows_by_ref.setdefault(ref, []).append(row)
+            sort_column = self.columns[SNAPSHOT_INDEX_SORT_KEYS[column]]
+            ids = self.columns['id']
+            
+            def order_key(row: int) -> Tuple[str, str]:
+                # 文字列のコードポイント順はDynamoDBのソートキー（UTF-8バイト列）の順序と一致
+                return self.string(sort_column[row]), self.string(ids[row])
+            
+            index = self._string_index[column] = {
+                self.string(ref): sorted(rows, key=order_key) for ref, rows in rows_by_ref.items()
+            }
+        return index.get(value, [])
+    
+    def spot(self, row: int) -> Dict[str, Any]:
+        """
+        行番号から駐輪場データ（DynamoDBアイテムと同じ形）を復元
+        """
+        columns = self.columns
+        # 数値はDynamoDBから読んだ場合と同じ型（整数値ならint）に揃える
+        spot = json.loads(self.string(columns['detail'][row]), parse_float=parse_snapshot_float)
+        spot['id'] = self.string(columns['id'][row])
+        spot['name'] = self.string(columns['name'][row])
+        spot['ward'] = self.string(columns['ward'][row])
+        spot['station'] = self.string(columns['station'][row])
+        spot['lat'] = normalize_number(columns['lat'][row])
+        spot['lng'] = normalize_number(columns['lng'][row])
+        return spot
+    
+    def spots(self, rows: Optional[Sequence[int]] = None) -> List[Dict[str, Any]]:
+        if rows is None:
+            rows = range(self.count)
+        return [self.spot(row) for row in rows]
+    
+    def close(self) -> None:
+        for view in list(self.columns.values()) + [self._string_offsets, self._string_data]:
+            view.release()
+        self._mmap.close()
+        self._file.close()
 
 
-def calculate_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+def parse_snapshot_float(raw: str) -> Any:
+    return normalize_number(float(raw))
+
+
+def get_snapshot() -> Optional[ParkingSnapshot]:
     """
-    2点間の距離を計算（メートル単位）
+    現在のデータセットバージョンに対応するスナップショットを取得（未公開・読み込み失敗時はNone）
     """
-    import math
+    get_dataset_version()
+    key = _spot_cache['snapshot_key']
+    if not key:
+        return None
     
-    # 地球の半径（km）
-    R = 6371.0
+    snapshot = _spot_cache['snapshot']
+    if snapshot is not None and snapshot.key == key:
+        return snapshot
     
-    # 度をラジアンに変換
-    lat1_rad = math.radians(lat1)
-    lng1_rad = math.radians(lng1)
-    lat2_rad = math.radians(lat2)
-    lng2_rad = math.radians(lng2)
+    try:
+        with span('SnapshotLoad'):
+            if SNAPSHOT_BUCKET:
+                # S3から1オブジェクトとして取得し、ローカルに置いてmmap
+                path = os.path.join(SNAPSHOT_LOCAL_DIR, os.path.basename(key))
+                get_client('s3').download_file(SNAPSHOT_BUCKET, key, path)
+            elif SNAPSHOT_DIR:
+                path = os.path.join(SNAPSHOT_DIR, key)
+            else:
+                return None
+            
+            loaded = ParkingSnapshot(key, path)
+    except Exception as e:
+        print(f"Snapshot load error ({key}): {str(e)}")
+        # 同じキーで再試行し続けないようにDynamoDB読み込みへ切り替える
+        _spot_cache['snapshot_key'] = None
+        return None
     
-    # 差分
-    dlat = lat2_rad - lat1_rad
-    dlng = lng2_rad - lng1_rad
+    if snapshot is not None:
+        snapshot.close()
+        if SNAPSHOT_BUCKET and snapshot.path != loaded.path:
+            try:
+                os.remove(snapshot.path)
+            except OSError:
+                pass
     
-    # Haversine式
-    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlng/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    _spot_cache['snapshot'] = loaded
+    return loaded
+
+
+def query_snapshot_tokyo_wide(snapshot: ParkingSnapshot, ward: Optional[str], station: Optional[str], area: Optional[str], limit: int) -> List[Dict[str, Any]]:
+    """
+    スナップショットから区・駅・エリア指定の駐輪場を取得
+    """
+    if ward:
+        rows = snapshot.rows_for('ward', ward)
+    elif station:
+        rows = snapshot.rows_for('station', station)
+    elif area:
+        rows = snapshot.rows_for('station', AREA_STATION_MAPPING.get(area, area))
+    else:
+        rows = range(snapshot.count)
     
-    # km → m に変換
-    distance = R * c * 1000
+    return snapshot.spots(rows[:limit])
+
+
+def get_parking_data_by_location(lat: float, lng: float, radius: int = 1000, limit: int = 50) -> List[Dict[str, Any]]:
+    """
+    座標ベースの近傍検索（空間索引、構築できない場合はpfc_data_accessの実行計画で取得）
+    """
+    try:
+        spatial = get_spatial_index()
+        if spatial is not None:
+            index, spot_at = spatial
+            results = []
+            for i, distance in index.nearest(lat, lng, limit, max_distance=radius):
+                spot = dict(spot_at(i))
+                spot['calculated_distance'] = distance
+                results.append(spot)
+            return results
+        
+        items, explain = find_parking(FilterSpec(lat=lat, lng=lng, radius=radius), limit)
+        log_explain('location', explain)
+        return items
+        
+    except Exception as e:
+        print(f"Location-based search error: {str(e)}")
+        return []
+
+
+def get_parking_data_in_bbox(min_lat: float, min_lng: float, max_lat: float, max_lng: float, limit: int = 50) -> List[Dict[str, Any]]:
+    """
+    矩形（地図の表示範囲）内の駐輪場を取得（空間索引を使用）
+    """
+    try:
+        spatial = get_spatial_index()
+        if spatial is not None:
+            index, spot_at = spatial
+            return [spot_at(i) for i in index.within_bbox(min_lat, min_lng, max_lat, max_lng)[:limit]]
+        
+        # 索引を構築できない場合は全件から絞り込み
+        return [
+            spot for spot in get_parking_data()
+            if min_lat <= float(spot.get('lat', 0)) <= max_lat and min_lng <= float(spot.get('lng', 0)) <= max_lng
+        ][:limit]
+        
+    except Exception as e:
+        print(f"Bounding box search error: {str(e)}")
+        return []
+
+
+def get_spatial_index() -> Optional[Tuple[SpatialGridIndex, Callable[[int], Dict[str, Any]]]]:
+    """
+    データセットバージョンごとに1回だけ構築する空間索引と、索引番号から駐輪場を取り出す関数
+    バージョン不明の場合は毎回の再構築を避けるためNone
+    駐輪場データの読み込みに失敗した場合もNone（空の索引をキャッシュせず、次のリクエストで再構築する）
+    """
+    if get_dataset_version() is None:
+        return None
+    try:
+        return get_cached(('spatial_index',), build_spatial_index)
+    except Exception as e:
+        print(f"Spatial index build error: {str(e)}")
+        return None
+
+
+def build_spatial_index() -> Tuple[SpatialGridIndex, Callable[[int], Dict[str, Any]]]:
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        # スナップショットの座標列から構築し、駐輪場データは必要な行だけ復元
+        index = SpatialGridIndex(snapshot.columns['lat'], snapshot.columns['lng'], SPATIAL_GRID_CELL_METERS)
+        return index, snapshot.spot
     
-    return distance
+    # 読み込みの失敗はget_parking_dataのように空リストにせず呼び出し元へ伝える
+    spots = get_cached(('all', None), read_parking_data)
+    index = SpatialGridIndex(
+        [float(spot.get('lat', 0)) for spot in spots],
+        [float(spot.get('lng', 0)) for spot in spots],
+        SPATIAL_GRID_CELL_METERS
+    )
+    return index, spots.__getitem__
 
 
-def get_parking_data() -> List[Dict[str, Any]]:
+def get_parking_data(fields: Optional[Tuple[str, ...]] = None) -> List[Dict[str, Any]]:
     """
     DynamoDBから駐輪場データを取得（従来版）
     """
-    table = dynamodb.Table(TABLE_NAME)
-    
     try:
-        response = table.scan()
-        items = response.get('Items', [])
-        
-        # Decimalを通常の数値に変換
-        return [convert_decimal(item) for item in items]
+        return get_cached(('all', fields), lambda: read_parking_data(fields))
         
     except Exception as e:
         print(f"DynamoDB Error: {str(e)}")
         return []
 
 
-def convert_decimal(obj: Any) -> Any:
+def read_parking_data(fields: Optional[Tuple[str, ...]] = None) -> List[Dict[str, Any]]:
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot.spots()
+    return scan_parking_data(fields)
+
+
+def scan_parking_data(fields: Optional[Tuple[str, ...]] = None) -> List[Dict[str, Any]]:
     """
-    DynamoDBのDecimal型を通常の数値型に変換
+    テーブル全体をスキャンして駐輪場データを取得
     """
-    if isinstance(obj, list):
-        return [convert_decimal(item) for item in obj]
-    elif isinstance(obj, dict):
-        return {key: convert_decimal(value) for key, value in obj.items()}
-    elif isinstance(obj, Decimal):
-        if obj % 1 == 0:
-            return int(obj)
-        else:
-            return float(obj)
+    items, explain = find_parking(FilterSpec(), attributes=projection_attributes(fields))
+    log_explain('all', explain)
+    return items
+
+
+class NormalizedSpot(NamedTuple):
+    """
+    新旧スキーマを吸収した駐輪場レコード（ソートと表示文字列の生成で共用）
+    """
+    id: str
+    name: str
+    address: str
+    lat: float
+    lng: float
+    distance: float
+    walk_time: int
+    total: int
+    available: int
+    daily_fee: int
+    fee_details: str
+    free_time: int
+    hours: str
+    vehicle_types: List[str]
+    payment_methods: List[str]
+    last_updated: str
+    ward: str
+    station: str
+    area: str
+    geo_hash: str
+
+
+def normalize_spot(spot: Dict[str, Any]) -> NormalizedSpot:
+    """
+    スキーマを1回だけ判定して駐輪場データを正規化
+    """
+    get = spot.get
+    capacity = get('capacity')
+    fees = get('fees')
+    
+    # 容量・料金はそれぞれ独立に新旧スキーマを判定（片方のみ構造化された移行途中のアイテムあり）
+    if isinstance(capacity, dict):
+        total = capacity['total']
+        available = capacity['available']
+    else:
+        total = spot['total'] if 'total' in spot else (capacity or 0)
+        available = spot['available'] if 'available' in spot else get('available_spots', 0)
+    
+    if isinstance(fees, dict):
+        daily_fee = fees.get('daily', 0)
+        fee_details = fees['details'] if 'details' in fees else f"1日{daily_fee}円"
+        free_time = fees.get('freeTime', 0)
     else:
-        return obj
+        daily_fee = spot['daily_fee'] if 'daily_fee' in spot else (fees or 0)
+        fee_details = f"1日{daily_fee}円"
+        free_time = get('free_time', 0)
+    
+    # 車種データ（旧フィールド名bikeTypesにも対応）
+    vehicle_types = spot['vehicleTypes'] if 'vehicleTypes' in spot else get('bikeTypes', [])
+    if isinstance(vehicle_types, str):
+        vehicle_types = [vehicle_types]
+    
+    # 座標データ（coordinates構造はスキーマとは独立して存在しうる）
+    coordinates = get('coordinates')
+    if isinstance(coordinates, dict):
+        lat = coordinates.get('lat', 0)
+        lng = coordinates.get('lng', 0)
+    else:
+        lat = get('lat', 0)
+        lng = get('lng', 0)
+    
+    distance = spot['distance'] if 'distance' in spot else get('calculated_distance', 0)
+    walk_time = spot['walkTime'] if 'walkTime' in spot else get('walk_time', 0)
+    
+    return NormalizedSpot(
+        id=spot['id'],
+        name=spot['name'],
+        address=get('address', ''),
+        lat=lat,
+        lng=lng,
+        distance=distance,
+        walk_time=walk_time,
+        total=total,
+        available=available,
+        daily_fee=daily_fee,
+        fee_details=fee_details,
+        free_time=free_time,
+        hours=spot['openHours'] if 'openHours' in spot else get('hours', '24時間'),
+        vehicle_types=vehicle_types,
+        payment_methods=get('paymentMethods', ['現金']),
+        last_updated=get('lastUpdated', ''),
+        ward=get('ward', ''),
+        station=get('station', ''),
+        area=get('area', ''),
+        geo_hash=get('geoHash', '')
+    )
+
+
+def render_spot(record: NormalizedSpot) -> Dict[str, Any]:
+    """
+    正規化済みレコードからフロントエンド用の表示データを生成
+    """
+    total = record.total
+    available = record.available
+    occupancy_rate = int(((total - available) / total) * 100) if total > 0 else 0
+    
+    # 無料時間がある場合の表示
+    free_time = record.free_time
+    free_badge = ""
+    if free_time > 0:
+        if free_time >= 60:
+            free_badge = f"{free_time//60}時間無料"
+        else:
+            free_badge = f"{free_time}分無料"
+    
+    lat = record.lat
+    lng = record.lng
+    
+    return {
+        'id': record.id,
+        'name': record.name,
+        'address': record.address,
+        'lat': lat,
+        'lng': lng,
+        'coordinates': {'lat': lat, 'lng': lng},  # 統一フォーマット
+        'distance': f"{int(record.distance)}m",
+        'walkTime': f"徒歩{record.walk_time}分",
+        'price': f"1日{record.daily_fee}円",
+        'priceDetails': record.fee_details,
+        'freeBadge': free_badge,
+        'hours': record.hours,
+        'vehicleTypes': ', '.join(record.vehicle_types),
+        'paymentMethods': ', '.join(record.payment_methods),
+        'paymentMethodsList': record.payment_methods,
+        'occupancyRate': occupancy_rate,
+        'available': available,
+        'total': total,
+        'availabilityText': f"空き {available}台 / 全{total}台",
+        'availabilityShort': f"空き{available}台",
+        'lastUpdated': record.last_updated,
+        # 東京全域対応のメタデータ
+        'ward': record.ward,
+        'station': record.station,
+        'area': record.area,
+        'geoHash': record.geo_hash
+    }
 
 
-def format_for_frontend(parking_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def format_for_frontend(parking_data: List[Dict[str, Any]], fields: Optional[Tuple[str, ...]] = None, keep_order: bool = False) -> List[Dict[str, Any]]:
     """
     フロントエンド用にデータをフォーマット（新旧スキーマ対応）
+    正規化 → 数値の距離でソート → 表示データ生成 の1パス構成
+    fields指定時はそのフィールドのみ出力、keep_order指定時は入力順（総合評価順）を維持
     """
-    formatted = []
+    records = []
     
     for spot in parking_data:
         try:
-            # 容量データの取得（新旧スキーマ対応）
-            if 'capacity' in spot and isinstance(spot['capacity'], dict):
-                total = spot['capacity']['total']
-                available = spot['capacity']['available']
-            else:
-                total = spot.get('total', spot.get('capacity', 0))
-                available = spot.get('available', spot.get('available_spots', 0))
-            
-            occupancy_rate = int(((total - available) / total) * 100) if total > 0 else 0
-            
-            # 料金データの取得（新旧スキーマ対応）
-            if 'fees' in spot and isinstance(spot['fees'], dict):
-                daily_fee = spot['fees'].get('daily', 0)
-                fee_details = spot['fees'].get('details', f"1日{daily_fee}円")
-                free_time = spot['fees'].get('freeTime', 0)
-            else:
-                daily_fee = spot.get('daily_fee', spot.get('fees', 0))
-                fee_details = f"1日{daily_fee}円"
-                free_time = spot.get('free_time', 0)
-            
-            # 無料時間がある場合の表示
-            free_badge = ""
-            if free_time > 0:
-                if free_time >= 60:
-                    free_badge = f"{free_time//60}時間無料"
-                else:
-                    free_badge = f"{free_time}分無料"
-            
-            price_display = f"1日{daily_fee}円"
-            
-            # 座標データの取得（新旧スキーマ対応）
-            if 'coordinates' in spot and isinstance(spot['coordinates'], dict):
-                lat = spot['coordinates'].get('lat', 0)
-                lng = spot['coordinates'].get('lng', 0)
-            else:
-                lat = spot.get('lat', 0)
-                lng = spot.get('lng', 0)
-            
-            # 距離・時間データの取得
-            distance = spot.get('distance', spot.get('calculated_distance', 0))
-            walk_time = spot.get('walkTime', spot.get('walk_time', 0))
-            
-            # 車種データの取得（新旧スキーマ対応）
-            vehicle_types = spot.get('vehicleTypes', spot.get('bikeTypes', []))
-            if isinstance(vehicle_types, str):
-                vehicle_types = [vehicle_types]
-            
-            formatted_spot = {
-                'id': spot['id'],
-                'name': spot['name'],
-                'address': spot.get('address', ''),
-                'lat': lat,
-                'lng': lng,
-                'coordinates': {'lat': lat, 'lng': lng},  # 統一フォーマット
-                'distance': f"{int(distance)}m",
-                'walkTime': f"徒歩{walk_time}分",
-                'price': price_display,
-                'priceDetails': fee_details,
-                'freeBadge': free_badge,
-                'hours': spot.get('openHours', spot.get('hours', '24時間')),
-                'vehicleTypes': ', '.join(vehicle_types),
-                'paymentMethods': ', '.join(spot.get('paymentMethods', ['現金'])),
-                'paymentMethodsList': spot.get('paymentMethods', ['現金']),
-                'occupancyRate': occupancy_rate,
-                'available': available,
-                'total': total,
-                'availabilityText': f"空き {available}台 / 全{total}台",
-                'availabilityShort': f"空き{available}台",
-                'lastUpdated': spot.get('lastUpdated', ''),
-                # 東京全域対応のメタデータ
-                'ward': spot.get('ward', ''),
-                'station': spot.get('station', ''),
-                'area': spot.get('area', ''),
-                'geoHash': spot.get('geoHash', '')
-            }
-            
-            formatted.append(formatted_spot)
-            
+            record = normalize_spot(spot)
+            # 表示文字列と同じ整数距離で並べるため、ここで数値を検証しておく
+            sort_key = int(record.distance)
+            records.append((sort_key, record))
         except Exception as e:
             print(f"Error formatting spot {spot.get('id', 'unknown')}: {str(e)}")
             continue
     
-    # 距離順でソート
-    try:
-        formatted.sort(key=lambda x: int(x['distance'].replace('m', '')))
-    except (ValueError, AttributeError):
-        # ソートに失敗した場合はそのまま返す
-        pass
+    # 距離順でソート（数値のまま比較）
+    if not keep_order:
+        records.sort(key=lambda entry: entry[0])
+    
+    formatted = []
+    for _, record in records:
+        try:
+            spot = render_spot(record)
+            if fields:
+                spot = {key: value for key, value in spot.items() if key in fields}
+            formatted.append(spot)
+        except Exception as e:
+            print(f"Error formatting spot {record.id}: {str(e)}")
+            continue
     
     return formatted
 
 
-def create_response(status_code: int, body: Any) -> Dict[str, Any]:
+def get_request_header(event: Dict[str, Any], name: str) -> Optional[str]:
     """
-    API Gatewayレスポンスを作成
+    リクエストヘッダーを大文字小文字を区別せず取得（ペイロード v1/v2 両対応）
+    """
+    headers = event.get('headers') or {}
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def accepts_gzip(event: Dict[str, Any]) -> bool:
+    """
+    Accept-Encodingでgzipが許可されているか判定
+    """
+    accept_encoding = get_request_header(event, 'Accept-Encoding') or ''
+    for encoding in accept_encoding.split(','):
+        token, _, params = encoding.strip().partition(';')
+        if token.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+def compress_response(response: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    クライアントがgzip対応かつ本文がGZIP_MIN_BYTES以上の場合にgzip圧縮（API Gatewayのバイナリパススルー）
+    """
+    body = response.get('body') or ''
+    encoded = body.encode('utf-8')
+    if len(encoded) < GZIP_MIN_BYTES or not accepts_gzip(event):
+        return response
+    
+    response['headers']['Content-Encoding'] = 'gzip'
+    response['headers']['Vary'] = 'Accept-Encoding'
+    with span('Compress'):
+        response['body'] = base64.b64encode(gzip.compress(encoded, compresslevel=GZIP_LEVEL)).decode('ascii')
+    response['isBase64Encoded'] = True
+    return response
+
+
+def build_etag(version: Optional[int], query_params: Dict[str, Any]) -> Optional[str]:
+    """
+    データセットバージョンとクエリパラメータから弱いETagを生成（バージョン不明時はNone）
+    エンコーディング（gzip有無）に依存しない意味的な同一性を表すため弱いETagとする
+    """
+    if version is None:
+        return None
+    
+    canonical = json.dumps([version, sorted(query_params.items())], ensure_ascii=False, separators=(',', ':'))
+    return f'W/"{hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Matchヘッダーが指定ETagに一致するか判定（弱い比較）
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def create_not_modified_response(etag: str) -> Dict[str, Any]:
+    """
+    304 Not Modified レスポンスを作成
     """
     return {
+        'statusCode': 304,
+        'headers': {
+            'ETag': etag,
+            'Cache-Control': 'no-cache',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
+        },
+        'body': ''
+    }
+
+
+def create_response(status_code: int, body: Any, event: Optional[Dict[str, Any]] = None, etag: Optional[str] = None) -> Dict[str, Any]:
+    """
+    API Gatewayレスポンスを作成
+    eventを渡した場合はAccept-Encodingに応じてgzip圧縮、etagを渡した場合は再検証用ヘッダーを付与
+    """
+    with span('Serialize'):
+        serialized = json.dumps(body, ensure_ascii=False)
+    
+    response = {
         'statusCode': status_code,
         'headers': {
             'Content-Type': 'application/json',
@@ -317,5 +977,14 @@ def create_response(status_code: int, body: Any) -> Dict[str, Any]:
             'Access-Control-Allow-Headers': 'Content-Type',
             'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
         },
-        'body': json.dumps(body, ensure_ascii=False)
-    }
\ No newline at end of file
+        'body': serialized
+    }
+    
+    if etag:
+        response['headers']['ETag'] = etag
+        response['headers']['Cache-Control'] = 'no-cache'
+    
+    if event is not None:
+        response = compress_response(response, event)
+    
+    return response
@@ -0,0 +1,755 @@
+import heapq
+import json
+import math
+import operator
+import os
+import queue
+import threading
+import time
+import boto3
+import geohash2
+from boto3.dynamodb.conditions import Attr, ConditionBase, Key
+from functools import reduce
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dynamodb_codec import DynamoTable
+from spatial_index import METERS_PER_DEGREE_LAT, calculate_distances, select_nearest
+
+# DynamoDBは全ハンドラーのほぼ全リクエストで使うため、初期化フェーズで生成
+dynamodb = boto3.client('dynamodb')
+
+# 一部の経路でしか使わないクライアント（Bedrock・S3・Lambda）は初回使用時に生成して再利用
+_clients: Dict[str, Any] = {}
+_clients_lock = threading.Lock()
+
+TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', 'pfc-ParkingSpots-table')
+SCAN_TOTAL_SEGMENTS = int(os.environ.get('SCAN_TOTAL_SEGMENTS', '4'))
+# 収集側（parking-data-collector）のgeohash2.encode(precision=7)と一致させること
+GEOHASH_PRECISION = int(os.environ.get('GEOHASH_PRECISION', '7'))
+MAX_GEO_QUERY_WORKERS = int(os.environ.get('MAX_GEO_QUERY_WORKERS', '8'))
+PLANNER_STATS_TTL_SECONDS = float(os.environ.get('PLANNER_STATS_TTL_SECONDS', '300'))
+# 料金・距離・車種の条件をFilterExpressionで送る場合の1リクエストの読み取り件数
+FILTER_PAGE_SIZE = int(os.environ.get('FILTER_PAGE_SIZE', '200'))
+# limit件の一致を探す際の読み取り件数の上限（超えた時点で見つかった分だけ返す）
+FILTER_READ_BUDGET = int(os.environ.get('FILTER_READ_BUDGET', '3000'))
+
+# 属性が欠けている場合に matches() が使う料金・距離（FilterExpressionも同じ意味になるよう生成）
+MISSING_FEE = 999
+MISSING_DISTANCE = 999
+
+# 管理用アイテムのパーティション（駐輪場の検索・スキャン対象から除外）
+META_WARD = '__meta__'
+
+# データセットバージョン管理用アイテム（parking-data-collectorが収集ごとに更新し、統計もここに保持）
+DATASET_VERSION_KEY = {'id': '__dataset_version__', 'ward': META_WARD}
+
+# 全体・区・駅ごとの要約アイテム（近い順・空き台数順・安い順の上位SUMMARY_SIZE件、収集ごとに更新）
+# 駐輪場テーブルの検索・スキャン・ページングに混ざらないよう、推奨文キャッシュテーブル（TTL付き）に保存
+SUMMARY_TABLE_NAME = os.environ.get('RECOMMENDATION_CACHE_TABLE', 'pfc-RecommendationCache-table')
+SUMMARY_KEY_PREFIX = 'summary#'
+SUMMARY_TTL_SECONDS = int(os.environ.get('SUMMARY_TTL_SECONDS', '86400'))
+SUMMARY_SIZE = int(os.environ.get('SUMMARY_SIZE', '5'))
+SUMMARY_SCOPE_ALL = 'all'
+
+# エリア指定 → 主要駅マッピング
+AREA_STATION_MAPPING = {
+    'shinjuku': '新宿', 'shibuya': '渋谷', 'ikebukuro': '池袋',
+    'tokyo': '東京', 'shinagawa': '品川', 'ueno': '上野',
+    'kichijoji': '吉祥寺', 'tachikawa': '立川', 'machida': '町田'
+}
+
+# 実行計画
+PLAN_KEY_LOOKUP = 'KeyLookup'
+PLAN_WARD_INDEX = 'WardIndex'
+PLAN_STATION_INDEX = 'StationIndex'
+PLAN_GEO_INDEX = 'GeoIndex'
+PLAN_SCAN = 'ParallelScan'
+# 推定コストが同じ場合の優先順
+PLAN_PREFERENCE = (PLAN_KEY_LOOKUP, PLAN_WARD_INDEX, PLAN_STATION_INDEX, PLAN_GEO_INDEX, PLAN_SCAN)
+# 実行計画ごとのLastEvaluatedKeyの属性（テーブルのキー + GSIのキー）
+PLAN_START_KEY_ATTRIBUTES = {
+    PLAN_KEY_LOOKUP: frozenset(('id', 'ward')),
+    PLAN_WARD_INDEX: frozenset(('id', 'ward', 'station')),
+    PLAN_STATION_INDEX: frozenset(('id', 'ward', 'station')),
+    PLAN_SCAN: frozenset(('id', 'ward'))
+}
+
+# 統計（収集時に作成）がない場合の推定値
+DEFAULT_ESTIMATED_ITEMS = 10000
+DEFAULT_WARD_SELECTIVITY = 1 / 33  # 23区 + 多摩主要10市
+DEFAULT_STATION_SELECTIVITY = 1 / 50
+DEFAULT_ITEMS_PER_GEO_CELL = 2.0
+# 1リクエストあたりの固定コスト（読み取り件数換算）
+REQUEST_COST = 1.0
+
+# 実行計画の選択に使う統計（PLANNER_STATS_TTL_SECONDS間隔で再取得）
+_stats_cache: Dict[str, Any] = {'stats': None, 'checked_at': 0.0}
+
+
+class FilterSpec(NamedTuple):
+    """
+    駐輪場検索の条件（指定された条件はすべてAND）
+    """
+    ward: Optional[str] = None
+    station: Optional[str] = None
+    area: Optional[str] = None
+    spot_id: Optional[str] = None
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+    radius: Optional[float] = None
+    fee_type: Optional[str] = None
+    fee_max: Optional[float] = None
+    distance_max: Optional[float] = None
+    bike_types: Optional[str] = None
+    
+    def station_name(self) -> Optional[str]:
+        if self.station:
+            return self.station
+        if self.area:
+            return AREA_STATION_MAPPING.get(self.area, self.area)
+        return None
+    
+    def has_location(self) -> bool:
+        return self.lat is not None and self.lng is not None
+
+
+class QueryPlan(NamedTuple):
+    """
+    選択した実行計画と、比較した全候補の推定読み取り件数
+    """
+    name: str
+    index: Optional[str]
+    key_condition: Any
+    estimated_reads: float
+    costs: Dict[str, float]
+
+
+def get_client(service: str, **kwargs: Any) -> Any:
+    """
+    boto3クライアントを初回使用時に生成（使わないリクエストのコールドスタートで生成コストを払わない）
+    """
+    client = _clients.get(service)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(service)
+            if client is None:
+                client = _clients[service] = boto3.client(service, **kwargs)
+    return client
+
+
+def get_table(table_name: str = TABLE_NAME) -> DynamoTable:
+    return DynamoTable(dynamodb, table_name)
+
+
+def get_table_stats() -> Dict[str, Any]:
+    """
+    区・駅ごとの件数などの統計を取得（未作成・取得失敗時は空）
+    """
+    now = time.time()
+    if _stats_cache['stats'] is not None and now - _stats_cache['checked_at'] < PLANNER_STATS_TTL_SECONDS:
+        return _stats_cache['stats']
+    
+    try:
+        response = get_table().get_item(Key=DATASET_VERSION_KEY, ProjectionExpression='stats')
+        stats = response.get('Item', {}).get('stats') or {}
+    except Exception as e:
+        print(f"Planner stats error: {str(e)}")
+        stats = {}
+    
+    _stats_cache['stats'] = stats
+    _stats_cache['checked_at'] = now
+    return stats
+
+
+def estimate_costs(spec: FilterSpec, stats: Dict[str, Any], paginated: bool = False) -> Dict[str, float]:
+    """
+    利用可能な各実行計画の推定読み取り件数を算出
+    paginated=True の場合はLastEvaluatedKeyで継続できる計画のみ（GeoIndexは除外）
+    """
+    total = float(stats.get('total') or DEFAULT_ESTIMATED_ITEMS)
+    station = spec.station_name()
+    
+    costs = {PLAN_SCAN: total + SCAN_TOTAL_SEGMENTS * REQUEST_COST}
+    
+    if spec.spot_id:
+        costs[PLAN_KEY_LOOKUP] = REQUEST_COST
+    
+    ward_count = _estimate_count(stats, 'wards', spec.ward, total * DEFAULT_WARD_SELECTIVITY)
+    station_count = _estimate_count(stats, 'stations', station, total * DEFAULT_STATION_SELECTIVITY)
+    # 区と駅の両方を指定した場合はどちらのGSIでも複合キー条件になる（独立と仮定）
+    pair_count = ward_count * station_count / total if total else 0.0
+    
+    if spec.ward:
+        costs[PLAN_WARD_INDEX] = (pair_count if station else ward_count) + REQUEST_COST
+    if station:
+        costs[PLAN_STATION_INDEX] = (pair_count if spec.ward else station_count) + REQUEST_COST
+    
+    if spec.has_location() and spec.radius and not paginated:
+        cell_height, cell_width = _geohash_cell_size(spec.lat, spec.lng)
+        cell_meters = min(
+            cell_height * METERS_PER_DEGREE_LAT,
+            cell_width * METERS_PER_DEGREE_LAT * math.cos(math.radians(spec.lat))
+        )
+        cells = (2 * math.ceil(spec.radius / cell_meters) + 1) ** 2
+        geo_cells = stats.get('geoCells')
+        per_cell = total / geo_cells if geo_cells else DEFAULT_ITEMS_PER_GEO_CELL
+        costs[PLAN_GEO_INDEX] = cells * (per_cell + REQUEST_COST)
+    
+    return costs
+
+
+def _estimate_count(stats: Dict[str, Any], group: str, value: Optional[str], default: float) -> float:
+    if not value:
+        return 0.0
+    counts = stats.get(group)
+    if counts is None:
+        return default
+    # 統計にない値は該当なし
+    return float(counts.get(value, 0))
+
+
+def plan_query(spec: FilterSpec, paginated: bool = False) -> QueryPlan:
+    """
+    推定読み取り件数が最小の実行計画を選択
+    """
+    costs = estimate_costs(spec, get_table_stats(), paginated)
+    name = min((plan for plan in PLAN_PREFERENCE if plan in costs), key=lambda plan: costs[plan])
+    station = spec.station_name()
+    
+    index = None
+    key_condition = None
+    if name == PLAN_KEY_LOOKUP:
+        key_condition = Key('id').eq(spec.spot_id)
+        if spec.ward:
+            key_condition = key_condition & Key('ward').eq(spec.ward)
+    elif name == PLAN_WARD_INDEX:
+        index = 'WardIndex'
+        key_condition = Key('ward').eq(spec.ward)
+        if station:
+            key_condition = key_condition & Key('station').eq(station)
+    elif name == PLAN_STATION_INDEX:
+        index = 'StationIndex'
+        key_condition = Key('station').eq(station)
+        if spec.ward:
+            key_condition = key_condition & Key('ward').eq(spec.ward)
+    elif name == PLAN_GEO_INDEX:
+        index = 'GeoIndex'
+    
+    return QueryPlan(name, index, key_condition, costs[name], costs)
+
+
+def find_parking(spec: FilterSpec, limit: Optional[int] = None, attributes: Optional[Sequence[str]] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    条件に合う駐輪場を最大limit件取得し、実行計画の記録（explain）と共に返す
+    座標指定時は距離の近い順（calculated_distance付き）、それ以外は読み取り順
+    attributes指定時は必要な属性のみ読む（条件の評価に使う属性は自動で追加）
+    """
+    started = time.perf_counter()
+    plan = plan_query(spec)
+    options = build_request_options(spec, attributes)
+    
+    budget_exhausted = False
+    if plan.name == PLAN_GEO_INDEX:
+        items, items_read, requests = _find_by_geohash(spec, limit, options)
+    else:
+        items, items_read, requests, budget_exhausted = _find_by_plan(plan, spec, limit, options)
+    
+    explain = build_explain(plan, started, items_read, len(items), requests)
+    explain['filterPushdown'] = 'FilterExpression' in options
+    explain['readBudgetExhausted'] = budget_exhausted
+    return items, explain
+
+
+def query_page(spec: FilterSpec, limit: int, exclusive_start_key: Optional[Dict[str, Any]] = None, attributes: Optional[Sequence[str]] = None) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]], Dict[str, Any]]:
+    """
+    最大limit件の1ページを取得し、(items, LastEvaluatedKey, explain) を返す
+    FilterExpressionやmatches()で除外された分はページが埋まるか末尾に達するまで続けて読み、
+    LastEvaluatedKeyは返却した最後の項目の位置になるよう残り件数をLimitに指定する
+    """
+    started = time.perf_counter()
+    plan = plan_query(spec, paginated=True)
+    if exclusive_start_key is not None:
+        validate_start_key(plan, spec, exclusive_start_key)
+    request = _build_request(plan, build_request_options(spec, attributes))
+    
+    table = get_table()
+    items: List[Dict[str, Any]] = []
+    scanned = 0
+    requests = 0
+    last_key = exclusive_start_key
+    while True:
+        request['Limit'] = limit - len(items)
+        if last_key:
+            request['ExclusiveStartKey'] = last_key
+        response = table.scan(**request) if plan.name == PLAN_SCAN else table.query(**request)
+        requests += 1
+        scanned += response.get('ScannedCount', 0)
+        items.extend(item for item in response.get('Items', []) if matches(item, spec))
+        last_key = response.get('LastEvaluatedKey')
+        if len(items) >= limit or not last_key:
+            break
+    
+    explain = build_explain(plan, started, scanned, len(items), requests)
+    return items, last_key, explain
+
+
+def validate_start_key(plan: QueryPlan, spec: FilterSpec, start_key: Dict[str, Any]) -> None:
+    """
+    ExclusiveStartKeyが実行計画のキーの形で、キー条件（区・駅）と一致するか検証
+    改ざん・別の検索条件のカーソルをDynamoDBに渡さないよう、不正な場合はValueError
+    """
+    expected = PLAN_START_KEY_ATTRIBUTES.get(plan.name)
+    if expected is None or set(start_key) != expected:
+        raise ValueError("Invalid nextToken: key does not match the query")
+    if not all(isinstance(value, str) and value for value in start_key.values()):
+        raise ValueError("Invalid nextToken: key values must be non-empty strings")
+    
+    # 検索条件で指定した区・駅・idと異なる位置（管理用アイテムを含む）からは再開しない
+    conditions = {'id': spec.spot_id, 'ward': spec.ward, 'station': spec.station_name()}
+    mismatched = any(value is not None and start_key.get(attribute, value) != value for attribute, value in conditions.items())
+    if mismatched or start_key['ward'] == META_WARD:
+        raise ValueError("Invalid nextToken: key does not match the query")
+
+
+def build_request_options(spec: FilterSpec, attributes: Optional[Sequence[str]]) -> Dict[str, Any]:
+    """
+    全ての実行計画に共通するリクエスト引数（ProjectionExpressionとFilterExpression）
+    """
+    options = build_projection(required_attributes(spec, attributes))
+    filter_expression = build_filter_expression(spec)
+    if filter_expression is not None:
+        options['FilterExpression'] = filter_expression
+    return options
+
+
+def _build_request(plan: QueryPlan, options: Dict[str, Any]) -> Dict[str, Any]:
+    request = dict(options)
+    if plan.index:
+        request['IndexName'] = plan.index
+    if plan.key_condition is not None:
+        request['KeyConditionExpression'] = plan.key_condition
+    if plan.name == PLAN_SCAN:
+        exclude_meta = Attr('ward').ne(META_WARD)
+        request['FilterExpression'] = exclude_meta & request['FilterExpression'] if 'FilterExpression' in request else exclude_meta
+    return request
+
+
+def _find_by_plan(plan: QueryPlan, spec: FilterSpec, limit: Optional[int], options: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], int, int, bool]:
+    """
+    キー条件（またはスキャン）でlimit件の一致が揃うまでページを読み進める
+    Limitは一致件数ではなく読み取り件数の上限のため、条件で絞り込む場合は多めに読み、
+    読み取り件数がFILTER_READ_BUDGETに達した時点で打ち切る
+    (items, 読み取り件数, リクエスト数, 読み取り上限で打ち切ったか) を返す
+    """
+    table = get_table()
+    request = _build_request(plan, options)
+    # 距離順に並べる場合は全候補が必要
+    stop_at = None if spec.has_location() else limit
+    page_size = max(stop_at, FILTER_PAGE_SIZE) if stop_at and 'FilterExpression' in options else stop_at
+    
+    items: List[Dict[str, Any]] = []
+    items_read = 0
+    requests = 0
+    budget_exhausted = False
+    
+    if plan.name == PLAN_SCAN and stop_at is None:
+        for response in parallel_scan(table, **request):
+            requests += 1
+            items_read += response.get('ScannedCount', 0)
+            items.extend(item for item in response.get('Items', []) if matches(item, spec))
+    else:
+        operation = table.scan if plan.name == PLAN_SCAN else table.query
+        while True:
+            if page_size:
+                request['Limit'] = min(page_size, FILTER_READ_BUDGET - items_read)
+            response = operation(**request)
+            requests += 1
+            items_read += response.get('ScannedCount', 0)
+            items.extend(item for item in response.get('Items', []) if matches(item, spec))
+            
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key or (stop_at and len(items) >= stop_at):
+                break
+            if stop_at and items_read >= FILTER_READ_BUDGET:
+                budget_exhausted = True
+                break
+            request['ExclusiveStartKey'] = last_key
+    
+    if spec.has_location():
+        items = _nearest_first(spec, items, limit)
+    
+    return items[:limit] if limit is not None else items, items_read, requests, budget_exhausted
+
+
+def _nearest_first(spec: FilterSpec, items: List[Dict[str, Any]], limit: Optional[int]) -> List[Dict[str, Any]]:
+    distances = calculate_distances(
+        spec.lat, spec.lng,
+        [float(item.get('lat', 0)) for item in items],
+        [float(item.get('lng', 0)) for item in items]
+    )
+    candidates = []
+    candidate_distances = []
+    for item, distance in zip(items, distances):
+        if spec.radius is None or distance <= spec.radius:
+            item['calculated_distance'] = float(distance)
+            candidates.append(item)
+            candidate_distances.append(float(distance))
+    
+    nearest = select_nearest(candidate_distances, len(candidates) if limit is None else limit)
+    return [candidates[i] for i in nearest]
+
+
+def _find_by_geohash(spec: FilterSpec, limit: Optional[int], options: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], int, int]:
+    """
+    中心セルから外側へリング単位でGeoHashセルを広げながらGeoIndexを並列クエリし、
+    limit件が確定するか検索半径を覆い尽くした時点で打ち切る
+    """
+    table = get_table()
+    lat, lng, radius = spec.lat, spec.lng, spec.radius
+    
+    center_lat, center_lng, lat_err, lng_err = geohash2.decode_exactly(
+        geohash2.encode(lat, lng, precision=GEOHASH_PRECISION)
+    )
+    cell_height = lat_err * 2
+    cell_width = lng_err * 2
+    
+    # セル1辺の長さ（m）：リング数の上限と打ち切り判定に使用
+    cell_meters = min(
+        cell_height * METERS_PER_DEGREE_LAT,
+        cell_width * METERS_PER_DEGREE_LAT * math.cos(math.radians(lat))
+    )
+    max_ring = int(math.ceil(radius / cell_meters)) + 1
+    
+    candidates = []
+    candidate_distances = []
+    seen_ids = set()
+    items_read = 0
+    requests = 0
+    
+    with ThreadPoolExecutor(max_workers=MAX_GEO_QUERY_WORKERS) as executor:
+        for ring in range(max_ring + 1):
+            # リング内のセルは中心からring-1セル分以上離れているため、
+            # 既にlimit件が揃っていてそれより遠ければ打ち切る
+            ring_min_distance = max(0, ring - 1) * cell_meters
+            if limit is not None and len(candidates) >= limit:
+                kth = select_nearest(candidate_distances, limit)[-1]
+                if candidate_distances[kth] <= ring_min_distance:
+                    break
+            if ring_min_distance > radius:
+                break
+            
+            cells = get_geohash_ring(center_lat, center_lng, cell_height, cell_width, ring)
+            ring_items = []
+            for items, cell_read, cell_requests in executor.map(lambda cell: query_geohash_cell(table, cell, options), cells):
+                items_read += cell_read
+                requests += cell_requests
+                for item in items:
+                    if item['id'] not in seen_ids and matches(item, spec):
+                        seen_ids.add(item['id'])
+                        ring_items.append(item)
+            
+            # リング内の全候補を一括で距離計算
+            distances = calculate_distances(
+                lat, lng,
+                [float(item.get('lat', 0)) for item in ring_items],
+                [float(item.get('lng', 0)) for item in ring_items]
+            )
+            for item, distance in zip(ring_items, distances):
+                if distance <= radius:
+                    item['calculated_distance'] = float(distance)
+                    candidates.append(item)
+                    candidate_distances.append(float(distance))
+    
+    # 距離順の上位limit件を部分選択
+    nearest = select_nearest(candidate_distances, len(candidates) if limit is None else limit)
+    return [candidates[i] for i in nearest], items_read, requests
+
+
+def get_geohash_ring(center_lat: float, center_lng: float, cell_height: float, cell_width: float, ring: int) -> List[str]:
+    """
+    中心セルからringセル離れた外周のGeoHashセル一覧を取得（ring=0は中心セルのみ）
+    """
+    offsets: List[Tuple[int, int]] = []
+    if ring == 0:
+        offsets.append((0, 0))
+    else:
+        for d in range(-ring, ring + 1):
+            offsets.append((d, -ring))
+            offsets.append((d, ring))
+        for d in range(-ring + 1, ring):
+            offsets.append((-ring, d))
+            offsets.append((ring, d))
+    
+    cells = []
+    for dx, dy in offsets:
+        cell_lat = center_lat + dy * cell_height
+        cell_lng = center_lng + dx * cell_width
+        # 極付近・日付変更線はパス（東京圏のみ対象）
+        if -90 <= cell_lat <= 90 and -180 <= cell_lng <= 180:
+            cells.append(geohash2.encode(cell_lat, cell_lng, precision=GEOHASH_PRECISION))
+    return cells
+
+
+def _geohash_cell_size(lat: float, lng: float) -> Tuple[float, float]:
+    _, _, lat_err, lng_err = geohash2.decode_exactly(geohash2.encode(lat, lng, precision=GEOHASH_PRECISION))
+    return lat_err * 2, lng_err * 2
+
+
+def query_geohash_cell(table: Any, cell: str, options: Optional[Dict[str, Any]] = None) -> Tuple[List[Dict[str, Any]], int, int]:
+    """
+    GeoIndexから1セル分の駐輪場を全件取得（ページネーション対応、optionsはProjection/FilterExpression）
+    (items, 読み取り件数, リクエスト数) を返す
+    """
+    items = []
+    items_read = 0
+    requests = 0
+    query_kwargs = {
+        'IndexName': 'GeoIndex',
+        'KeyConditionExpression': Key('geoHash').eq(cell),
+        **(options or {})
+    }
+    
+    while True:
+        response = table.query(**query_kwargs)
+        requests += 1
+        items_read += response.get('ScannedCount', 0)
+        items.extend(response.get('Items', []))
+        
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return items, items_read, requests
+        query_kwargs['ExclusiveStartKey'] = last_key
+
+
+def parallel_scan(table: Any, total_segments: int = SCAN_TOTAL_SEGMENTS, **scan_kwargs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Segment/TotalSegmentsで分割した並列スキャン（LastEvaluatedKeyを最後まで追跡）
+    取得したページ（scanのレスポンス）から順にyieldする
+    """
+    pages: queue.Queue = queue.Queue(maxsize=total_segments * 2)
+    stop = threading.Event()
+    
+    def put(page: Any) -> None:
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+    
+    def scan_segment(segment: int) -> None:
+        kwargs = dict(scan_kwargs, Segment=segment, TotalSegments=total_segments)
+        try:
+            while not stop.is_set():
+                response = table.scan(**kwargs)
+                put(response)
+                
+                last_key = response.get('LastEvaluatedKey')
+                if not last_key:
+                    break
+                kwargs['ExclusiveStartKey'] = last_key
+            put(None)
+        except Exception as e:
+            put(e)
+    
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        for segment in range(total_segments):
+            executor.submit(scan_segment, segment)
+        
+        try:
+            remaining = total_segments
+            while remaining:
+                page = pages.get()
+                if page is None:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield page
+        finally:
+            # 途中終了・例外時はワーカーを停止させる
+            stop.set()
+
+
+def summary_key(scope: str, name: str = '') -> Dict[str, str]:
+    return {'cacheKey': f"{SUMMARY_KEY_PREFIX}{scope}#{name}"}
+
+
+def build_spot_summary(spots: Sequence[Dict[str, Any]], size: int = SUMMARY_SIZE) -> Dict[str, Any]:
+    """
+    駐輪場一覧から、近い順・空き台数順・安い順の上位size件を部分選択で抽出
+    """
+    return {
+        'count': len(spots),
+        'nearest': heapq.nsmallest(size, spots, key=lambda spot: spot.get('distance', MISSING_DISTANCE)),
+        'mostAvailable': heapq.nlargest(size, spots, key=lambda spot: (spot.get('capacity') or {}).get('available', 0)),
+        'cheapest': heapq.nsmallest(size, spots, key=lambda spot: (spot.get('fees') or {}).get('daily', MISSING_FEE))
+    }
+
+
+def build_summary_records(spots: Sequence[Dict[str, Any]], size: int = SUMMARY_SIZE) -> List[Dict[str, Any]]:
+    """
+    全体・区ごと・駅ごとの要約アイテムを生成（parking-data-collectorが全件収集時にSUMMARY_TABLE_NAMEへ保存）
+    収集が止まった場合はSUMMARY_TTL_SECONDS後に失効し、読み取り側は駐輪場テーブルから集計する
+    """
+    groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = {(SUMMARY_SCOPE_ALL, ''): list(spots)}
+    for spot in spots:
+        if spot.get('ward'):
+            groups.setdefault(('ward', spot['ward']), []).append(spot)
+        if spot.get('station'):
+            groups.setdefault(('station', spot['station']), []).append(spot)
+    
+    updated_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+    expires_at = int(time.time()) + SUMMARY_TTL_SECONDS
+    return [
+        {**summary_key(scope, name), 'scope': scope, 'name': name, 'updatedAt': updated_at, 'expiresAt': expires_at, **build_spot_summary(members, size)}
+        for (scope, name), members in groups.items()
+    ]
+
+
+def get_spot_summary(scope: str = SUMMARY_SCOPE_ALL, name: str = '') -> Optional[Dict[str, Any]]:
+    """
+    要約アイテムを1件取得（未作成・取得失敗時はNone）
+    """
+    try:
+        response = get_table(SUMMARY_TABLE_NAME).get_item(Key=summary_key(scope, name))
+    except Exception as e:
+        print(f"Summary read error: {str(e)}")
+        return None
+    
+    # TTLによる削除は遅延するため有効期限も確認
+    item = response.get('Item')
+    if not item or item.get('expiresAt', 0) <= time.time():
+        return None
+    return item
+
+
+def matches(item: Dict[str, Any], spec: FilterSpec) -> bool:
+    """
+    キー条件以外も含め、アイテムが検索条件をすべて満たすか判定
+    """
+    if spec.spot_id and item.get('id') != spec.spot_id:
+        return False
+    if spec.ward and item.get('ward') != spec.ward:
+        return False
+    station = spec.station_name()
+    if station and item.get('station') != station:
+        return False
+    
+    # 料金フィルタ
+    if spec.fee_type == 'free':
+        fees = item.get('fees', {})
+        if fees.get('daily', MISSING_FEE) > 0 and fees.get('hourly', MISSING_FEE) > 0:
+            return False
+    if spec.fee_max is not None:
+        if item.get('fees', {}).get('daily', MISSING_FEE) > spec.fee_max:
+            return False
+    
+    # 距離フィルタ
+    if spec.distance_max is not None:
+        if item.get('distance', MISSING_DISTANCE) > spec.distance_max:
+            return False
+    
+    # 車種フィルタ
+    if spec.bike_types:
+        vehicle_types = item.get('vehicleTypes', [])
+        if not vehicle_types:
+            vehicle_types = item.get('bikeTypes', [])  # 旧フィールド名対応
+        if spec.bike_types not in ' '.join(vehicle_types):
+            return False
+    
+    return True
+
+
+def build_filter_expression(spec: FilterSpec) -> Optional[ConditionBase]:
+    """
+    料金・距離の条件をFilterExpressionに変換（条件外のアイテムをDynamoDB側で除外し転送量を削減）
+    matches() で一致するアイテムを落とさない条件のみ生成し、最終判定は引き続き matches() で行う
+    車種は車種一覧を連結した文字列への部分一致で、containsの要素一致では同じ意味にならないため送らない
+    """
+    conditions = []
+    
+    if spec.fee_type == 'free':
+        conditions.append(Attr('fees.daily').lte(0) | Attr('fees.hourly').lte(0))
+    if spec.fee_max is not None:
+        conditions.append(_lte_or_missing('fees.daily', spec.fee_max, MISSING_FEE))
+    if spec.distance_max is not None:
+        conditions.append(_lte_or_missing('distance', spec.distance_max, MISSING_DISTANCE))
+    
+    if not conditions:
+        return None
+    return reduce(operator.and_, conditions)
+
+
+def _lte_or_missing(attribute: str, limit: float, missing: float) -> ConditionBase:
+    # matches() は属性欠損時に既定値で比較するため、既定値が上限以下なら欠損も一致させる
+    condition = Attr(attribute).lte(limit)
+    if missing <= limit:
+        condition = condition | Attr(attribute).not_exists()
+    return condition
+
+
+def required_attributes(spec: FilterSpec, attributes: Optional[Sequence[str]]) -> Optional[List[str]]:
+    """
+    読み取る属性に、検索条件の評価に必要な属性を追加（None＝全属性）
+    """
+    if attributes is None:
+        return None
+    
+    required = list(attributes)
+    needed = ['id']
+    if spec.ward:
+        needed.append('ward')
+    if spec.station_name():
+        needed.append('station')
+    if spec.has_location():
+        needed += ['lat', 'lng']
+    if spec.fee_type or spec.fee_max is not None:
+        needed.append('fees')
+    if spec.distance_max is not None:
+        needed.append('distance')
+    if spec.bike_types:
+        needed += ['vehicleTypes', 'bikeTypes']
+    
+    for attribute in needed:
+        if attribute not in required:
+            required.append(attribute)
+    return required
+
+
+def build_projection(attributes: Optional[Sequence[str]]) -> Dict[str, Any]:
+    """
+    必要な属性だけを読むProjectionExpressionを生成（None＝全属性）
+    """
+    if not attributes:
+        return {}
+    
+    # 予約語（name, area など）を避けるため全て属性名プレースホルダーを使用
+    names = {f'#f{i}': attribute for i, attribute in enumerate(attributes)}
+    return {
+        'ProjectionExpression': ', '.join(names),
+        'ExpressionAttributeNames': names
+    }
+
+
+def build_explain(plan: QueryPlan, started: float, items_read: int, items_returned: int, requests: int) -> Dict[str, Any]:
+    """
+    実行計画の記録（選択した計画・推定と実績の読み取り件数・所要時間）
+    """
+    return {
+        'plan': plan.name,
+        'index': plan.index,
+        'estimatedReads': round(plan.estimated_reads, 1),
+        'alternatives': {name: round(cost, 1) for name, cost in plan.costs.items()},
+        'itemsRead': items_read,
+        'itemsReturned': items_returned,
+        'requests': requests,
+        'elapsedMs': round((time.perf_counter() - started) * 1000, 1)
+    }
+
+
+def log_explain(label: str, explain: Dict[str, Any]) -> None:
+    """
+    実行計画の記録を1行のJSONでログ出力（CloudWatch Logs Insightsで集計）
+    """
+    print(json.dumps({'queryPlan': label, **explain}, ensure_ascii=False))
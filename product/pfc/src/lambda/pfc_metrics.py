@@ -0,0 +1,179 @@
+import contextlib
+import functools
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# CloudWatchメトリクスの名前空間（Embedded Metric Format、ログ出力のみでPutMetricData不要）
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'PFC')
+
+# 段階別レイテンシを計測するリクエストの割合（0で無効、1で全リクエスト）
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0'))
+
+
+def emit_metrics(metrics: Dict[str, Tuple[float, str]], dimensions: Dict[str, str], properties: Optional[Dict[str, Any]] = None, namespace: str = METRICS_NAMESPACE) -> None:
+    """
+    メトリクスをCloudWatch Embedded Metric Format（EMF）の1行JSONでログ出力
+    metricsは 名前 → (値, 単位)、dimensionsは集計軸、propertiesはメトリクス化しない付加情報（Logs Insightsで検索可能）
+    """
+    record: Dict[str, Any] = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in metrics.items()]
+            }]
+        },
+        **dimensions
+    }
+    if properties:
+        record.update(properties)
+    for name, (value, _) in metrics.items():
+        record[name] = value
+    print(json.dumps(record, ensure_ascii=False))
+
+
+class RequestTrace:
+    """
+    サンプリングされた1リクエスト分の段階別所要時間・件数・キャッシュ結果
+    同じ段階を複数回通った場合は合計する（段階の入れ子はそれぞれに計上）
+    """
+    
+    def __init__(self, function_name: str):
+        self.function_name = function_name
+        self.started = time.perf_counter()
+        self.durations: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.cache: Dict[str, bool] = {}
+        # ワーカースレッド（先読み等）からも記録されるため
+        self._lock = threading.Lock()
+    
+    def add_duration(self, stage: str, elapsed_ms: float) -> None:
+        with self._lock:
+            self.durations[stage] = self.durations.get(stage, 0.0) + elapsed_ms
+    
+    def add_count(self, name: str, value: int) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+    
+    def emit(self) -> None:
+        """
+        段階ごとの <段階>Ms、件数の <名前>Count、キャッシュの <名前>CacheHit（1/0）をEMFで出力
+        """
+        total_ms = (time.perf_counter() - self.started) * 1000
+        metrics: Dict[str, Tuple[float, str]] = {'TotalMs': (round(total_ms, 1), 'Milliseconds')}
+        with self._lock:
+            for stage, elapsed_ms in self.durations.items():
+                metrics[f'{stage}Ms'] = (round(elapsed_ms, 1), 'Milliseconds')
+            for name, value in self.counts.items():
+                metrics[f'{name}Count'] = (value, 'Count')
+            for name, hit in self.cache.items():
+                metrics[f'{name}CacheHit'] = (1 if hit else 0, 'Count')
+        emit_metrics(metrics, {'Function': self.function_name})
+
+
+# 処理中のリクエストのトレース（サンプリング対象外はNone）
+# Lambdaの実行環境は同時に1リクエストしか処理しないため、スレッド共有のモジュール変数で持つ
+_current_trace: Optional[RequestTrace] = None
+
+# サンプリング対象外で返す共有の空コンテキスト（生成コストなし）
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class _Span:
+    """
+    with文の区間の経過時間を現在のトレースの段階に加算
+    """
+    __slots__ = ('stage', 'started')
+    
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.started = 0.0
+    
+    def __enter__(self) -> '_Span':
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info: Any) -> None:
+        trace = _current_trace
+        if trace is not None:
+            trace.add_duration(self.stage, (time.perf_counter() - self.started) * 1000)
+
+
+def span(stage: str) -> Any:
+    """
+    段階の所要時間を計測するコンテキストマネージャー（サンプリング対象外では何もしない）
+    """
+    if _current_trace is None:
+        return _NULL_SPAN
+    return _Span(stage)
+
+
+def traced(stage: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    関数呼び出し全体を段階として計測するデコレーター（ジェネレーター関数には使わないこと）
+    """
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _current_trace is None:
+                return func(*args, **kwargs)
+            with _Span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_duration(stage: str, elapsed_ms: float) -> None:
+    """
+    計測済みの所要時間を段階に加算（ストリーミングなどwith文で囲めない区間用）
+    """
+    trace = _current_trace
+    if trace is not None:
+        trace.add_duration(stage, elapsed_ms)
+
+
+def record_count(name: str, value: int) -> None:
+    """
+    件数（取得アイテム数・候補数など）を加算
+    """
+    trace = _current_trace
+    if trace is not None:
+        trace.add_count(name, value)
+
+
+def record_cache(name: str, hit: bool) -> None:
+    """
+    キャッシュのヒット/ミスを記録（同じリクエストで複数回参照した場合は最後の結果）
+    """
+    trace = _current_trace
+    if trace is not None:
+        trace.cache[name] = hit
+
+
+def traced_handler(function_name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    Lambdaハンドラーをサンプリング対象のリクエストでトレースし、終了時に段階別メトリクスを出力するデコレーター
+    """
+    def decorator(handler: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(handler)
+        def wrapper(event: Any, context: Any) -> Any:
+            global _current_trace
+            if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+                return handler(event, context)
+            
+            trace = _current_trace = RequestTrace(function_name)
+            try:
+                return handler(event, context)
+            finally:
+                _current_trace = None
+                try:
+                    trace.emit()
+                except Exception as e:
+                    print(f"Trace emit error: {str(e)}")
+        return wrapper
+    return decorator
@@ -0,0 +1,238 @@
+import math
+import heapq
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# 地球の半径（m）
+EARTH_RADIUS_M = 6371000.0
+# 緯度1度あたりの距離（m、Haversine式と同じ地球半径を使用）
+METERS_PER_DEGREE_LAT = math.pi * EARTH_RADIUS_M / 180
+# セル境界までの距離の下限に掛ける安全係数（大円距離と平面近似の差を吸収）
+RING_DISTANCE_MARGIN = 0.99
+# NumPyを使う最小件数（少数件では配列化のオーバーヘッドが上回る）
+NUMPY_MIN_BATCH = 64
+# グリッドのセル1辺（m）
+DEFAULT_CELL_METERS = 250.0
+
+# 読み込み済みのNumPy（未読み込みの間はキーなし、未導入ならNone）
+_numpy: Dict[str, Any] = {}
+
+
+def load_numpy() -> Any:
+    """
+    任意依存：レイヤー等でNumPyが利用可能な場合のみ距離計算をベクトル化
+    読み込みに数十msかかるため、NUMPY_MIN_BATCH件以上を処理する初回まで読み込まない（未導入時はNone）
+    """
+    if 'module' not in _numpy:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy['module'] = numpy
+    return _numpy['module']
+
+
+def calculate_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """
+    2点間の距離を計算（メートル単位）
+    """
+    # 地球の半径（km）
+    R = 6371.0
+    
+    # 度をラジアンに変換
+    lat1_rad = math.radians(lat1)
+    lng1_rad = math.radians(lng1)
+    lat2_rad = math.radians(lat2)
+    lng2_rad = math.radians(lng2)
+    
+    # 差分
+    dlat = lat2_rad - lat1_rad
+    dlng = lng2_rad - lng1_rad
+    
+    # Haversine式
+    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlng/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    
+    # km → m に変換
+    distance = R * c * 1000
+    
+    return distance
+
+
+def calculate_distances(lat: float, lng: float, lats: Sequence[float], lngs: Sequence[float]) -> Sequence[float]:
+    """
+    1点から複数地点への距離を一括計算（メートル単位、Haversine式）
+    NumPyが利用可能かつ件数が多い場合は配列演算、それ以外は純Python
+    """
+    lat1_rad = math.radians(lat)
+    lng1_rad = math.radians(lng)
+    cos_lat1 = math.cos(lat1_rad)
+    
+    np = load_numpy() if len(lats) >= NUMPY_MIN_BATCH else None
+    if np is not None:
+        lat2_rad = np.radians(np.asarray(lats, dtype=float))
+        lng2_rad = np.radians(np.asarray(lngs, dtype=float))
+        a = np.sin((lat2_rad - lat1_rad) / 2) ** 2 + cos_lat1 * np.cos(lat2_rad) * np.sin((lng2_rad - lng1_rad) / 2) ** 2
+        return EARTH_RADIUS_M * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    
+    sin = math.sin
+    cos = math.cos
+    radians = math.radians
+    distances = []
+    for lat2, lng2 in zip(lats, lngs):
+        lat2_rad = radians(lat2)
+        a = sin((lat2_rad - lat1_rad) / 2) ** 2 + cos_lat1 * cos(lat2_rad) * sin((radians(lng2) - lng1_rad) / 2) ** 2
+        distances.append(EARTH_RADIUS_M * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a)))
+    return distances
+
+
+def select_nearest(distances: Sequence[float], k: int) -> List[int]:
+    """
+    距離の小さい順に上位k件のインデックスを取得（全件ソートせず部分選択）
+    """
+    n = len(distances)
+    if k <= 0 or n == 0:
+        return []
+    
+    np = load_numpy() if n >= NUMPY_MIN_BATCH else None
+    if np is not None:
+        values = np.asarray(distances, dtype=float)
+        if k < n:
+            top = np.argpartition(values, k - 1)[:k]
+        else:
+            top = np.arange(n)
+        return top[np.argsort(values[top], kind='stable')].tolist()
+    
+    return heapq.nsmallest(k, range(n), key=distances.__getitem__)
+
+
+class SpatialGridIndex:
+    """
+    緯度経度を一定サイズ（既定250m）のセルに分割した一様グリッド索引
+    半径検索・k近傍・矩形検索は対象セルの候補のみを距離計算する
+    """
+    
+    def __init__(self, lats: Sequence[float], lngs: Sequence[float], cell_meters: float = DEFAULT_CELL_METERS):
+        self.lats = [float(lat) for lat in lats]
+        self.lngs = [float(lng) for lng in lngs]
+        self.cell_meters = cell_meters
+        
+        # 経度方向のセル幅はデータ中で最も高緯度の地点を基準にし、
+        # 全セルの実距離がcell_meters以上になるようにする（リング打ち切り判定の前提）
+        max_abs_lat = max((abs(lat) for lat in self.lats), default=0.0)
+        self.cell_lat_deg = cell_meters / METERS_PER_DEGREE_LAT
+        self.cell_lng_deg = cell_meters / (METERS_PER_DEGREE_LAT * max(math.cos(math.radians(max_abs_lat)), 1e-6))
+        
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+        for i, (lat, lng) in enumerate(zip(self.lats, self.lngs)):
+            self.cells.setdefault(self._cell(lat, lng), []).append(i)
+        
+        if self.cells:
+            rows = [cell[0] for cell in self.cells]
+            cols = [cell[1] for cell in self.cells]
+            self._bounds = (min(rows), max(rows), min(cols), max(cols))
+        else:
+            self._bounds = (0, -1, 0, -1)
+    
+    def __len__(self) -> int:
+        return len(self.lats)
+    
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (int(math.floor(lat / self.cell_lat_deg)), int(math.floor(lng / self.cell_lng_deg)))
+    
+    def _candidates_in_cells(self, row_min: int, row_max: int, col_min: int, col_max: int) -> List[int]:
+        min_row, max_row, min_col, max_col = self._bounds
+        row_min, row_max = max(row_min, min_row), min(row_max, max_row)
+        col_min, col_max = max(col_min, min_col), min(col_max, max_col)
+        if row_min > row_max or col_min > col_max:
+            return []
+        
+        candidates: List[int] = []
+        # 対象セル数が実在セル数より多い場合は実在セル側を走査
+        if (row_max - row_min + 1) * (col_max - col_min + 1) > len(self.cells):
+            for (row, col), members in self.cells.items():
+                if row_min <= row <= row_max and col_min <= col <= col_max:
+                    candidates.extend(members)
+        else:
+            cells = self.cells
+            for row in range(row_min, row_max + 1):
+                for col in range(col_min, col_max + 1):
+                    members = cells.get((row, col))
+                    if members:
+                        candidates.extend(members)
+        return candidates
+    
+    def within_bbox(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float) -> List[int]:
+        """
+        矩形内の地点インデックスを取得
+        """
+        row_min, col_min = self._cell(min_lat, min_lng)
+        row_max, col_max = self._cell(max_lat, max_lng)
+        lats = self.lats
+        lngs = self.lngs
+        return [
+            i for i in self._candidates_in_cells(row_min, row_max, col_min, col_max)
+            if min_lat <= lats[i] <= max_lat and min_lng <= lngs[i] <= max_lng
+        ]
+    
+    def within_radius(self, lat: float, lng: float, radius: float) -> List[Tuple[int, float]]:
+        """
+        半径内の地点を (インデックス, 距離m) の距離順リストで取得
+        """
+        dlat = radius / METERS_PER_DEGREE_LAT
+        # 高緯度側ほど同じ距離の経度差が大きくなるため、矩形の高緯度端で経度幅を算出
+        dlng = radius / (METERS_PER_DEGREE_LAT * max(math.cos(math.radians(min(abs(lat) + dlat, 90.0))), 1e-6))
+        candidates = self.within_bbox(lat - dlat, lng - dlng, lat + dlat, lng + dlng)
+        distances = calculate_distances(lat, lng, [self.lats[i] for i in candidates], [self.lngs[i] for i in candidates])
+        
+        results = [(i, float(d)) for i, d in zip(candidates, distances) if d <= radius]
+        results.sort(key=lambda result: result[1])
+        return results
+    
+    def nearest(self, lat: float, lng: float, k: int, max_distance: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        k近傍を (インデックス, 距離m) の距離順リストで取得
+        中心セルからリング単位で広げ、k件目がまだ調べていないリングより近くなった時点で打ち切る
+        """
+        if k <= 0 or not self.cells:
+            return []
+        
+        center_row, center_col = self._cell(lat, lng)
+        min_row, max_row, min_col, max_col = self._bounds
+        # 全セルを覆うのに必要なリング数
+        max_ring = max(abs(center_row - min_row), abs(center_row - max_row), abs(center_col - min_col), abs(center_col - max_col))
+        
+        found: List[Tuple[int, float]] = []
+        for ring in range(max_ring + 1):
+            # ringのセルは中心セルから(ring-1)セル分以上離れている
+            ring_min_distance = max(0, ring - 1) * self.cell_meters * RING_DISTANCE_MARGIN
+            if max_distance is not None and ring_min_distance > max_distance:
+                break
+            if len(found) >= k:
+                kth_distance = heapq.nsmallest(k, (d for _, d in found))[-1]
+                if kth_distance <= ring_min_distance:
+                    break
+            
+            candidates = self._ring_candidates(center_row, center_col, ring)
+            if not candidates:
+                continue
+            distances = calculate_distances(lat, lng, [self.lats[i] for i in candidates], [self.lngs[i] for i in candidates])
+            for i, d in zip(candidates, distances):
+                if max_distance is None or d <= max_distance:
+                    found.append((i, float(d)))
+        
+        nearest = select_nearest([d for _, d in found], k)
+        return [found[i] for i in nearest]
+    
+    def _ring_candidates(self, center_row: int, center_col: int, ring: int) -> List[int]:
+        if ring == 0:
+            return list(self.cells.get((center_row, center_col), []))
+        
+        top = center_row + ring
+        bottom = center_row - ring
+        left = center_col - ring
+        right = center_col + ring
+        candidates = self._candidates_in_cells(top, top, left, right)
+        candidates += self._candidates_in_cells(bottom, bottom, left, right)
+        candidates += self._candidates_in_cells(bottom + 1, top - 1, left, left)
+        candidates += self._candidates_in_cells(bottom + 1, top - 1, right, right)
+        return candidates
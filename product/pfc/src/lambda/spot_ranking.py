@@ -0,0 +1,166 @@
+import json
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+from pfc_data_access import MISSING_DISTANCE, MISSING_FEE
+from spatial_index import NUMPY_MIN_BATCH, load_numpy, select_nearest
+
+
+class RankingWeights(NamedTuple):
+    """
+    各評価軸の重み（0以上、スコアは重みの合計で正規化）
+    """
+    distance: float = 0.0
+    cost: float = 0.0
+    free_time: float = 0.0
+    availability: float = 0.0
+    vehicle: float = 0.0
+
+
+class SpotColumns(NamedTuple):
+    """
+    候補全体の評価値を列ごとにまとめたもの（行は候補の並び順）
+    """
+    distance: Sequence[float]
+    daily_fee: Sequence[float]
+    free_time: Sequence[float]
+    availability: Sequence[float]
+    vehicle_match: Sequence[float]
+
+
+# step2の優先度（SELECTION_MAPPING['step2'][*]['priority']）ごとの既定の重み
+DEFAULT_PRIORITY_WEIGHTS = {
+    'distance': RankingWeights(distance=0.6, cost=0.1, free_time=0.05, availability=0.25),
+    'cost': RankingWeights(distance=0.2, cost=0.5, free_time=0.15, availability=0.15),
+    'vehicle': RankingWeights(distance=0.3, cost=0.1, free_time=0.05, availability=0.15, vehicle=0.4),
+    'balanced': RankingWeights(distance=0.35, cost=0.25, free_time=0.1, availability=0.3)
+}
+DEFAULT_PRIORITY = 'balanced'
+
+
+def load_priority_weights() -> Dict[str, RankingWeights]:
+    """
+    既定の重みを環境変数RANKING_WEIGHTSで上書き
+    例: {"cost": {"cost": 0.7, "distance": 0.3}}（指定した優先度は指定した軸のみの重みになる）
+    """
+    weights = dict(DEFAULT_PRIORITY_WEIGHTS)
+    overrides = os.environ.get('RANKING_WEIGHTS')
+    if overrides:
+        for priority, values in json.loads(overrides).items():
+            weights[priority] = RankingWeights(**{axis: float(value) for axis, value in values.items()})
+    return weights
+
+
+PRIORITY_WEIGHTS = load_priority_weights()
+
+
+def extract_columns(spots: Sequence[Dict[str, Any]], vehicle_type: Optional[str] = None) -> SpotColumns:
+    """
+    駐輪場データ（新旧スキーマ・スナップショット復元データ）から評価に使う列を1パスで抽出
+    距離は現在地からの距離（calculated_distance）があればそちらを使う
+    """
+    distances = []
+    daily_fees = []
+    free_times = []
+    availabilities = []
+    vehicle_matches = []
+    
+    for spot in spots:
+        get = spot.get
+        capacity = get('capacity')
+        fees = get('fees')
+        
+        if isinstance(capacity, dict):
+            total = capacity.get('total') or 0
+            available = capacity.get('available') or 0
+        else:
+            total = get('total') or 0
+            available = get('available', get('available_spots')) or 0
+        
+        if isinstance(fees, dict):
+            daily_fee = fees.get('daily', MISSING_FEE)
+            free_time = fees.get('freeTime') or 0
+        else:
+            daily_fee = get('daily_fee', MISSING_FEE)
+            free_time = get('free_time') or 0
+        
+        distance = get('calculated_distance')
+        if distance is None:
+            distance = get('distance', MISSING_DISTANCE)
+        
+        distances.append(float(distance))
+        daily_fees.append(float(daily_fee))
+        free_times.append(float(free_time))
+        availabilities.append(available / total if total > 0 else 0.0)
+        
+        if vehicle_type:
+            vehicle_types = get('vehicleTypes') or get('bikeTypes') or []
+            if isinstance(vehicle_types, str):
+                vehicle_types = [vehicle_types]
+            vehicle_matches.append(1.0 if vehicle_type in ' '.join(vehicle_types) else 0.0)
+        else:
+            vehicle_matches.append(0.0)
+    
+    return SpotColumns(distances, daily_fees, free_times, availabilities, vehicle_matches)
+
+
+def score_columns(columns: SpotColumns, weights: RankingWeights) -> Sequence[float]:
+    """
+    各列を候補内で0〜1に正規化（距離・料金は小さいほど高評価）し、重み付き平均でスコア化
+    NumPyが利用可能かつ件数が多い場合は配列演算、それ以外は純Python
+    """
+    axes = (
+        (columns.distance, weights.distance, True),
+        (columns.daily_fee, weights.cost, True),
+        (columns.free_time, weights.free_time, False),
+        (columns.availability, weights.availability, False),
+        (columns.vehicle_match, weights.vehicle, False)
+    )
+    total_weight = sum(weight for _, weight, _ in axes) or 1.0
+    n = len(columns.distance)
+    
+    np = load_numpy() if n >= NUMPY_MIN_BATCH else None
+    if np is not None:
+        scores = np.zeros(n)
+        for values, weight, lower_is_better in axes:
+            if not weight:
+                continue
+            array = np.asarray(values, dtype=float)
+            low = array.min()
+            span = array.max() - low
+            if span <= 0:
+                continue
+            normalized = (array - low) / span
+            scores += weight * (1.0 - normalized if lower_is_better else normalized)
+        return scores / total_weight
+    
+    scores = [0.0] * n
+    for values, weight, lower_is_better in axes:
+        if not weight or not n:
+            continue
+        low = min(values)
+        span = max(values) - low
+        if span <= 0:
+            continue
+        for i, value in enumerate(values):
+            normalized = (value - low) / span
+            scores[i] += weight * (1.0 - normalized if lower_is_better else normalized)
+    return [score / total_weight for score in scores]
+
+
+def rank_spots(spots: Sequence[Dict[str, Any]], priority: Optional[str] = None, k: Optional[int] = None, vehicle_type: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    候補全体を優先度の重みでスコア化し、上位k件をスコア順に返す（全件ソートせず部分選択）
+    """
+    if not spots:
+        return []
+    
+    weights = PRIORITY_WEIGHTS.get(priority or DEFAULT_PRIORITY, PRIORITY_WEIGHTS[DEFAULT_PRIORITY])
+    scores = score_columns(extract_columns(spots, vehicle_type), weights)
+    
+    # select_nearestは小さい順の部分選択のため、スコアを負にして上位を選ぶ
+    if isinstance(scores, list):
+        negated = [-score for score in scores]
+    else:
+        negated = -scores
+    top = select_nearest(negated, len(spots) if k is None else k)
+    return [spots[i] for i in top]
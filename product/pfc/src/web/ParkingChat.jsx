@@ -124,6 +124,12 @@ const ParkingChat = () => {
   const [mapCenter, setMapCenter] = useState([35.6762, 139.6503]);
   const [mapZoom, setMapZoom] = useState(11);
   const messagesEndRef = useRef(null);
+  // ページ単位のセッションID（同じエリアの再検索ではサーバー側の候補集合を再利用）
+  const sessionIdRef = useRef(
+    window.crypto && window.crypto.randomUUID
+      ? window.crypto.randomUUID()
+      : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+  );
 
   // 自動スクロール
   const scrollToBottom = () => {
@@ -325,6 +331,7 @@ const ParkingChat = () => {
             selections: updatedSelections,
             step: currentStep,
             isSelectionMode: true,
+            sessionId: sessionIdRef.current,
             area: option.area,
             ward: option.ward
           })
@@ -350,7 +357,21 @@ const ParkingChat = () => {
         setCurrentStep(1);
         setSelections({});
       } else if (currentStep < 3) {
-        // ステップ1-2: ローカル処理
+        // ステップ1-2: ローカル処理（選ばれやすいエリアの候補をサーバー側で先読み、応答は待たない）
+        fetch(API_ENDPOINT, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify({
+            selections: updatedSelections,
+            step: currentStep,
+            isSelectionMode: true,
+            prefetch: true,
+            sessionId: sessionIdRef.current
+          })
+        }).catch(() => {});
+
         const nextStep = currentStep + 1;
         const stepData = ChatFlow[`step${nextStep}`];
         
@@ -0,0 +1,116 @@
+import importlib.util
+import os
+import random
+import sys
+from decimal import Decimal
+from pathlib import Path
+
+import boto3
+import geohash2
+import pytest
+from moto import mock_aws
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-northeast-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+LAMBDA_DIR = Path(__file__).resolve().parents[1] / 'src' / 'lambda'
+sys.path.insert(0, str(LAMBDA_DIR))
+
+# Lambdaレイヤーの共有モジュール（テストごとに読み直し、プロセス内キャッシュ・クライアントを持ち越さない）
+SHARED_MODULES = ['dynamodb_codec', 'spatial_index', 'pfc_data_access', 'spot_ranking', 'keyword_matcher', 'pfc_metrics']
+
+SPOTS_TABLE_NAME = 'pfc-ParkingSpots-table'
+CACHE_TABLE_NAME = 'pfc-RecommendationCache-table'
+
+WARDS = ['新宿区', '渋谷区', '豊島区']
+STATIONS = ['新宿', '渋谷', '池袋', '代々木']
+FEES = [
+    {'hourly': 100, 'daily': 600, 'freeTime': 120, 'details': '1日600円'},
+    {'hourly': 50, 'daily': 200, 'freeTime': 60, 'details': '1日200円'},
+    {'hourly': 0, 'daily': 150, 'freeTime': 180, 'details': '3時間無料'},
+    {'hourly': 0, 'daily': 0, 'freeTime': 0, 'details': '無料'}
+]
+VEHICLE_TYPES = [['自転車'], ['自転車', '原付'], ['原付', 'バイク']]
+
+
+def load_lambda(name):
+    """
+    ハイフンを含むLambdaのファイル名（park-finder-chat.pyなど）をモジュールとして読み込む
+    """
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), LAMBDA_DIR / f'{name}.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_spots(count, seed=1):
+    rng = random.Random(seed)
+    spots = []
+    for i in range(count):
+        lat = 35.65 + rng.random() * 0.1
+        lng = 139.65 + rng.random() * 0.1
+        spots.append({
+            'id': f'spot-{i:04d}',
+            'name': f'駐輪場{i}',
+            'ward': rng.choice(WARDS),
+            'station': rng.choice(STATIONS),
+            'lat': Decimal(str(round(lat, 6))),
+            'lng': Decimal(str(round(lng, 6))),
+            'geoHash': geohash2.encode(lat, lng, precision=7),
+            'distance': rng.choice([30, 80, 150, 190, 250, 400, 600]),
+            'walkTime': rng.randint(1, 8),
+            'capacity': {'total': 100, 'available': rng.randint(0, 100)},
+            'fees': dict(rng.choice(FEES)),
+            'vehicleTypes': list(rng.choice(VEHICLE_TYPES)),
+            'paymentMethods': ['現金'],
+            'openHours': '24時間',
+            'lastUpdated': '2026-01-01T00:00:00'
+        })
+    return spots
+
+
+@pytest.fixture
+def aws():
+    for name in SHARED_MODULES:
+        sys.modules.pop(name, None)
+    with mock_aws():
+        yield
+
+
+@pytest.fixture
+def spots_table(aws):
+    client = boto3.client('dynamodb')
+    client.create_table(
+        TableName=SPOTS_TABLE_NAME,
+        BillingMode='PAY_PER_REQUEST',
+        KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}, {'AttributeName': 'ward', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[{'AttributeName': name, 'AttributeType': 'S'} for name in ['id', 'ward', 'station', 'geoHash']],
+        GlobalSecondaryIndexes=[
+            {'IndexName': 'WardIndex', 'KeySchema': [{'AttributeName': 'ward', 'KeyType': 'HASH'}, {'AttributeName': 'station', 'KeyType': 'RANGE'}], 'Projection': {'ProjectionType': 'ALL'}},
+            {'IndexName': 'StationIndex', 'KeySchema': [{'AttributeName': 'station', 'KeyType': 'HASH'}, {'AttributeName': 'ward', 'KeyType': 'RANGE'}], 'Projection': {'ProjectionType': 'ALL'}},
+            {'IndexName': 'GeoIndex', 'KeySchema': [{'AttributeName': 'geoHash', 'KeyType': 'HASH'}, {'AttributeName': 'id', 'KeyType': 'RANGE'}], 'Projection': {'ProjectionType': 'ALL'}}
+        ]
+    )
+    return boto3.resource('dynamodb').Table(SPOTS_TABLE_NAME)
+
+
+@pytest.fixture
+def cache_table(aws):
+    boto3.client('dynamodb').create_table(
+        TableName=CACHE_TABLE_NAME,
+        BillingMode='PAY_PER_REQUEST',
+        KeySchema=[{'AttributeName': 'cacheKey', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'cacheKey', 'AttributeType': 'S'}]
+    )
+    return boto3.resource('dynamodb').Table(CACHE_TABLE_NAME)
+
+
+@pytest.fixture
+def spots(spots_table):
+    items = make_spots(600)
+    with spots_table.batch_writer() as writer:
+        for item in items:
+            writer.put_item(Item=item)
+        writer.put_item(Item={'id': '__dataset_version__', 'ward': '__meta__', 'version': 1})
+    return items
@@ -0,0 +1,76 @@
+import pytest
+
+from conftest import load_lambda
+
+STEP2_PREDICATES = {
+    'free': lambda spot: spot['fees']['daily'] == 0 or spot['fees']['hourly'] == 0,
+    'cheap': lambda spot: spot['fees']['daily'] <= 300,
+    'near_station': lambda spot: spot['distance'] <= 200,
+    'motorcycle': lambda spot: '原付' in spot['vehicleTypes'],
+    'bicycle': lambda spot: '自転車' in spot['vehicleTypes']
+}
+
+
+@pytest.fixture
+def chat(spots, cache_table):
+    return load_lambda('park-finder-chat')
+
+
+def selection_filters(chat, step2_id, ward='新宿区'):
+    return chat.build_filters_from_selections({'step2': {'id': step2_id}}, '', ward)
+
+
+@pytest.mark.parametrize('step2_id', sorted(STEP2_PREDICATES))
+def test_step2_predicates_are_honored(chat, spots, step2_id):
+    results = chat.get_filtered_parking_data_tokyo_wide(selection_filters(chat, step2_id))
+
+    expected = [spot for spot in spots if spot['ward'] == '新宿区' and STEP2_PREDICATES[step2_id](spot)]
+    assert results
+    assert len(results) == min(15, len(expected))
+    assert all(STEP2_PREDICATES[step2_id](spot) for spot in results)
+
+
+def test_step2_filter_reaches_filter_spec(chat):
+    spec = chat.build_filter_spec(selection_filters(chat, 'near_station'))
+
+    assert spec.distance_max == 200
+    assert 'filter' not in selection_filters(chat, 'near_station')
+
+
+def test_vehicle_choice_reaches_ranking(chat, monkeypatch):
+    ranked = []
+    rank_spots = chat.rank_spots
+
+    def recording_rank_spots(spots, priority=None, k=None, vehicle_type=None):
+        ranked.append((priority, vehicle_type))
+        return rank_spots(spots, priority, k, vehicle_type=vehicle_type)
+
+    monkeypatch.setattr(chat, 'rank_spots', recording_rank_spots)
+    motorcycle = chat.get_filtered_parking_data_tokyo_wide(selection_filters(chat, 'motorcycle'))
+    bicycle = chat.get_filtered_parking_data_tokyo_wide(selection_filters(chat, 'bicycle'))
+
+    assert ranked == [('vehicle', '原付'), ('vehicle', '自転車')]
+    assert [spot['id'] for spot in motorcycle] != [spot['id'] for spot in bicycle]
+
+
+@pytest.mark.parametrize('step2_id', sorted(STEP2_PREDICATES))
+def test_area_candidates_rank_like_table_search(chat, step2_id):
+    filters = selection_filters(chat, step2_id)
+    uncached = chat.get_filtered_parking_data_tokyo_wide(filters)
+    cached = chat.get_filtered_parking_data_tokyo_wide(filters, 'session-1')
+
+    assert 'ward#新宿区' in chat._area_candidates
+    assert [spot['id'] for spot in cached] == [spot['id'] for spot in uncached]
+
+
+def test_pregeneration_falls_back_to_major_areas(chat):
+    assert chat.get_pregeneration_wards()[:3] == ['新宿区', '渋谷区', '豊島区']
+
+
+def test_pregenerated_lots_match_the_choice(chat, cache_table, monkeypatch):
+    monkeypatch.setattr(chat, 'invoke_bedrock_text', lambda prompt, max_tokens=None: '推奨文')
+
+    assert chat.pregenerate_recommendation('near_station', '新宿区', 1) == 'generated'
+    item = cache_table.get_item(Key={'cacheKey': chat.build_pregenerated_key('near_station', '新宿区')})['Item']
+    assert item['responseData']['parkingLots']
+    assert all(spot['distance'] <= 200 for spot in item['responseData']['parkingLots'])
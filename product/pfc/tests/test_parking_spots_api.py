@@ -0,0 +1,77 @@
+import json
+import pytest
+
+from conftest import load_lambda
+
+SHINJUKU_BBOX = (35.65, 139.65, 35.75, 139.75)
+
+
+@pytest.fixture
+def api(spots, monkeypatch):
+    monkeypatch.setenv('SPOT_CACHE_VERSION_CHECK_SECONDS', '0')
+    return load_lambda('parking-spots-api')
+
+
+def test_failed_load_does_not_cache_empty_spatial_index(api, monkeypatch):
+    find_parking = api.find_parking
+
+    def failing_find_parking(*args, **kwargs):
+        raise RuntimeError('ProvisionedThroughputExceededException')
+
+    monkeypatch.setattr(api, 'find_parking', failing_find_parking)
+    assert api.get_parking_data_in_bbox(*SHINJUKU_BBOX) == []
+
+    monkeypatch.setattr(api, 'find_parking', find_parking)
+    assert len(api.get_parking_data_in_bbox(*SHINJUKU_BBOX)) == 50
+    assert api.get_parking_data_by_location(35.7, 139.7, 1000, 10)
+
+
+@pytest.fixture
+def snapshot_api(spots, spots_table, tmp_path, monkeypatch):
+    collector = load_lambda('parking-data-collector')
+    (tmp_path / 'snapshot.bin').write_bytes(collector.build_snapshot(json.loads(json.dumps(spots, default=float))))
+    spots_table.put_item(Item={'id': '__dataset_version__', 'ward': '__meta__', 'version': 2, 'snapshotKey': 'snapshot.bin'})
+    monkeypatch.setenv('SNAPSHOT_DIR', str(tmp_path))
+    monkeypatch.setenv('SPOT_CACHE_VERSION_CHECK_SECONDS', '0')
+    return load_lambda('parking-spots-api')
+
+
+@pytest.mark.parametrize('key, values', [('ward', ['新宿区', '渋谷区']), ('station', ['新宿', '池袋', '代々木'])])
+def test_multi_value_snapshot_matches_dynamodb(snapshot_api, monkeypatch, key, values):
+    from_snapshot = snapshot_api.read_parking_data_multi(key, values, 20, None)
+    assert snapshot_api._spot_cache['snapshot'] is not None
+
+    monkeypatch.setattr(snapshot_api, 'get_snapshot', lambda: None)
+    from_dynamodb = snapshot_api.read_parking_data_multi(key, values, 20, None)
+
+    assert len(from_snapshot) == 20
+    assert [spot['id'] for spot in from_snapshot] == [spot['id'] for spot in from_dynamodb]
+
+
+def get_page(api, **params):
+    response = api.lambda_handler({'queryStringParameters': {'paginate': 'true', 'limit': '5', **params}}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+def test_next_token_round_trip(api):
+    status, first = get_page(api, ward='新宿区')
+    status_next, second = get_page(api, ward='新宿区', nextToken=first['nextToken'])
+
+    assert (status, status_next) == (200, 200)
+    assert not {spot['id'] for spot in first['items']} & {spot['id'] for spot in second['items']}
+
+
+@pytest.mark.parametrize('token', [
+    'not-base64!',
+    None,  # 別の区のカーソル
+    'eyJpZCI6InNwb3QtMDAwMSJ9',  # {"id":"spot-0001"}
+    'eyJpZCI6MSwid2FyZCI6Ilx1NjViMFx1NWJiZlx1NTMzYSIsInN0YXRpb24iOiJcdTY1YjBcdTViYmYifQ'  # idが数値
+])
+def test_invalid_next_token_is_rejected(api, token):
+    if token is None:
+        token = get_page(api, ward='渋谷区')[1]['nextToken']
+
+    status, body = get_page(api, ward='新宿区', nextToken=token)
+
+    assert status == 400
+    assert 'nextToken' in body['message']
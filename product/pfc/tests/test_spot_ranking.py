@@ -0,0 +1,24 @@
+from spot_ranking import rank_spots
+
+
+def make_spot(spot_id, vehicle_types, distance=100, daily=100):
+    return {
+        'id': spot_id,
+        'distance': distance,
+        'capacity': {'total': 50, 'available': 20},
+        'fees': {'daily': daily, 'freeTime': 60},
+        'vehicleTypes': vehicle_types
+    }
+
+
+def test_vehicle_choice_changes_order():
+    # 自転車のみの駐輪場の方が近く安いが、車種が合う駐輪場を優先する
+    spots = [
+        make_spot('bicycle-only', ['自転車'], distance=50, daily=0),
+        make_spot('moped', ['自転車', '原付'], distance=150, daily=200),
+        make_spot('far', ['自転車'], distance=400, daily=300)
+    ]
+
+    assert [spot['id'] for spot in rank_spots(spots, 'vehicle', vehicle_type='原付')][:2] == ['moped', 'bicycle-only']
+    assert [spot['id'] for spot in rank_spots(spots, 'vehicle', vehicle_type='自転車')][:2] == ['bicycle-only', 'moped']
+    assert [spot['id'] for spot in rank_spots(spots, 'vehicle')][0] == 'bicycle-only'